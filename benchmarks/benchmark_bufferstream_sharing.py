@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Runs the same synthetic workload once per bufferstream sharing mode, reporting the number of bufferstreams
+(each one is a video decoded downstream) and its reduction from the exact mode, along with the events/sec.
+Use fewer publishers than queries to get the realistic mix of many subscribers querying the same publishers.
+
+    $ python -m benchmarks.benchmark_bufferstream_sharing --publishers 100 --workers 50 --queries 5000
+"""
+import argparse
+
+from client_manager.bufferstreams import BUFFER_STREAM_SHARING_EXACT, BUFFER_STREAM_SHARING_MODES
+
+from benchmarks.benchmark_client_manager import run_benchmark
+
+
+def run_sharing_benchmark(publishers, workers, queries, churn, seed, cmd_batch_size, modes=BUFFER_STREAM_SHARING_MODES):
+    mode_results = {}
+    for mode in modes:
+        results = run_benchmark(
+            publishers=publishers, workers=workers, queries=queries, churn=churn, seed=seed,
+            cmd_batch_size=cmd_batch_size, buffer_stream_sharing=mode,
+        )
+        mode_results[mode] = {
+            'bufferstreams': results['state_sizes']['bufferstreams'],
+            'queries': results['state_sizes']['queries'],
+            'events_per_second': results['events_per_second'],
+        }
+    return mode_results
+
+
+def format_sharing_results(mode_results):
+    lines = [f'{"mode":<12}{"queries":>10}{"bufferstreams":>16}{"reduction":>12}{"events/sec":>14}']
+    exact_bufferstreams = mode_results.get(BUFFER_STREAM_SHARING_EXACT, {}).get('bufferstreams')
+    for mode, summary in mode_results.items():
+        reduction = ''
+        if exact_bufferstreams:
+            reduction = f'{(1 - summary["bufferstreams"] / exact_bufferstreams) * 100:.1f}%'
+        lines.append(
+            f'{mode:<12}{summary["queries"]:>10}{summary["bufferstreams"]:>16}{reduction:>12}'
+            f'{summary["events_per_second"]:>14.1f}'
+        )
+    return '\n'.join(lines)
+
+
+def get_arg_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--publishers', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--churn', type=float, default=0.2, help='fraction of entities affected by each churn action')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cmd-batch-size', type=int, default=100)
+    return parser
+
+
+def main():
+    args = get_arg_parser().parse_args()
+    mode_results = run_sharing_benchmark(
+        publishers=args.publishers,
+        workers=args.workers,
+        queries=args.queries,
+        churn=args.churn,
+        seed=args.seed,
+        cmd_batch_size=args.cmd_batch_size,
+    )
+    print(format_sharing_results(mode_results))
+
+
+if __name__ == '__main__':
+    main()
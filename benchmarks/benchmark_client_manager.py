@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+Drives a ClientManager over in-memory streams with a synthetic workload, reporting the processed events/sec,
+the latency per event type and the peak memory, and saving the results as json to compare runs across commits.
+
+    $ python -m benchmarks.benchmark_client_manager --publishers 1000 --workers 200 --queries 5000
+    $ python -m benchmarks.compare_results benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+import argparse
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from client_manager.bufferstreams import BUFFER_STREAM_SHARING_EXACT, BUFFER_STREAM_SHARING_MODES
+from client_manager.in_memory_streams import InMemoryStreamFactory
+
+from benchmarks.workload import SyntheticWorkload, create_service
+
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCHMARKS_DIR)
+DEFAULT_RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT, stderr=subprocess.DEVNULL
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux, but in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss / 1024 / 1024
+    return max_rss / 1024
+
+
+def drain_cmd_events(service):
+    cmd_stream = service.service_cmd
+    while cmd_stream.pending_events_count() > 0:
+        service.process_cmd()
+
+
+def run_benchmark(publishers, workers, queries, churn, seed, cmd_batch_size, trace_memory=False, **service_kwargs):
+    stream_factory = InMemoryStreamFactory()
+    service = create_service(stream_factory=stream_factory, cmd_batch_size=cmd_batch_size, **service_kwargs)
+    workload = SyntheticWorkload(publishers=publishers, workers=workers, queries=queries, churn=churn, seed=seed)
+    total_events = workload.write_events(stream_factory)
+
+    if service.parse_executor is not None:
+        service.parse_executor.start()
+    if trace_memory:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    try:
+        drain_cmd_events(service)
+        duration = time.perf_counter() - start_time
+    finally:
+        if service.parse_executor is not None:
+            service.parse_executor.shutdown()
+    traced_peak_mb = None
+    if trace_memory:
+        traced_peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+
+    return {
+        'benchmark': 'client_manager',
+        'git_commit': get_git_commit(),
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python_version': sys.version.split()[0],
+        'params': {
+            'publishers': publishers,
+            'workers': workers,
+            'queries': queries,
+            'churn': churn,
+            'seed': seed,
+            'cmd_batch_size': cmd_batch_size,
+            'trace_memory': trace_memory,
+            **service_kwargs,
+        },
+        'events': total_events,
+        'duration_seconds': duration,
+        'events_per_second': total_events / duration if duration else None,
+        'event_types': {
+            event_type: {
+                'count': metrics.count,
+                'errors': metrics.errors,
+                'duplicates': metrics.duplicates,
+                'latency_mean': metrics.latency.mean(),
+                'latency_p50': metrics.latency.percentile(50),
+                'latency_p99': metrics.latency.percentile(99),
+                'latency_max': metrics.latency.max,
+            }
+            for event_type, metrics in service.event_type_metrics.items() if metrics.count
+        },
+        'publish_latency_mean': service.publish_latency.mean(),
+        'parsed_query_cache': service.parsed_query_cache.stats(),
+        'state_sizes': service.get_state_sizes(),
+        'peak_rss_mb': get_peak_rss_mb(),
+        'traced_peak_mb': traced_peak_mb,
+    }
+
+
+def format_results(results):
+    lines = [
+        f'{results["events"]} events in {results["duration_seconds"]:.2f}s: '
+        f'{results["events_per_second"]:.1f} events/sec',
+        f'peak rss: {results["peak_rss_mb"]:.1f} MB',
+    ]
+    if results['traced_peak_mb'] is not None:
+        lines.append(f'peak traced memory: {results["traced_peak_mb"]:.1f} MB')
+    lines.append(f'{"event type":<24}{"count":>8}{"errors":>8}{"mean ms":>10}{"p50 ms":>10}{"p99 ms":>10}')
+    for event_type, summary in sorted(results['event_types'].items()):
+        lines.append(
+            f'{event_type:<24}{summary["count"]:>8}{summary["errors"]:>8}'
+            f'{summary["latency_mean"] * 1000:>10.3f}{summary["latency_p50"] * 1000:>10.3f}'
+            f'{summary["latency_p99"] * 1000:>10.3f}'
+        )
+    lines.append(f'state sizes: {results["state_sizes"]}')
+    return '\n'.join(lines)
+
+
+def save_results(results, output_path=None):
+    if output_path is None:
+        timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        file_name = f'{results["benchmark"]}-{results["git_commit"] or "unknown"}-{timestamp}.json'
+        output_path = os.path.join(DEFAULT_RESULTS_DIR, file_name)
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return output_path
+
+
+def get_arg_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--publishers', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--churn', type=float, default=0.2, help='fraction of entities affected by each churn action')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cmd-batch-size', type=int, default=100)
+    parser.add_argument('--parse-executor-workers', type=int, default=0,
+                        help='number of processes parsing the queries in parallel (0 parses them inline)')
+    parser.add_argument('--buffer-stream-sharing', default=BUFFER_STREAM_SHARING_EXACT,
+                        choices=BUFFER_STREAM_SHARING_MODES, help='how queries share bufferstreams')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also report the peak python memory using tracemalloc (slows down the run)')
+    parser.add_argument('--output', help=f'results json path, defaults to a new file in {DEFAULT_RESULTS_DIR}')
+    return parser
+
+
+def main():
+    args = get_arg_parser().parse_args()
+    results = run_benchmark(
+        publishers=args.publishers,
+        workers=args.workers,
+        queries=args.queries,
+        churn=args.churn,
+        seed=args.seed,
+        cmd_batch_size=args.cmd_batch_size,
+        trace_memory=args.trace_memory,
+        parse_executor_workers=args.parse_executor_workers,
+        buffer_stream_sharing=args.buffer_stream_sharing,
+    )
+    print(format_results(results))
+    print(f'results saved to: {save_results(results, args.output)}')
+
+
+if __name__ == '__main__':
+    main()
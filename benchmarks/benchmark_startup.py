@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Measures the startup time of the service, as autoscaled containers are only useful once ready: each run is a new
+python process importing `client_manager.run` (import) and then creating and starting the service over in-memory
+streams (ready, measured from before the import), reporting the min/median/max of the runs.
+
+    $ python -m benchmarks.benchmark_startup --repeat 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCHMARKS_DIR)
+
+STARTUP_METRICS = ['import_seconds', 'ready_seconds', 'process_seconds']
+# settings that need a redis server on startup, disabled as the service runs over in-memory streams
+REDIS_ONLY_ENV_VARS = ['STATE_SNAPSHOT_REDIS_KEY', 'QUERY_CATALOG_KEY_PREFIX', 'SHARD_ID']
+
+
+def measure_startup():
+    start_time = time.perf_counter()
+    from client_manager import run
+    import_time = time.perf_counter()
+
+    from client_manager.in_memory_streams import InMemoryStreamFactory
+    service = run.create_service(InMemoryStreamFactory())
+    service.start()
+    ready_time = time.perf_counter()
+    service.stop()
+    return {
+        'import_seconds': import_time - start_time,
+        'ready_seconds': ready_time - start_time,
+    }
+
+
+def measure_startup_process(env):
+    start_time = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.benchmark_startup', '--child'], cwd=PROJECT_ROOT, env=env)
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    # includes the python interpreter startup
+    result['process_seconds'] = time.perf_counter() - start_time
+    return result
+
+
+def run_startup_benchmark(repeat=5):
+    env = os.environ.copy()
+    env.update({env_var: '' for env_var in REDIS_ONLY_ENV_VARS})
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [PROJECT_ROOT, env.get('PYTHONPATH')]))
+
+    runs = [measure_startup_process(env) for _ in range(repeat)]
+    return {
+        'runs': len(runs),
+        'startup': {
+            metric: {
+                'min': min(run[metric] for run in runs),
+                'median': statistics.median(run[metric] for run in runs),
+                'max': max(run[metric] for run in runs),
+            }
+            for metric in STARTUP_METRICS
+        },
+    }
+
+
+def format_startup_results(results):
+    lines = [
+        f'runs: {results["runs"]}',
+        f'{"metric":<18}{"min ms":>10}{"median ms":>12}{"max ms":>10}',
+    ]
+    for metric, summary in results['startup'].items():
+        lines.append(
+            f'{metric:<18}{summary["min"] * 1000:>10.1f}{summary["median"] * 1000:>12.1f}{summary["max"] * 1000:>10.1f}'
+        )
+    return '\n'.join(lines)
+
+
+def get_arg_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='number of processes started')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = get_arg_parser().parse_args()
+    if args.child:
+        print(json.dumps(measure_startup()))
+        return
+    results = run_startup_benchmark(repeat=args.repeat)
+    print(format_startup_results(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Compares two benchmark results json files, eg: from runs on different commits.
+
+    $ python -m benchmarks.compare_results benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+import argparse
+import json
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def format_change(old_value, new_value):
+    if old_value is None or new_value is None:
+        return ''
+    if old_value == 0:
+        return ''
+    return f'{(new_value - old_value) / old_value * 100:+.1f}%'
+
+
+def compare_results(old_results, new_results):
+    rows = []
+    for key in ['events_per_second', 'duration_seconds', 'peak_rss_mb', 'traced_peak_mb', 'publish_latency_mean']:
+        rows.append((key, old_results.get(key), new_results.get(key)))
+
+    event_types = sorted(set(old_results['event_types']) | set(new_results['event_types']))
+    for event_type in event_types:
+        old_summary = old_results['event_types'].get(event_type, {})
+        new_summary = new_results['event_types'].get(event_type, {})
+        for key in ['latency_mean', 'latency_p50', 'latency_p99']:
+            rows.append((f'{event_type}.{key}', old_summary.get(key), new_summary.get(key)))
+    return rows
+
+
+def format_value(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f'{value:.6g}'
+    return str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+
+    old_results = load_results(args.old)
+    new_results = load_results(args.new)
+    if old_results['params'] != new_results['params']:
+        print(f'Warning: comparing runs with different params:\n{old_results["params"]}\n{new_results["params"]}')
+
+    print(f'{"":<44}{old_results["git_commit"] or "old":>14}{new_results["git_commit"] or "new":>14}{"change":>10}')
+    for name, old_value, new_value in compare_results(old_results, new_results):
+        print(f'{name:<44}{format_value(old_value):>14}{format_value(new_value):>14}'
+              f'{format_change(old_value, new_value):>10}')
+
+
+if __name__ == '__main__':
+    main()
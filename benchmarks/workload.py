@@ -0,0 +1,202 @@
+import json
+import random
+import uuid
+
+from client_manager.in_memory_streams import InMemoryStreamFactory
+from client_manager.service import ClientManager
+from client_manager.service_registry import ServiceRegistry
+
+
+SERVICE_STREAM_KEY = 'cm-data'
+SERVICE_CMD_KEY_LIST = [
+    'PublisherCreated',
+    'PublisherUpdated',
+    'PublisherRemoved',
+    'QueryReceived',
+    'QueryBulkReceived',
+    'QueryDeletionRequested',
+    'SubscriberQueriesDeletionRequested',
+    'QueryLookupRequested',
+    'ServiceWorkerAnnounced',
+    'ServiceWorkerRemoved',
+    'ClientManagerShardJoined',
+    'ClientManagerShardLeft',
+    'ClientManagerShardStateHandedOver',
+]
+PUB_EVENT_LIST = [
+    'QueryCreated',
+    'QueryRemoved',
+    'QueryBulkProcessed',
+    'QueryLookupResponded',
+    'ClientManagerShardJoined',
+    'ClientManagerShardLeft',
+    'ClientManagerShardStateHandedOver',
+]
+
+SERVICE_TYPES = ['ObjectDetection', 'ColorDetection', 'PersonDetection', 'CarDetection', 'FaceDetection']
+RESOLUTIONS = ['640x480', '1280x720', '1920x1080']
+FPS = ['5', '10', '15', '30']
+MATCH_CLAUSES = [
+    "MATCH (c1:Car {color:'blue'}), (c2:Car {color:'white'})",
+    "MATCH (p:Person)",
+    "MATCH (p:Person)-[r:near]->(c:Car)",
+    "MATCH (d:Dog {color:'brown'})",
+]
+WINDOWS = ['TUMBLING_COUNT_WINDOW(2)', 'TUMBLING_COUNT_WINDOW(5)', 'TUMBLING_TIME_WINDOW(10)']
+QOS_POLICIES = ['accuracy', 'latency', 'energy_consumption']
+
+QUERY_TEXT_TEMPLATE = """
+REGISTER QUERY {name}
+OUTPUT K_GRAPH_JSON
+CONTENT {content}
+{match}
+FROM {publisher_id}
+WITHIN {window}{qos}
+RETURN *
+""".strip()
+
+
+def new_msg(event_data):
+    event_data.update({'id': str(uuid.uuid4())})
+    return {'event': json.dumps(event_data)}
+
+
+def create_service(stream_factory=None, service_registry=None, **kwargs):
+    if stream_factory is None:
+        stream_factory = InMemoryStreamFactory()
+    if service_registry is None:
+        service_registry = ServiceRegistry()
+    service = ClientManager(
+        service_stream_key=SERVICE_STREAM_KEY,
+        service_cmd_key_list=SERVICE_CMD_KEY_LIST,
+        pub_event_list=PUB_EVENT_LIST,
+        service_details=None,
+        stream_factory=stream_factory,
+        service_registry=service_registry,
+        logging_level='ERROR',
+        tracer_configs={'reporting_host': None, 'reporting_port': None},
+        **kwargs
+    )
+    return service
+
+
+class SyntheticWorkload():
+    """
+    Generates a reproducible (seeded) sequence of events with churn:
+    publishers and service workers joining, queries arriving (some before their publisher),
+    duplicated query submissions, worker heartbeats, query deletions and publishers leaving and rejoining.
+    """
+
+    def __init__(self, publishers=1000, workers=200, queries=5000, churn=0.2, seed=42):
+        self.num_publishers = publishers
+        self.num_workers = workers
+        self.num_queries = queries
+        self.churn = churn
+        self.random = random.Random(seed)
+
+    def publisher_created(self, publisher_id):
+        return ('PublisherCreated', {
+            'publisher_id': publisher_id,
+            'source': f'rtmp://172.17.0.1/hls/{publisher_id}',
+            'meta': {
+                'resolution': self.random.choice(RESOLUTIONS),
+                'fps': self.random.choice(FPS),
+            }
+        })
+
+    def worker_announced(self, worker_index):
+        return ('ServiceWorkerAnnounced', {
+            'worker': {
+                'service_type': SERVICE_TYPES[worker_index % len(SERVICE_TYPES)],
+                'stream_key': f'worker-{worker_index}',
+                'queue_limit': 100,
+                'throughput': self.random.randint(1, 30),
+                'accuracy': round(self.random.random(), 2),
+                'energy_consumption': self.random.randint(10, 100),
+            }
+        })
+
+    def query_text(self, query_name, publisher_id):
+        content = self.random.sample(SERVICE_TYPES, self.random.randint(1, 3))
+        qos = ''
+        if self.random.random() < 0.5:
+            qos = '\nWITH_QOS ' + ', '.join(
+                f'{policy} = {self.random.randint(1, 10)}' for policy in QOS_POLICIES
+            )
+        return QUERY_TEXT_TEMPLATE.format(
+            name=query_name,
+            content=', '.join(content),
+            match=self.random.choice(MATCH_CLAUSES),
+            publisher_id=publisher_id,
+            window=self.random.choice(WINDOWS),
+            qos=qos,
+        )
+
+    def query_received(self, subscriber_id, query_text):
+        return ('QueryReceived', {'subscriber_id': subscriber_id, 'query': query_text})
+
+    def generate_events(self):
+        publisher_ids = [f'publisher_{i}' for i in range(self.num_publishers)]
+        # some publishers only join after their queries were received, leaving them pending for a while
+        late_publisher_ids = self.random.sample(publisher_ids, int(len(publisher_ids) * self.churn))
+        late_publisher_id_set = set(late_publisher_ids)
+
+        events = []
+        for worker_index in range(self.num_workers):
+            events.append(self.worker_announced(worker_index))
+        for publisher_id in publisher_ids:
+            if publisher_id not in late_publisher_id_set:
+                events.append(self.publisher_created(publisher_id))
+
+        queries = []
+        for query_index in range(self.num_queries):
+            subscriber_id = f'subscriber_{query_index % max(1, self.num_queries // 5)}'
+            query_name = f'query_{query_index}'
+            query_text = self.query_text(query_name, self.random.choice(publisher_ids))
+            queries.append((subscriber_id, query_name, query_text))
+            events.append(self.query_received(subscriber_id, query_text))
+
+        # groups of events that must keep their order, shuffled between each other
+        churn_event_groups = []
+        for publisher_id in late_publisher_ids:
+            churn_event_groups.append([self.publisher_created(publisher_id)])
+        for subscriber_id, query_name, query_text in self.random.sample(queries, int(len(queries) * self.churn)):
+            # subscribers re-sending the same queries, eg: after reconnecting
+            churn_event_groups.append([self.query_received(subscriber_id, query_text)])
+        for subscriber_id, query_name, query_text in self.random.sample(queries, int(len(queries) * self.churn)):
+            churn_event_groups.append([
+                ('QueryDeletionRequested', {'subscriber_id': subscriber_id, 'query_name': query_name})
+            ])
+        for worker_index in self.random.sample(range(self.num_workers), int(self.num_workers * self.churn)):
+            # heartbeats, sometimes with updated metrics
+            churn_event_groups.append([self.worker_announced(worker_index)])
+        for worker_index in self.random.sample(range(self.num_workers), int(self.num_workers * self.churn / 2)):
+            churn_event_groups.append([
+                ('ServiceWorkerRemoved', {'worker': {'stream_key': f'worker-{worker_index}'}})
+            ])
+        for publisher_id in self.random.sample(publisher_ids, int(len(publisher_ids) * self.churn / 2)):
+            churn_event_groups.append([
+                ('PublisherRemoved', {'publisher_id': publisher_id}),
+                self.publisher_created(publisher_id),
+            ])
+        for publisher_id in self.random.sample(publisher_ids, int(len(publisher_ids) * self.churn / 2)):
+            # cameras adapting their fps
+            churn_event_groups.append([
+                ('PublisherUpdated', {'publisher_id': publisher_id, 'meta': {'fps': self.random.choice(FPS)}})
+            ])
+        self.random.shuffle(churn_event_groups)
+
+        for event_group in churn_event_groups:
+            events.extend(event_group)
+        return events
+
+    def write_events(self, stream_factory, events=None):
+        if events is None:
+            events = self.generate_events()
+        streams = {}
+        for event_type, event_data in events:
+            stream = streams.get(event_type)
+            if stream is None:
+                stream = streams[event_type] = stream_factory.create(event_type, stype='streamOnly')
+            stream.write_events(new_msg(event_data))
+        return len(events)
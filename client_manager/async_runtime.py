@@ -0,0 +1,162 @@
+import asyncio
+import time
+
+from client_manager.batching import add_event_to_pipeline, write_events_pipelined
+
+
+class AsyncRedisCmdReader():
+    """
+    Reads the service cmd events from its (already created) consumer group using an async redis client
+    (`redis.asyncio.Redis`), returning them in the same format as the sync consumer group.
+    """
+
+    def __init__(self, redis_client, cg_id, keys, block_ms=1000, consumer=None):
+        self.redis_client = redis_client
+        self.cg_id = cg_id
+        self.streams = {key: '>' for key in keys}
+        self.block_ms = block_ms
+        # same consumer name used by the sync (walrus) consumer group
+        self.consumer = consumer or f'{cg_id}.c1'
+
+    @classmethod
+    def from_service(cls, service, redis_client, cg_sub_group='default', **kwargs):
+        return cls(
+            redis_client,
+            cg_id=service._get_cg_sub_group_id(cg_sub_group),
+            keys=service.service_cmd_cg_keys_map[cg_sub_group],
+            **kwargs
+        )
+
+    async def read_stream_events_list(self, count=1):
+        return await self.redis_client.xreadgroup(
+            self.cg_id, self.consumer, self.streams, count=count, block=self.block_ms)
+
+
+class AsyncRedisEventWriter():
+    """
+    Writes a list of (stream, event_msg) tuples in a single pipeline (atomic if `transaction`),
+    keeping their order.
+    """
+
+    def __init__(self, redis_client, transaction=False):
+        self.redis_client = redis_client
+        self.transaction = transaction
+
+    async def write_events(self, stream_event_msg_list):
+        pipeline = self.redis_client.pipeline(transaction=self.transaction)
+        for stream, event_msg in stream_event_msg_list:
+            add_event_to_pipeline(pipeline, stream, event_msg)
+        return await pipeline.execute()
+
+
+class StreamCmdReaderAdapter():
+    """
+    Async reader over a sync non-blocking consumer group (eg: the in-memory streams),
+    yielding to the event loop for `idle_seconds` when there are no events to read.
+    """
+
+    def __init__(self, cmd_stream, idle_seconds=0.01):
+        self.cmd_stream = cmd_stream
+        self.idle_seconds = idle_seconds
+
+    async def read_stream_events_list(self, count=1):
+        stream_event_list = self.cmd_stream.read_stream_events_list(count=count)
+        if not stream_event_list:
+            await asyncio.sleep(self.idle_seconds)
+        return stream_event_list
+
+
+class StreamEventWriterAdapter():
+    """Async writer over the sync streams (eg: the in-memory streams)."""
+
+    async def write_events(self, stream_event_msg_list):
+        return write_events_pipelined(stream_event_msg_list)
+
+
+class AsyncServiceRuntime():
+    """
+    Runs the service cmd loop on asyncio, reading the next batch of events while the events published by the
+    previous batches are being written. The events are processed by the same (sync) service methods, one batch
+    at a time and in order, and their published events are written in the same order by a single writer task.
+    At most `max_in_flight_publishes` batches of published events wait to be written, after that reading
+    waits for the writer to catch up (backpressure).
+    """
+
+    def __init__(self, service, cmd_reader, event_writer, max_in_flight_publishes=8):
+        self.service = service
+        self.cmd_reader = cmd_reader
+        self.event_writer = event_writer
+        self.max_in_flight_publishes = max_in_flight_publishes
+        self.publish_queue = None
+        self.stopping = False
+
+    def stop(self):
+        self.stopping = True
+
+    async def read_loop(self):
+        try:
+            while not self.stopping:
+                await self.read_and_process_cmd_events()
+        finally:
+            await self.publish_queue.put(None)
+
+    async def read_and_process_cmd_events(self):
+        stream_event_list = await self.cmd_reader.read_stream_events_list(count=self.service.cmd_batch_size)
+        cmd_events = self.service.get_cmd_events(stream_event_list or [])
+        if not cmd_events:
+            await self.process_and_queue_pub_events(self.service.process_idle)
+            return
+
+        self.service.sort_cmd_events(cmd_events)
+        await self.process_and_queue_pub_events(self.service.process_cmd_events, cmd_events)
+
+    async def process_and_queue_pub_events(self, process, *args):
+        pub_events = self.service.pub_events_sink = []
+        try:
+            process(*args)
+        finally:
+            self.service.pub_events_sink = None
+            # a snapshot taken by the batch is saved by the writer, after the events published before it are written
+            state_snapshot = self.service.pending_state_snapshot
+            self.service.pending_state_snapshot = None
+        if pub_events or state_snapshot is not None:
+            await self.publish_queue.put((pub_events, state_snapshot))
+
+    async def publish_loop(self):
+        while True:
+            queued = await self.publish_queue.get()
+            if queued is None:
+                return
+            pub_events, state_snapshot = queued
+            if pub_events:
+                await self.write_pub_events(pub_events)
+            if state_snapshot is not None:
+                self.service.save_pending_state_snapshot(state_snapshot)
+
+    async def write_pub_events(self, pub_events):
+        start_time = time.perf_counter()
+        try:
+            await self.event_writer.write_events(pub_events)
+        except Exception:
+            # like on the sync runtime, the state is no longer snapshotted as processed
+            self.service.pub_events_write_failed = True
+            raise
+        self.service.publish_latency.observe(time.perf_counter() - start_time)
+
+    async def run(self):
+        self.publish_queue = asyncio.Queue(maxsize=self.max_in_flight_publishes)
+        self.service.start()
+        read_task = asyncio.ensure_future(self.read_loop())
+        publish_task = asyncio.ensure_future(self.publish_loop())
+        try:
+            await asyncio.wait([read_task, publish_task], return_when=asyncio.FIRST_EXCEPTION)
+            if not publish_task.done():
+                # reading stopped (or failed), writes the events of the already processed batches before stopping
+                await publish_task
+            # a failed write stops the reading, like it does on the sync runtime
+            publish_task.result()
+            read_task.result()
+        finally:
+            read_task.cancel()
+            publish_task.cancel()
+            self.service.stop()
@@ -0,0 +1,56 @@
+import itertools
+
+
+def stream_event_id_sort_key(event_id):
+    # redis stream ids are "<milliseconds>-<sequence>", anything else keeps the read order.
+    if isinstance(event_id, bytes):
+        event_id = event_id.decode('utf-8')
+    ms, _, seq = str(event_id).partition('-')
+    try:
+        return (int(ms), int(seq or 0))
+    except ValueError:
+        return (0, 0)
+
+
+def get_shared_redis_db(streams):
+    redis_db = None
+    for stream in streams:
+        stream_redis_db = getattr(stream, 'redis_db', None)
+        if stream_redis_db is None:
+            return None
+        if redis_db is None:
+            redis_db = stream_redis_db
+        elif redis_db is not stream_redis_db:
+            return None
+    return redis_db
+
+
+def add_event_to_pipeline(pipeline, stream, event_msg):
+    # non stream writers (eg: the query catalog) add their own commands to the pipeline
+    if hasattr(type(stream), 'add_to_pipeline'):
+        return stream.add_to_pipeline(pipeline, event_msg)
+    write_kwargs = getattr(stream, 'default_write_kwargs', {})
+    return pipeline.xadd(stream.key, event_msg, **write_kwargs)
+
+
+def write_events_pipelined(stream_event_msg_list, transaction=False):
+    """
+    Writes a list of (stream, event_msg) tuples, keeping their order.
+    If all streams are redis streams on the same db this is done in a single pipeline (one round trip,
+    and atomic if `transaction`), otherwise it falls back to one write_events call for each consecutive
+    group of events of the same stream.
+    """
+    if not stream_event_msg_list:
+        return []
+
+    redis_db = get_shared_redis_db(stream for stream, _ in stream_event_msg_list)
+    if redis_db is not None:
+        pipeline = redis_db.pipeline(transaction=transaction)
+        for stream, event_msg in stream_event_msg_list:
+            add_event_to_pipeline(pipeline, stream, event_msg)
+        return pipeline.execute()
+
+    results = []
+    for stream, group in itertools.groupby(stream_event_msg_list, key=lambda stream_msg: stream_msg[0]):
+        results.extend(stream.write_events(*[event_msg for _, event_msg in group]))
+    return results
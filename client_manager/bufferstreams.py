@@ -0,0 +1,93 @@
+from client_manager.indexes import ManyToOneIndex
+from client_manager.tracking import TrackedDict
+
+
+class BufferStreamIndex(ManyToOneIndex):
+    """
+    Two-way index between buffer stream keys and the queries using them.
+
+    Keeps the buffer_stream_key -> set(query_id) map used by the rest of the system
+    next to a query_id -> buffer_stream_key reverse map, so that adding and removing
+    a query are both O(1).
+    """
+
+    def __init__(self):
+        super(BufferStreamIndex, self).__init__()
+        self.key_to_items_map = TrackedDict()
+        self.buffer_hash_to_query_map = self.key_to_items_map
+        self.query_to_buffer_hash_map = self.item_to_key_map
+
+    def get_buffer_stream_key(self, query_id):
+        return self.get_key(query_id)
+
+    def get_query_ids(self, buffer_stream_key):
+        return self.get_items(buffer_stream_key)
+
+
+# exact: one bufferstream per query content, as is (same bufferstreams as the previous versions, default).
+# canonical: the bufferstream key is hashed from the sorted and deduplicated content types, so queries with the
+# same content types in any order share it (each one keeping its declared order for its service chain).
+# superset: canonical, and queries join an existing bufferstream of their publisher with all their content types.
+BUFFER_STREAM_SHARING_EXACT = 'exact'
+BUFFER_STREAM_SHARING_CANONICAL = 'canonical'
+BUFFER_STREAM_SHARING_SUPERSET = 'superset'
+BUFFER_STREAM_SHARING_MODES = (
+    BUFFER_STREAM_SHARING_EXACT, BUFFER_STREAM_SHARING_CANONICAL, BUFFER_STREAM_SHARING_SUPERSET,
+)
+
+
+def canonical_content(query_content):
+    return tuple(sorted(set(query_content)))
+
+
+class BufferStreamPlanner():
+    """
+    Decides the content types of the bufferstream used by a query, in the order used for its service chain,
+    and the content hashed into its bufferstream key.
+
+    On the superset mode a query joins the smallest existing bufferstream (of the same publisher) having all of
+    its content types, so it doesn't decode the same video again, and its chain follows the order of the query
+    that created it. Otherwise it gets a new bufferstream with its own content types.
+    Existing bufferstreams are never merged or grown, so no registered query changes.
+    """
+
+    def __init__(self, mode=BUFFER_STREAM_SHARING_EXACT):
+        if mode not in BUFFER_STREAM_SHARING_MODES:
+            raise ValueError(
+                f'Unknown bufferstream sharing mode: {mode}. Available modes: {BUFFER_STREAM_SHARING_MODES}')
+        self.mode = mode
+
+    @property
+    def shares_buffer_streams(self):
+        return self.mode != BUFFER_STREAM_SHARING_EXACT
+
+    def plan_content(self, query_content, buffer_stream_contents=()):
+        """
+        Returns the bufferstream content for the query content, given the contents of the existing bufferstreams
+        of its publisher (only used, and so only iterated, on the superset mode).
+        """
+        if self.mode == BUFFER_STREAM_SHARING_EXACT:
+            return tuple(query_content)
+
+        # deduplicated, keeping the declared order
+        content = tuple(dict.fromkeys(query_content))
+        if self.mode == BUFFER_STREAM_SHARING_SUPERSET:
+            content_set = set(content)
+            superset_contents = [
+                buffer_stream_content for buffer_stream_content in buffer_stream_contents
+                if buffer_stream_content is not None and content_set.issubset(buffer_stream_content)
+            ]
+            if superset_contents:
+                superset_content = min(
+                    superset_contents,
+                    key=lambda superset_content: (len(superset_content), canonical_content(superset_content)))
+                # a bufferstream with the same content types is shared, but the query keeps its own chain order
+                if len(superset_content) > len(content):
+                    return tuple(superset_content)
+        return content
+
+    def get_key_content(self, buffer_stream_content):
+        """Content hashed into the bufferstream key, which doesn't depend on its order when sharing bufferstreams."""
+        if self.mode == BUFFER_STREAM_SHARING_EXACT:
+            return tuple(buffer_stream_content)
+        return canonical_content(buffer_stream_content)
@@ -0,0 +1,143 @@
+import json
+from collections import namedtuple
+
+from client_manager.records import record_to_dict
+
+
+QueryCatalogUpdate = namedtuple(
+    'QueryCatalogUpdate', ['set_queries', 'del_query_ids', 'set_buffer_streams', 'del_buffer_stream_keys']
+)
+
+
+def empty_update():
+    return QueryCatalogUpdate(set_queries={}, del_query_ids=[], set_buffer_streams={}, del_buffer_stream_keys=[])
+
+
+def decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class RedisQueryCatalog():
+    """
+    Read-only (for other services) catalog of the current queries, with their bufferstream and service chain,
+    and of the bufferstreams, with their query ids, kept in redis hashes (as json) next to a version counter.
+    Other services can then cold-start from a single bulk read (`read`) instead of replaying the
+    QueryCreated/QueryRemoved events.
+
+    The catalog changes are collected while the events are processed and written as one update (`pop_update`)
+    in the same pipeline as the published events, so it's updated together with them.
+    """
+
+    def __init__(self, redis_db, key_prefix):
+        self.redis_db = redis_db
+        self.key_prefix = key_prefix
+        self.queries_key = f'{key_prefix}:queries'
+        self.buffer_streams_key = f'{key_prefix}:bufferstreams'
+        self.version_key = f'{key_prefix}:version'
+        # query_id -> query, or None if it was removed
+        self.changed_queries = {}
+        # buffer_stream_key -> publisher_id
+        self.changed_buffer_stream_keys = {}
+
+    def _mark_buffer_stream_changed(self, query):
+        buffer_stream = query['buffer_stream']
+        self.changed_buffer_stream_keys[buffer_stream['buffer_stream_key']] = buffer_stream['publisher_id']
+
+    def set_query(self, query):
+        self.changed_queries[query['query_id']] = query
+        self._mark_buffer_stream_changed(query)
+
+    def remove_query(self, query):
+        self.changed_queries[query['query_id']] = None
+        self._mark_buffer_stream_changed(query)
+
+    def pop_update(self, get_buffer_stream_dict, owns_publisher_id=None):
+        """
+        Returns the update with the changes since the last call (None if nothing changed), using the current
+        state of the changed queries, and of the changed bufferstreams from `get_buffer_stream_dict(key)`
+        (None if it was removed). Bufferstreams of publishers no longer owned (eg: handed over to another shard)
+        are left to their new owner.
+        """
+        if not self.changed_queries and not self.changed_buffer_stream_keys:
+            return None
+
+        update = empty_update()
+        for query_id, query in self.changed_queries.items():
+            if query is None:
+                update.del_query_ids.append(query_id)
+            else:
+                update.set_queries[query_id] = json.dumps(record_to_dict(query))
+        for buffer_stream_key, publisher_id in self.changed_buffer_stream_keys.items():
+            if owns_publisher_id is not None and not owns_publisher_id(publisher_id):
+                continue
+            buffer_stream_dict = get_buffer_stream_dict(buffer_stream_key)
+            if buffer_stream_dict is None:
+                update.del_buffer_stream_keys.append(buffer_stream_key)
+            else:
+                update.set_buffer_streams[buffer_stream_key] = json.dumps(buffer_stream_dict)
+        self.changed_queries = {}
+        self.changed_buffer_stream_keys = {}
+        return update
+
+    def add_to_pipeline(self, pipeline, update):
+        if update.del_query_ids:
+            pipeline.hdel(self.queries_key, *update.del_query_ids)
+        if update.set_queries:
+            pipeline.hset(self.queries_key, mapping=update.set_queries)
+        if update.del_buffer_stream_keys:
+            pipeline.hdel(self.buffer_streams_key, *update.del_buffer_stream_keys)
+        if update.set_buffer_streams:
+            pipeline.hset(self.buffer_streams_key, mapping=update.set_buffer_streams)
+        pipeline.incr(self.version_key)
+
+    def write_events(self, *updates):
+        # same interface as the streams, so the updates can be written along with the published events
+        pipeline = self.redis_db.pipeline(transaction=True)
+        for update in updates:
+            self.add_to_pipeline(pipeline, update)
+        return pipeline.execute()
+
+    def rebuild(self, update, owns_publisher_id):
+        """
+        Writes a full update of the service state (eg: after starting), also removing the entries of the
+        publishers it owns that are no longer in its state.
+        """
+        if update is None:
+            update = empty_update()
+        catalog = self.read()
+        update.del_query_ids.extend(
+            query_id for query_id, query in catalog['queries'].items()
+            if query_id not in update.set_queries and owns_publisher_id(query['buffer_stream']['publisher_id'])
+        )
+        update.del_buffer_stream_keys.extend(
+            buffer_stream_key for buffer_stream_key, buffer_stream in catalog['bufferstreams'].items()
+            if buffer_stream_key not in update.set_buffer_streams and owns_publisher_id(buffer_stream['publisher_id'])
+        )
+        return self.write_events(update)
+
+    def read(self, stream_keys=()):
+        """
+        Reads the whole catalog in a single transaction, along with the last event id of each of the `stream_keys`
+        (eg: QueryCreated and QueryRemoved), so that a consumer can continue reading the events after them.
+        """
+        pipeline = self.redis_db.pipeline(transaction=True)
+        pipeline.get(self.version_key)
+        pipeline.hgetall(self.queries_key)
+        pipeline.hgetall(self.buffer_streams_key)
+        for stream_key in stream_keys:
+            pipeline.xrevrange(stream_key, count=1)
+        version, queries, buffer_streams, *last_stream_events = pipeline.execute()
+        return {
+            'version': int(version or 0),
+            'queries': {decode(query_id): json.loads(query) for query_id, query in queries.items()},
+            'bufferstreams': {
+                decode(buffer_stream_key): json.loads(buffer_stream)
+                for buffer_stream_key, buffer_stream in buffer_streams.items()
+            },
+            'last_stream_ids': {
+                stream_key: decode(stream_events[0][0]) if stream_events else None
+                for stream_key, stream_events in zip(stream_keys, last_stream_events)
+            },
+        }
@@ -8,7 +8,8 @@ PROJECT_ROOT = os.path.dirname(SOURCE_DIR)
 REDIS_ADDRESS = config('REDIS_ADDRESS', default='localhost')
 REDIS_PORT = config('REDIS_PORT', default='6379')
 
-TRACER_REPORTING_HOST = config('TRACER_REPORTING_HOST', default='localhost')
+# tracing is opt-in, only enabled with a reporting host.
+TRACER_REPORTING_HOST = config('TRACER_REPORTING_HOST', default='')
 TRACER_REPORTING_PORT = config('TRACER_REPORTING_PORT', default='6831')
 
 
@@ -16,29 +17,121 @@ SERVICE_STREAM_KEY = config('SERVICE_STREAM_KEY')
 
 
 LISTEN_EVENT_TYPE_PUBLISHER_CREATED = config('LISTEN_EVENT_TYPE_PUBLISHER_CREATED')
+LISTEN_EVENT_TYPE_PUBLISHER_UPDATED = config('LISTEN_EVENT_TYPE_PUBLISHER_UPDATED', default='PublisherUpdated')
 LISTEN_EVENT_TYPE_PUBLISHER_REMOVED = config('LISTEN_EVENT_TYPE_PUBLISHER_REMOVED')
 LISTEN_EVENT_TYPE_QUERY_RECEIVED = config('LISTEN_EVENT_TYPE_QUERY_RECEIVED')
+LISTEN_EVENT_TYPE_QUERY_BULK_RECEIVED = config('LISTEN_EVENT_TYPE_QUERY_BULK_RECEIVED', default='QueryBulkReceived')
 LISTEN_EVENT_TYPE_QUERY_DELETION_REQUESTED = config('LISTEN_EVENT_TYPE_QUERY_DELETION_REQUESTED')
+LISTEN_EVENT_TYPE_SUBSCRIBER_QUERIES_DELETION_REQUESTED = config(
+    'LISTEN_EVENT_TYPE_SUBSCRIBER_QUERIES_DELETION_REQUESTED', default='SubscriberQueriesDeletionRequested')
+LISTEN_EVENT_TYPE_QUERY_LOOKUP_REQUESTED = config(
+    'LISTEN_EVENT_TYPE_QUERY_LOOKUP_REQUESTED', default='QueryLookupRequested')
 LISTEN_EVENT_TYPE_SERVICE_WORKER_ANNOUNCED = config('LISTEN_EVENT_TYPE_SERVICE_WORKER_ANNOUNCED')
+LISTEN_EVENT_TYPE_SERVICE_WORKER_REMOVED = config(
+    'LISTEN_EVENT_TYPE_SERVICE_WORKER_REMOVED', default='ServiceWorkerRemoved')
+LISTEN_EVENT_TYPE_CLIENT_MANAGER_SHARD_JOINED = config(
+    'LISTEN_EVENT_TYPE_CLIENT_MANAGER_SHARD_JOINED', default='ClientManagerShardJoined')
+LISTEN_EVENT_TYPE_CLIENT_MANAGER_SHARD_LEFT = config(
+    'LISTEN_EVENT_TYPE_CLIENT_MANAGER_SHARD_LEFT', default='ClientManagerShardLeft')
+LISTEN_EVENT_TYPE_CLIENT_MANAGER_SHARD_STATE_HANDED_OVER = config(
+    'LISTEN_EVENT_TYPE_CLIENT_MANAGER_SHARD_STATE_HANDED_OVER', default='ClientManagerShardStateHandedOver')
 
 SERVICE_CMD_KEY_LIST = [
     LISTEN_EVENT_TYPE_PUBLISHER_CREATED,
+    LISTEN_EVENT_TYPE_PUBLISHER_UPDATED,
     LISTEN_EVENT_TYPE_PUBLISHER_REMOVED,
     LISTEN_EVENT_TYPE_QUERY_RECEIVED,
+    LISTEN_EVENT_TYPE_QUERY_BULK_RECEIVED,
     LISTEN_EVENT_TYPE_QUERY_DELETION_REQUESTED,
+    LISTEN_EVENT_TYPE_SUBSCRIBER_QUERIES_DELETION_REQUESTED,
+    LISTEN_EVENT_TYPE_QUERY_LOOKUP_REQUESTED,
     LISTEN_EVENT_TYPE_SERVICE_WORKER_ANNOUNCED,
+    LISTEN_EVENT_TYPE_SERVICE_WORKER_REMOVED,
+    LISTEN_EVENT_TYPE_CLIENT_MANAGER_SHARD_JOINED,
+    LISTEN_EVENT_TYPE_CLIENT_MANAGER_SHARD_LEFT,
+    LISTEN_EVENT_TYPE_CLIENT_MANAGER_SHARD_STATE_HANDED_OVER,
 ]
 
 PUB_EVENT_TYPE_QUERY_CREATED = config('PUB_EVENT_TYPE_QUERY_CREATED')
 PUB_EVENT_TYPE_QUERY_REMOVED = config('PUB_EVENT_TYPE_QUERY_REMOVED')
+PUB_EVENT_TYPE_QUERY_BULK_PROCESSED = config('PUB_EVENT_TYPE_QUERY_BULK_PROCESSED', default='QueryBulkProcessed')
+PUB_EVENT_TYPE_QUERY_LOOKUP_RESPONDED = config(
+    'PUB_EVENT_TYPE_QUERY_LOOKUP_RESPONDED', default='QueryLookupResponded')
+PUB_EVENT_TYPE_CLIENT_MANAGER_SHARD_JOINED = config(
+    'PUB_EVENT_TYPE_CLIENT_MANAGER_SHARD_JOINED', default='ClientManagerShardJoined')
+PUB_EVENT_TYPE_CLIENT_MANAGER_SHARD_LEFT = config(
+    'PUB_EVENT_TYPE_CLIENT_MANAGER_SHARD_LEFT', default='ClientManagerShardLeft')
+PUB_EVENT_TYPE_CLIENT_MANAGER_SHARD_STATE_HANDED_OVER = config(
+    'PUB_EVENT_TYPE_CLIENT_MANAGER_SHARD_STATE_HANDED_OVER', default='ClientManagerShardStateHandedOver')
 
 PUB_EVENT_LIST = [
     PUB_EVENT_TYPE_QUERY_CREATED,
     PUB_EVENT_TYPE_QUERY_REMOVED,
+    PUB_EVENT_TYPE_QUERY_BULK_PROCESSED,
+    PUB_EVENT_TYPE_QUERY_LOOKUP_RESPONDED,
+    PUB_EVENT_TYPE_CLIENT_MANAGER_SHARD_JOINED,
+    PUB_EVENT_TYPE_CLIENT_MANAGER_SHARD_LEFT,
+    PUB_EVENT_TYPE_CLIENT_MANAGER_SHARD_STATE_HANDED_OVER,
 ]
 
 
 SERVICE_DETAILS = None
 
+PARSED_QUERY_CACHE_SIZE = config('PARSED_QUERY_CACHE_SIZE', default=1024, cast=int)
+
+CMD_BATCH_SIZE = config('CMD_BATCH_SIZE', default=1, cast=int)
+CMD_BATCH_MAX_LINGER_MS = config('CMD_BATCH_MAX_LINGER_MS', default=0, cast=int)
+
+STATE_SNAPSHOT_PATH = config('STATE_SNAPSHOT_PATH', default='')
+STATE_SNAPSHOT_REDIS_KEY = config('STATE_SNAPSHOT_REDIS_KEY', default='')
+STATE_SNAPSHOT_EVERY_N_EVENTS = config('STATE_SNAPSHOT_EVERY_N_EVENTS', default=1000, cast=int)
+STATE_SNAPSHOT_INTERVAL_SECONDS = config('STATE_SNAPSHOT_INTERVAL_SECONDS', default=60, cast=float)
+
+PENDING_QUERY_TTL_SECONDS = config('PENDING_QUERY_TTL_SECONDS', default=300, cast=float)
+PENDING_QUERY_MAX_SIZE = config('PENDING_QUERY_MAX_SIZE', default=10000, cast=int)
+REQUEUE_QUERIES_ON_PUBLISHER_REMOVED = config('REQUEUE_QUERIES_ON_PUBLISHER_REMOVED', default=False, cast=bool)
+
+# 0 disables the heartbeat expiration, workers are then only removed by ServiceWorkerRemoved events.
+WORKER_HEARTBEAT_TTL_SECONDS = config('WORKER_HEARTBEAT_TTL_SECONDS', default=0, cast=float)
+
+# prometheus text format metrics, served over http (0 disables it) and/or written to a redis key.
+METRICS_HTTP_PORT = config('METRICS_HTTP_PORT', default=0, cast=int)
+METRICS_REDIS_KEY = config('METRICS_REDIS_KEY', default='')
+METRICS_REDIS_INTERVAL_SECONDS = config('METRICS_REDIS_INTERVAL_SECONDS', default=10, cast=float)
+
+# how bufferstream keys and query ids are generated: legacy (md5, default), blake2b or compat
+# (blake2b, but keeping the legacy keys still in use, to migrate from legacy to blake2b).
+KEY_SCHEME = config('KEY_SCHEME', default='legacy')
+
+# how queries share bufferstreams: exact (one per query content, default), canonical (content order doesn't matter)
+# or superset (queries join an existing bufferstream of their publisher with all their content types).
+BUFFER_STREAM_SHARING = config('BUFFER_STREAM_SHARING', default='exact')
+
+# horizontal sharding by publisher_id: empty SHARD_ID runs a single (unsharded) instance.
+# SHARD_IDS are the other shards known at startup, the ones joining later announce themselves.
+SHARD_ID = config('SHARD_ID', default='') or None
+SHARD_IDS = config('SHARD_IDS', default='', cast=lambda v: [s.strip() for s in v.split(',') if s.strip()])
+SHARD_VIRTUAL_NODES = config('SHARD_VIRTUAL_NODES', default=64, cast=int)
+# how long a joining shard waits for the other shards to announce their membership (eg: when it's the first one)
+SHARD_JOIN_TIMEOUT_SECONDS = config('SHARD_JOIN_TIMEOUT_SECONDS', default=5, cast=float)
+
+# number of processes parsing the query texts of each batch of events in parallel (0 parses them inline).
+PARSE_EXECUTOR_WORKERS = config('PARSE_EXECUTOR_WORKERS', default=0, cast=int)
+
+# asyncio runtime (async redis client), overlapping the reading of events with the writing of published events.
+ASYNC_RUNTIME = config('ASYNC_RUNTIME', default=False, cast=bool)
+ASYNC_MAX_IN_FLIGHT_PUBLISHES = config('ASYNC_MAX_IN_FLIGHT_PUBLISHES', default=8, cast=int)
+ASYNC_READ_BLOCK_MS = config('ASYNC_READ_BLOCK_MS', default=1000, cast=int)
+
+# the state is logged incrementally (only its changes), a full dump is logged on SIGUSR1, at most once per interval.
+FULL_STATE_DUMP_MIN_INTERVAL_SECONDS = config('FULL_STATE_DUMP_MIN_INTERVAL_SECONDS', default=60, cast=float)
+
+# ids of the recently processed events, to skip the events delivered again (0 max size disables it).
+EVENT_DEDUPE_TTL_SECONDS = config('EVENT_DEDUPE_TTL_SECONDS', default=600, cast=float)
+EVENT_DEDUPE_MAX_SIZE = config('EVENT_DEDUPE_MAX_SIZE', default=10000, cast=int)
+
+# prefix of the redis keys of the read-only query catalog for other services (empty disables it).
+QUERY_CATALOG_KEY_PREFIX = config('QUERY_CATALOG_KEY_PREFIX', default='')
+
 
 LOGGING_LEVEL = config('LOGGING_LEVEL', default='DEBUG')
@@ -0,0 +1,69 @@
+import time
+
+from client_manager.ttl_map import BoundedTTLMap
+
+
+class EventIdDedupeWindow():
+    """
+    Ids of the recently processed events, to skip the events delivered again (eg: redelivered by the consumer group)
+    before doing any work for them. The ids expire after `ttl_seconds`, and the oldest ones are evicted
+    over `max_size`.
+    """
+
+    def __init__(self, ttl_seconds, max_size, clock=time.monotonic):
+        self.ids = BoundedTTLMap(ttl_seconds=ttl_seconds, max_size=max_size, clock=clock)
+        self.duplicates = 0
+
+    @property
+    def enabled(self):
+        return self.ids.max_size > 0
+
+    @property
+    def entries(self):
+        return self.ids.entries
+
+    @property
+    def expired(self):
+        return self.ids.expired
+
+    @property
+    def evicted(self):
+        return self.ids.evicted
+
+    def is_duplicate(self, event_id):
+        """Returns True (and counts it) if the event id was already seen."""
+        self.ids.purge_expired()
+        if event_id in self.ids:
+            self.duplicates += 1
+            return True
+        return False
+
+    def add(self, event_id):
+        self.ids.add(event_id, None, self.ids.get_expires_at())
+
+    def check_and_add(self, event_id):
+        """Returns True if the event id was already seen (a duplicate), otherwise adds it and returns False."""
+        if self.is_duplicate(event_id):
+            return True
+        self.add(event_id)
+        return False
+
+    def purge_expired(self, now=None):
+        self.ids.purge_expired(now)
+
+    def clear(self):
+        self.ids.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.ids),
+            'duplicates': self.duplicates,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
+
+    def __contains__(self, event_id):
+        return event_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
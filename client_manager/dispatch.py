@@ -0,0 +1,34 @@
+class EventTypeHandler():
+    """
+    Handler for one event type.
+
+    `handler` is either the name of a service method, resolved on each dispatch so that subclasses
+    (and mocks) overriding the method are respected, or any other callable (eg: plugins).
+    `args_extractor` is either a {handler_kwarg: event_data_key} dict or a callable receiving the
+    event data and returning the handler kwargs.
+    `shard_key_extractor` is used on the sharded mode to find which shard owns the event, and is either the
+    event_data key with the shard key (eg: 'publisher_id'), a callable receiving the event data and returning
+    the shard key, or None for events handled by all the shards.
+    """
+
+    def __init__(self, handler, args_extractor, shard_key_extractor=None):
+        self.handler = handler
+        self.args_extractor = args_extractor
+        self.shard_key_extractor = shard_key_extractor
+
+    def get_handler(self, service):
+        if isinstance(self.handler, str):
+            return getattr(service, self.handler)
+        return self.handler
+
+    def get_handler_kwargs(self, event_data):
+        if callable(self.args_extractor):
+            return self.args_extractor(event_data)
+        return {arg: event_data[key] for arg, key in self.args_extractor.items()}
+
+    def get_shard_key(self, event_data):
+        if self.shard_key_extractor is None:
+            return None
+        if callable(self.shard_key_extractor):
+            return self.shard_key_extractor(event_data)
+        return event_data[self.shard_key_extractor]
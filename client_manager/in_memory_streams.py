@@ -0,0 +1,92 @@
+import itertools
+
+from event_service_utils.streams.base import BasicStream, StreamFactory
+
+
+class InMemoryStreamStore():
+    """
+    Shared in-memory storage for the streams of an InMemoryStreamFactory.
+    Event ids follow the redis "<ms>-<seq>" format, using a single counter for all streams,
+    so events of different streams can be ordered the same way they would be in redis.
+    """
+
+    def __init__(self):
+        self.streams = {}
+        self.consumer_group_cursors = {}
+        self._id_counter = itertools.count(1)
+
+    def get_stream(self, key):
+        return self.streams.setdefault(key, [])
+
+    def add(self, key, event_msg):
+        event_id = f'0-{next(self._id_counter)}'.encode('utf-8')
+        self.get_stream(key).append((event_id, event_msg))
+        return event_id
+
+
+class InMemoryStreamOnly(BasicStream):
+
+    def __init__(self, store, key):
+        BasicStream.__init__(self, key)
+        self.store = store
+        self.last_position = len(store.get_stream(key))
+
+    def read_events(self, count=1):
+        stream = self.store.get_stream(self.key)
+        events = stream[self.last_position:self.last_position + count]
+        self.last_position += len(events)
+        yield from events
+
+    def write_events(self, *events):
+        return [self.store.add(self.key, event) for event in events]
+
+    def ack(self, event_id, stream_key=None):
+        pass
+
+
+class InMemoryManyKeyConsumerGroup(BasicStream):
+    """
+    Non-blocking consumer group reading from many keys, with a single cursor per key for the whole group.
+    Consumer groups with the same cg_id in the same store share the cursors, like in redis.
+    """
+
+    def __init__(self, store, keys, cg_id, cursors):
+        BasicStream.__init__(self, cg_id)
+        self.store = store
+        self.keys = list(keys)
+        self.cursors = cursors
+        for key in self.keys:
+            self.cursors.setdefault(key, len(self.store.get_stream(key)))
+
+    def read_stream_events_list(self, count=1):
+        stream_event_list = []
+        for key in self.keys:
+            stream = self.store.get_stream(key)
+            position = self.cursors[key]
+            events = stream[position:position + count]
+            if events:
+                self.cursors[key] = position + len(events)
+                stream_event_list.append([key.encode('utf-8'), events])
+        return stream_event_list
+
+    def pending_events_count(self):
+        return sum(len(self.store.get_stream(key)) - self.cursors[key] for key in self.keys)
+
+    def ack(self, event_id, stream_key=None):
+        pass
+
+
+class InMemoryStreamFactory(StreamFactory):
+    """
+    Stream factory with the same interface as the RedisStreamFactory, keeping everything in memory.
+    Useful to run one or more services in the same process, eg: on benchmarks and integration tests.
+    """
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else InMemoryStreamStore()
+
+    def create(self, key, stype='streamAndConsumer', cg_id=None):
+        if stype == 'manyKeyConsumerOnly':
+            cursors = self.store.consumer_group_cursors.setdefault(cg_id, {})
+            return InMemoryManyKeyConsumerGroup(self.store, keys=key, cg_id=cg_id, cursors=cursors)
+        return InMemoryStreamOnly(self.store, key)
@@ -0,0 +1,117 @@
+class ManyToOneIndex():
+    """
+    Two-way index where each item belongs to a single key, eg: query_id -> publisher_id.
+    Keeps the key -> set(items) map next to the item -> key reverse map, so that adding and removing
+    an item are both O(1), and getting all items of a key is O(result).
+    """
+
+    def __init__(self):
+        self.key_to_items_map = {}
+        self.item_to_key_map = {}
+
+    def add(self, key, item):
+        previous_key = self.item_to_key_map.get(item)
+        if previous_key is not None and previous_key != key:
+            self.remove(item)
+        item_set = self.key_to_items_map.setdefault(key, set())
+        item_set.add(item)
+        self.item_to_key_map[item] = key
+
+    def remove(self, item):
+        key = self.item_to_key_map.pop(item, None)
+        if key is None:
+            return None
+        item_set = self.key_to_items_map[key]
+        item_set.discard(item)
+        if len(item_set) == 0:
+            del self.key_to_items_map[key]
+        return key
+
+    def remove_items(self, items):
+        """
+        Removes many items, updating the item set of each of their keys only once.
+        Returns the {key: [removed items]} map.
+        """
+        key_removed_items = {}
+        for item in items:
+            key = self.item_to_key_map.pop(item, None)
+            if key is not None:
+                key_removed_items.setdefault(key, []).append(item)
+        for key, removed_items in key_removed_items.items():
+            item_set = self.key_to_items_map[key]
+            item_set.difference_update(removed_items)
+            if len(item_set) == 0:
+                del self.key_to_items_map[key]
+        return key_removed_items
+
+    def pop_key(self, key):
+        item_set = self.key_to_items_map.pop(key, set())
+        for item in item_set:
+            del self.item_to_key_map[item]
+        return item_set
+
+    def get_key(self, item):
+        return self.item_to_key_map.get(item)
+
+    def get_items(self, key):
+        return self.key_to_items_map.get(key, set())
+
+    def clear(self):
+        self.key_to_items_map.clear()
+        self.item_to_key_map.clear()
+
+    def __contains__(self, key):
+        return key in self.key_to_items_map
+
+    def __len__(self):
+        return len(self.key_to_items_map)
+
+
+class ManyToManyIndex():
+    """
+    Two-way index where each item can belong to many keys, eg: query_id -> content types.
+    """
+
+    def __init__(self):
+        self.key_to_items_map = {}
+        self.item_to_keys_map = {}
+
+    def add(self, keys, item):
+        self.remove(item)
+        keys = set(keys)
+        for key in keys:
+            self.key_to_items_map.setdefault(key, set()).add(item)
+        self.item_to_keys_map[item] = keys
+
+    def remove(self, item):
+        keys = self.item_to_keys_map.pop(item, None)
+        if keys is None:
+            return None
+        for key in keys:
+            item_set = self.key_to_items_map[key]
+            item_set.discard(item)
+            if len(item_set) == 0:
+                del self.key_to_items_map[key]
+        return keys
+
+    def get_keys(self, item):
+        return self.item_to_keys_map.get(item, set())
+
+    def get_items(self, key):
+        return self.key_to_items_map.get(key, set())
+
+    def get_items_for_any_key(self, keys):
+        items = set()
+        for key in keys:
+            items.update(self.get_items(key))
+        return items
+
+    def clear(self):
+        self.key_to_items_map.clear()
+        self.item_to_keys_map.clear()
+
+    def __contains__(self, key):
+        return key in self.key_to_items_map
+
+    def __len__(self):
+        return len(self.key_to_items_map)
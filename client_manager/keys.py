@@ -0,0 +1,94 @@
+import functools
+import hashlib
+
+
+# legacy: md5 of the '-'/'_' joined values, same keys as the previous versions (default).
+# blake2b: blake2b of an unambiguous encoding of the values.
+# compat: blake2b for new keys, but keeps using the legacy keys that are still in use,
+#   so the existing bufferstreams and queries keep their keys while migrating from legacy to blake2b.
+KEY_SCHEME_LEGACY = 'legacy'
+KEY_SCHEME_BLAKE2B = 'blake2b'
+KEY_SCHEME_COMPAT = 'compat'
+KEY_SCHEMES = (KEY_SCHEME_LEGACY, KEY_SCHEME_BLAKE2B, KEY_SCHEME_COMPAT)
+
+# same hex digest length as md5, so the new keys fit wherever the legacy ones did.
+BLAKE2B_DIGEST_SIZE = 16
+
+
+def unambiguous_encoding(values):
+    # the number of values followed by the values joined by NUL, so different value lists can't have the
+    # same encoding. Values containing NUL (never expected) fall back to prefixing each value by its length,
+    # starting with a NUL so that it can't be confused with the first encoding.
+    joined_values = '\x00'.join(values)
+    if joined_values.count('\x00') == len(values) - 1:
+        return f'{len(values)}\x00{joined_values}'.encode('utf-8')
+    return ('\x00' + ''.join([f'{len(value)}:{value}' for value in values])).encode('utf-8')
+
+
+def legacy_buffer_stream_key(query_content, publisher_id, resolution, fps):
+    keys_list = tuple(query_content) + tuple([publisher_id, resolution, fps])
+    unhashed_key = '-'.join(keys_list)
+    return hashlib.md5(unhashed_key.encode()).hexdigest()
+
+
+def blake2b_buffer_stream_key(query_content, publisher_id, resolution, fps):
+    values = (str(len(query_content)), *query_content, publisher_id, resolution, fps)
+    return hashlib.blake2b(unambiguous_encoding(values), digest_size=BLAKE2B_DIGEST_SIZE).hexdigest()
+
+
+def legacy_query_id(subscriber_id, query_name):
+    key = f'{subscriber_id}_{query_name}'
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def blake2b_query_id(subscriber_id, query_name):
+    return hashlib.blake2b(
+        unambiguous_encoding((subscriber_id, query_name)), digest_size=BLAKE2B_DIGEST_SIZE).hexdigest()
+
+
+class KeyGenerator():
+    """
+    Generates the bufferstream keys and query ids using the configured key scheme, memoizing the results.
+
+    On the compat scheme, `buffer_stream_key_in_use` and `query_id_in_use` are used to check if a legacy
+    key is still in use (eg: restored from a state snapshot), in which case it is returned instead of the new one.
+    """
+
+    def __init__(self, scheme=KEY_SCHEME_LEGACY, memo_size=65536,
+                 buffer_stream_key_in_use=None, query_id_in_use=None):
+        if scheme not in KEY_SCHEMES:
+            raise ValueError(f'Unknown key scheme: {scheme}. Available schemes: {KEY_SCHEMES}')
+        self.scheme = scheme
+        self.buffer_stream_key_in_use = buffer_stream_key_in_use
+        self.query_id_in_use = query_id_in_use
+
+        memoize = functools.lru_cache(maxsize=memo_size)
+        self._legacy_buffer_stream_key = memoize(legacy_buffer_stream_key)
+        self._legacy_query_id = memoize(legacy_query_id)
+        if scheme == KEY_SCHEME_LEGACY:
+            self._buffer_stream_key = self._legacy_buffer_stream_key
+            self._query_id = self._legacy_query_id
+        else:
+            self._buffer_stream_key = memoize(blake2b_buffer_stream_key)
+            self._query_id = memoize(blake2b_query_id)
+
+    def get_buffer_stream_key(self, query_content, publisher_id, resolution, fps):
+        query_content = tuple(query_content)
+        if self.scheme == KEY_SCHEME_COMPAT and self.buffer_stream_key_in_use is not None:
+            legacy_key = self._legacy_buffer_stream_key(query_content, publisher_id, resolution, fps)
+            if self.buffer_stream_key_in_use(legacy_key):
+                return legacy_key
+        return self._buffer_stream_key(query_content, publisher_id, resolution, fps)
+
+    def get_query_id(self, subscriber_id, query_name):
+        if self.scheme == KEY_SCHEME_COMPAT and self.query_id_in_use is not None:
+            legacy_id = self._legacy_query_id(subscriber_id, query_name)
+            if self.query_id_in_use(legacy_id):
+                return legacy_id
+        return self._query_id(subscriber_id, query_name)
+
+    def cache_info(self):
+        return {
+            'buffer_stream_keys': self._buffer_stream_key.cache_info()._asdict(),
+            'query_ids': self._query_id.cache_info()._asdict(),
+        }
@@ -0,0 +1,205 @@
+import bisect
+import time
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+
+
+# latency buckets upper bounds, in seconds
+DEFAULT_LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    float('inf'),
+)
+
+
+class LatencyHistogram():
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile):
+        # same linear interpolation inside the bucket as prometheus' histogram_quantile.
+        if self.count == 0:
+            return 0.0
+        rank = percentile / 100 * self.count
+        cumulative_count = 0
+        lower_bound = 0.0
+        for upper_bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            if bucket_count and cumulative_count + bucket_count >= rank:
+                upper_bound = min(upper_bound, self.max)
+                fraction = (rank - cumulative_count) / bucket_count
+                return lower_bound + (upper_bound - lower_bound) * fraction
+            cumulative_count += bucket_count
+            lower_bound = upper_bound
+        return self.max
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.sum / self.count
+
+    def cumulative_bucket_counts(self):
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative_count += bucket_count
+            yield upper_bound, cumulative_count
+
+
+class RateMeter():
+    """Events per second over a sliding window, kept as one counter per second of the window."""
+
+    def __init__(self, window_seconds=60, clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.second_counts = [0] * window_seconds
+        self.second_timestamps = [None] * window_seconds
+        self.start_time = clock()
+
+    def mark(self, count=1):
+        second = int(self.clock())
+        slot = second % self.window_seconds
+        if self.second_timestamps[slot] != second:
+            self.second_timestamps[slot] = second
+            self.second_counts[slot] = 0
+        self.second_counts[slot] += count
+
+    def rate(self):
+        now = self.clock()
+        current_second = int(now)
+        total = 0
+        for second, count in zip(self.second_timestamps, self.second_counts):
+            if second is not None and current_second - second < self.window_seconds:
+                total += count
+        elapsed = min(self.window_seconds, max(now - self.start_time, 1.0))
+        return total / elapsed
+
+
+class EventTypeMetrics():
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.duplicates = 0
+        self.latency = LatencyHistogram()
+        self.rate_meter = RateMeter()
+
+    def observe(self, latency, error=False):
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.latency.observe(latency)
+        self.rate_meter.mark()
+
+    def observe_duplicate(self):
+        self.duplicates += 1
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'duplicates': self.duplicates,
+            'events_per_second': self.rate_meter.rate(),
+            'latency_p50': self.latency.percentile(50),
+            'latency_p99': self.latency.percentile(99),
+            'latency_max': self.latency.max,
+        }
+
+
+def format_bucket_bound(upper_bound):
+    if upper_bound == float('inf'):
+        return '+Inf'
+    return repr(float(upper_bound))
+
+
+def histogram_metric_family(name, documentation, histograms_by_label, label_name):
+    metric_family = HistogramMetricFamily(name, documentation, labels=[label_name] if label_name else None)
+    for label_value, histogram in histograms_by_label:
+        buckets = [
+            (format_bucket_bound(upper_bound), count)
+            for upper_bound, count in histogram.cumulative_bucket_counts()
+        ]
+        labels = [label_value] if label_name else []
+        metric_family.add_metric(labels, buckets, histogram.sum)
+    return metric_family
+
+
+class ClientManagerMetricsCollector():
+    """
+    Prometheus collector reading the in-process metrics of a ClientManager when scraped,
+    so nothing is computed on the event processing path besides the counters themselves.
+    """
+
+    def __init__(self, service, prefix='client_manager'):
+        self.service = service
+        self.prefix = prefix
+
+    def _name(self, name):
+        return f'{self.prefix}_{name}'
+
+    def collect(self):
+        service = self.service
+        event_type_metrics = list(service.event_type_metrics.items())
+
+        events = CounterMetricFamily(self._name('events'), 'Processed events', labels=['event_type'])
+        errors = CounterMetricFamily(self._name('event_errors'), 'Events that failed processing', labels=['event_type'])
+        duplicates = CounterMetricFamily(
+            self._name('event_duplicates'), 'Duplicated events skipped by the dedupe window', labels=['event_type'])
+        rates = GaugeMetricFamily(
+            self._name('events_per_second'), 'Processed events per second (last minute)', labels=['event_type'])
+        p50 = GaugeMetricFamily(
+            self._name('event_latency_p50_seconds'), 'Median event handling latency', labels=['event_type'])
+        p99 = GaugeMetricFamily(
+            self._name('event_latency_p99_seconds'), '99th percentile event handling latency', labels=['event_type'])
+        for event_type, metrics in event_type_metrics:
+            events.add_metric([event_type], metrics.count)
+            errors.add_metric([event_type], metrics.errors)
+            duplicates.add_metric([event_type], metrics.duplicates)
+            rates.add_metric([event_type], metrics.rate_meter.rate())
+            p50.add_metric([event_type], metrics.latency.percentile(50))
+            p99.add_metric([event_type], metrics.latency.percentile(99))
+        yield events
+        yield errors
+        yield duplicates
+        yield rates
+        yield p50
+        yield p99
+        yield histogram_metric_family(
+            self._name('event_latency_seconds'), 'Event handling latency',
+            [(event_type, metrics.latency) for event_type, metrics in event_type_metrics], 'event_type'
+        )
+
+        parsed_query_cache = service.parsed_query_cache
+        yield histogram_metric_family(
+            self._name('query_parse_latency_seconds'), 'Query parsing latency (cache misses)',
+            [(None, parsed_query_cache.parse_latency)], None
+        )
+        yield histogram_metric_family(
+            self._name('publish_latency_seconds'), 'Latency of writing published events',
+            [(None, service.publish_latency)], None
+        )
+
+        cache_counters = CounterMetricFamily(
+            self._name('parsed_query_cache'), 'Parsed query cache counters', labels=['result'])
+        cache_stats = parsed_query_cache.stats()
+        for result in ['hits', 'misses', 'evictions']:
+            cache_counters.add_metric([result], cache_stats[result])
+        cache_counters.add_metric(['prefetches'], parsed_query_cache.prefetches)
+        yield cache_counters
+        yield GaugeMetricFamily(
+            self._name('parsed_query_cache_hit_ratio'), 'Parsed query cache hit ratio',
+            value=parsed_query_cache.hit_rate())
+
+        sizes = GaugeMetricFamily(self._name('state_size'), 'Number of entries in the state', labels=['collection'])
+        for collection, size in service.get_state_sizes().items():
+            sizes.add_metric([collection], size)
+        yield sizes
@@ -0,0 +1,42 @@
+from concurrent.futures import ProcessPoolExecutor
+
+
+_worker_query_parser = None
+
+
+def _init_worker():
+    from gnosis_epl.main import QueryParser
+
+    global _worker_query_parser
+    _worker_query_parser = QueryParser()
+
+
+def _parse_query_text(query_text):
+    return _worker_query_parser.parse(query_text)
+
+
+class QueryParseExecutor():
+    """
+    Process pool parsing the query texts of a batch of events in parallel, ahead of the events being processed.
+    The events are still processed one by one and in order, only waiting for their parsed query when needed.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.executor = None
+
+    @property
+    def running(self):
+        return self.executor is not None
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def submit(self, query_text):
+        return self.executor.submit(_parse_query_text, query_text)
@@ -0,0 +1,115 @@
+import time
+from collections import OrderedDict, namedtuple
+
+from client_manager.ttl_map import BoundedTTLMap
+
+
+PendingQuery = namedtuple(
+    'PendingQuery',
+    ['query_id', 'publisher_id', 'query_received_event_id', 'subscriber_id', 'parsed_query', 'expires_at']
+)
+
+
+class PendingQueryStore():
+    """
+    Queries waiting for their publisher, indexed by publisher_id and subscriber_id.
+    They expire after `ttl_seconds`, and the oldest ones are evicted over `max_size`.
+    """
+
+    def __init__(self, ttl_seconds, max_size, clock=time.time):
+        self.queries = BoundedTTLMap(
+            ttl_seconds=ttl_seconds, max_size=max_size, clock=clock, on_remove=self._on_query_removed)
+        self.publisher_to_query_ids = {}
+        self.subscriber_to_query_ids = {}
+
+    @property
+    def entries(self):
+        return self.queries.entries
+
+    @property
+    def expired(self):
+        return self.queries.expired
+
+    @property
+    def evicted(self):
+        return self.queries.evicted
+
+    def add(self, query_id, publisher_id, query_received_event_id, subscriber_id, parsed_query):
+        self.remove(query_id)
+        self.queries.purge_expired()
+        pending_query = PendingQuery(
+            query_id=query_id,
+            publisher_id=publisher_id,
+            query_received_event_id=query_received_event_id,
+            subscriber_id=subscriber_id,
+            parsed_query=parsed_query,
+            expires_at=self.queries.get_expires_at(),
+        )
+        self._insert(pending_query)
+        return pending_query
+
+    def _insert(self, pending_query):
+        publisher_query_ids = self.publisher_to_query_ids.setdefault(pending_query.publisher_id, OrderedDict())
+        publisher_query_ids[pending_query.query_id] = None
+        subscriber_query_ids = self.subscriber_to_query_ids.setdefault(pending_query.subscriber_id, OrderedDict())
+        subscriber_query_ids[pending_query.query_id] = None
+        self.queries.add(pending_query.query_id, pending_query, pending_query.expires_at)
+
+    def _on_query_removed(self, query_id, pending_query):
+        self._unindex(self.publisher_to_query_ids, pending_query.publisher_id, query_id)
+        self._unindex(self.subscriber_to_query_ids, pending_query.subscriber_id, query_id)
+
+    def remove(self, query_id):
+        pending_query = self.queries.pop(query_id)
+        if pending_query is not None:
+            self._on_query_removed(query_id, pending_query)
+        return pending_query
+
+    def _unindex(self, index, key, query_id):
+        key_query_ids = index.get(key)
+        if key_query_ids is None:
+            return
+        key_query_ids.pop(query_id, None)
+        if len(key_query_ids) == 0:
+            del index[key]
+
+    def purge_expired(self):
+        self.queries.purge_expired()
+
+    def pop_publisher(self, publisher_id):
+        self.purge_expired()
+        publisher_query_ids = self.publisher_to_query_ids.pop(publisher_id, {})
+        pending_queries = [self.queries.pop(query_id) for query_id in publisher_query_ids]
+        for pending_query in pending_queries:
+            self._unindex(self.subscriber_to_query_ids, pending_query.subscriber_id, pending_query.query_id)
+        return pending_queries
+
+    def pop_subscriber(self, subscriber_id):
+        self.purge_expired()
+        subscriber_query_ids = self.subscriber_to_query_ids.pop(subscriber_id, {})
+        pending_queries = [self.queries.pop(query_id) for query_id in subscriber_query_ids]
+        for pending_query in pending_queries:
+            self._unindex(self.publisher_to_query_ids, pending_query.publisher_id, pending_query.query_id)
+        return pending_queries
+
+    def restore(self, pending_queries):
+        self.queries.clear()
+        self.publisher_to_query_ids.clear()
+        self.subscriber_to_query_ids.clear()
+        for pending_query in sorted(pending_queries, key=lambda p: (p.expires_at is None, p.expires_at or 0)):
+            self._insert(pending_query)
+        self.purge_expired()
+
+    def stats(self):
+        return {
+            'size': len(self.queries),
+            'publishers': len(self.publisher_to_query_ids),
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
+
+    def __contains__(self, query_id):
+        return query_id in self.queries
+
+    def __len__(self):
+        return len(self.queries)
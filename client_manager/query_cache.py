@@ -0,0 +1,135 @@
+import re
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from types import MappingProxyType
+
+from client_manager.metrics import LatencyHistogram
+
+
+QUOTED_STRING_REGEX = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""")
+
+
+def normalize_query_text(query_text):
+    # collapses whitespaces outside of quoted strings, so that the same query sent with
+    # a different indentation/line breaks is considered the same query text.
+    parts = QUOTED_STRING_REGEX.split(query_text.strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = ' '.join(parts[i].split())
+    return ''.join(parts)
+
+
+def freeze(value):
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
+class LazyQueryParser():
+    """Query parser only constructed (and gnosis_epl imported, which is slow) when the first query is parsed."""
+
+    def __init__(self):
+        self.query_parser = None
+
+    def parse(self, query_text):
+        if self.query_parser is None:
+            from gnosis_epl.main import QueryParser
+            self.query_parser = QueryParser()
+        return self.query_parser.parse(query_text)
+
+
+class ParsedQueryCache():
+    """
+    Bounded LRU cache of parsed queries, keyed on the normalized query text.
+    Cached results are frozen (read-only mappings and tuples), use `thaw` to get a mutable copy.
+    Query texts can be prefetched on a parse executor, `parse` then waits for their result instead of parsing them.
+    """
+
+    def __init__(self, query_parser, max_size):
+        self.query_parser = query_parser
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.parse_latency = LatencyHistogram()
+        self.prefetched = {}
+        self.prefetches = 0
+
+    def get(self, query_text):
+        key = normalize_query_text(query_text)
+        parsed_query = self.cache.get(key)
+        if parsed_query is not None:
+            self.cache.move_to_end(key)
+        return parsed_query
+
+    def put(self, query_text, parsed_query):
+        key = normalize_query_text(query_text)
+        parsed_query = freeze(parsed_query)
+        if self.max_size <= 0:
+            return parsed_query
+        self.cache[key] = parsed_query
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+        return parsed_query
+
+    def parse(self, query_text):
+        parsed_query = self.get(query_text)
+        if parsed_query is not None:
+            self.hits += 1
+            return parsed_query
+
+        self.misses += 1
+        start_time = time.perf_counter()
+        future = self.prefetched.pop(normalize_query_text(query_text), None)
+        if future is not None:
+            parsed_query = future.result()
+        else:
+            parsed_query = self.query_parser.parse(query_text)
+        self.parse_latency.observe(time.perf_counter() - start_time)
+        return self.put(query_text, parsed_query)
+
+    def prefetch(self, query_texts, parse_executor):
+        for query_text in query_texts:
+            key = normalize_query_text(query_text)
+            if key in self.cache or key in self.prefetched:
+                continue
+            self.prefetched[key] = parse_executor.submit(query_text)
+            self.prefetches += 1
+
+    def clear_prefetched(self):
+        # prefetched texts whose events didn't need parsing them (eg: invalid events)
+        for future in self.prefetched.values():
+            future.cancel()
+        self.prefetched.clear()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def stats(self):
+        return {
+            'size': len(self.cache),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def clear(self):
+        self.cache.clear()
+        self.clear_prefetched()
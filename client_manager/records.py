@@ -0,0 +1,197 @@
+import sys
+from collections.abc import Mapping
+from types import MappingProxyType
+
+from client_manager.query_cache import freeze, thaw
+
+
+def intern_string(value):
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+
+def parsed_query_to_dict(parsed_query):
+    return {
+        'name': parsed_query['name'],
+        'output': thaw(parsed_query['output']),
+        'from': thaw(parsed_query['from']),
+        'content': thaw(parsed_query['content']),
+        'match': parsed_query['match'],
+        'optional_match': parsed_query.get('optional_match', ''),
+        'where': parsed_query.get('where', ''),
+        'window': thaw(parsed_query['window']),
+        'ret': parsed_query['ret'],
+        'qos_policies': thaw(parsed_query.get('qos_policies', {})),
+        # 'cypher_query': query['cypher_query'],
+    }
+
+
+class Record(Mapping):
+    """
+    Compact (__slots__) replacement for the dicts kept in the service state.
+
+    Records are read (and their fields updated) the same way as the dicts they replace, eg: query['service_chain'],
+    and are only converted to the dict used in the published events when needed, with `to_dict`/`copy`.
+    Pickling (state snapshots) also goes through the dict representation.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return self.to_dict() == dict(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)
+        return f'{self.__class__.__name__}({fields})'
+
+    def __reduce__(self):
+        return (self.__class__.from_dict, (self.to_dict(),))
+
+    def to_dict(self):
+        data = {}
+        for field in self.__slots__:
+            value = getattr(self, field)
+            data[field] = value.to_dict() if isinstance(value, Record) else value
+        return data
+
+    def copy(self):
+        return self.to_dict()
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class PublisherRecord(Record):
+    __slots__ = ('id', 'source', 'meta')
+
+    def __init__(self, id, source, meta):
+        self.id = intern_string(id)
+        self.source = intern_string(source)
+        self.meta = {intern_string(k): intern_string(v) for k, v in meta.items()}
+
+    def to_dict(self):
+        return {'id': self.id, 'source': self.source, 'meta': dict(self.meta)}
+
+
+class BufferStreamRecord(Record):
+    """
+    `content` is the content types of a shared bufferstream (see BufferStreamPlanner), it's None when the
+    bufferstream isn't shared, and then left out of the dict, so the published bufferstream stays the same.
+    """
+    __slots__ = ('publisher_id', 'buffer_stream_key', 'source', 'resolution', 'fps', 'content')
+
+    def __init__(self, publisher_id, buffer_stream_key, source, resolution, fps, content=None):
+        self.publisher_id = intern_string(publisher_id)
+        self.buffer_stream_key = intern_string(buffer_stream_key)
+        self.source = intern_string(source)
+        self.resolution = intern_string(resolution)
+        self.fps = intern_string(fps)
+        if content is not None:
+            content = tuple(intern_string(content_type) for content_type in content)
+        self.content = content
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def to_dict(self):
+        data = {
+            'publisher_id': self.publisher_id,
+            'buffer_stream_key': self.buffer_stream_key,
+            'source': self.source,
+            'resolution': self.resolution,
+            'fps': self.fps,
+        }
+        if self.content is not None:
+            data['content'] = list(self.content)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            publisher_id=data['publisher_id'],
+            buffer_stream_key=data['buffer_stream_key'],
+            source=data['source'],
+            resolution=data['resolution'],
+            fps=data['fps'],
+            content=data.get('content'),
+        )
+
+
+class QueryRecord(Record):
+    """
+    The parsed query is kept frozen, so queries with the same query text share the one in the parsed query cache,
+    and is only turned into the published parsed query dict in `to_dict`.
+    """
+    __slots__ = (
+        'subscriber_id', 'query_id', 'parsed_query', 'query_received_event_id', 'buffer_stream', 'service_chain',
+    )
+
+    def __init__(self, subscriber_id, query_id, parsed_query, query_received_event_id,
+                 buffer_stream=None, service_chain=None):
+        self.subscriber_id = intern_string(subscriber_id)
+        self.query_id = query_id
+        if not isinstance(parsed_query, MappingProxyType):
+            parsed_query = freeze(parsed_query)
+        self.parsed_query = parsed_query
+        self.query_received_event_id = query_received_event_id
+        self.buffer_stream = buffer_stream
+        self.service_chain = service_chain
+
+    def to_dict(self):
+        buffer_stream = self.buffer_stream
+        if isinstance(buffer_stream, Record):
+            buffer_stream = buffer_stream.to_dict()
+        return {
+            'subscriber_id': self.subscriber_id,
+            'query_id': self.query_id,
+            'parsed_query': parsed_query_to_dict(self.parsed_query),
+            'query_received_event_id': self.query_received_event_id,
+            'buffer_stream': buffer_stream,
+            'service_chain': self.service_chain,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        buffer_stream = data.get('buffer_stream')
+        if buffer_stream is not None:
+            buffer_stream = BufferStreamRecord.from_dict(buffer_stream)
+        return cls(
+            subscriber_id=data['subscriber_id'],
+            query_id=data['query_id'],
+            parsed_query=data['parsed_query'],
+            query_received_event_id=data['query_received_event_id'],
+            buffer_stream=buffer_stream,
+            service_chain=data.get('service_chain'),
+        )
+
+
+def record_to_dict(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+    return dict(value)
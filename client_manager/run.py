@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 from event_service_utils.streams.redis import RedisStreamFactory
 
+from client_manager.catalog import RedisQueryCatalog
 from client_manager.service import ClientManager
 from client_manager.service_registry import ServiceRegistry
+from client_manager.snapshots import FileStateSnapshotStore, RedisStateSnapshotStore
 
 from client_manager.conf import (
     REDIS_ADDRESS,
@@ -14,18 +16,77 @@ from client_manager.conf import (
     TRACER_REPORTING_HOST,
     TRACER_REPORTING_PORT,
     SERVICE_DETAILS,
+    PARSED_QUERY_CACHE_SIZE,
+    CMD_BATCH_SIZE,
+    CMD_BATCH_MAX_LINGER_MS,
+    STATE_SNAPSHOT_PATH,
+    STATE_SNAPSHOT_REDIS_KEY,
+    STATE_SNAPSHOT_EVERY_N_EVENTS,
+    STATE_SNAPSHOT_INTERVAL_SECONDS,
+    PENDING_QUERY_TTL_SECONDS,
+    PENDING_QUERY_MAX_SIZE,
+    REQUEUE_QUERIES_ON_PUBLISHER_REMOVED,
+    WORKER_HEARTBEAT_TTL_SECONDS,
+    METRICS_HTTP_PORT,
+    METRICS_REDIS_KEY,
+    METRICS_REDIS_INTERVAL_SECONDS,
+    KEY_SCHEME,
+    BUFFER_STREAM_SHARING,
+    SHARD_ID,
+    SHARD_IDS,
+    SHARD_VIRTUAL_NODES,
+    SHARD_JOIN_TIMEOUT_SECONDS,
+    PARSE_EXECUTOR_WORKERS,
+    ASYNC_RUNTIME,
+    ASYNC_MAX_IN_FLIGHT_PUBLISHES,
+    ASYNC_READ_BLOCK_MS,
+    FULL_STATE_DUMP_MIN_INTERVAL_SECONDS,
+    EVENT_DEDUPE_TTL_SECONDS,
+    EVENT_DEDUPE_MAX_SIZE,
+    QUERY_CATALOG_KEY_PREFIX,
 )
 
 
-def run_service():
-    service_registry = ServiceRegistry()
+def get_state_snapshot_store(stream_factory):
+    if STATE_SNAPSHOT_PATH:
+        return FileStateSnapshotStore(STATE_SNAPSHOT_PATH)
+    if STATE_SNAPSHOT_REDIS_KEY:
+        return RedisStateSnapshotStore(stream_factory.redis_db, STATE_SNAPSHOT_REDIS_KEY)
+    return None
+
+
+def get_query_catalog(stream_factory):
+    if QUERY_CATALOG_KEY_PREFIX:
+        return RedisQueryCatalog(stream_factory.redis_db, QUERY_CATALOG_KEY_PREFIX)
+    return None
+
+
+def run_service_async(service):
+    # asyncio and the async redis client are slow to import, so they are only imported when used
+    import asyncio
+
+    import redis.asyncio
+
+    from client_manager.async_runtime import AsyncRedisCmdReader, AsyncRedisEventWriter, AsyncServiceRuntime
+
+    redis_client = redis.asyncio.Redis(host=REDIS_ADDRESS, port=REDIS_PORT)
+    runtime = AsyncServiceRuntime(
+        service,
+        cmd_reader=AsyncRedisCmdReader.from_service(service, redis_client, block_ms=ASYNC_READ_BLOCK_MS),
+        event_writer=AsyncRedisEventWriter(redis_client, transaction=service.query_catalog is not None),
+        max_in_flight_publishes=ASYNC_MAX_IN_FLIGHT_PUBLISHES,
+    )
+    asyncio.run(runtime.run())
+
+
+def create_service(stream_factory):
+    service_registry = ServiceRegistry(worker_heartbeat_ttl_seconds=WORKER_HEARTBEAT_TTL_SECONDS)
 
     tracer_configs = {
         'reporting_host': TRACER_REPORTING_HOST,
         'reporting_port': TRACER_REPORTING_PORT,
     }
-    stream_factory = RedisStreamFactory(host=REDIS_ADDRESS, port=REDIS_PORT)
-    service = ClientManager(
+    return ClientManager(
         service_stream_key=SERVICE_STREAM_KEY,
         service_cmd_key_list=SERVICE_CMD_KEY_LIST,
         pub_event_list=PUB_EVENT_LIST,
@@ -33,9 +94,40 @@ def run_service():
         stream_factory=stream_factory,
         service_registry=service_registry,
         logging_level=LOGGING_LEVEL,
-        tracer_configs=tracer_configs
+        tracer_configs=tracer_configs,
+        parsed_query_cache_size=PARSED_QUERY_CACHE_SIZE,
+        cmd_batch_size=CMD_BATCH_SIZE,
+        cmd_batch_max_linger_ms=CMD_BATCH_MAX_LINGER_MS,
+        state_snapshot_store=get_state_snapshot_store(stream_factory),
+        state_snapshot_every_n_events=STATE_SNAPSHOT_EVERY_N_EVENTS,
+        state_snapshot_interval_seconds=STATE_SNAPSHOT_INTERVAL_SECONDS,
+        pending_query_ttl_seconds=PENDING_QUERY_TTL_SECONDS,
+        pending_query_max_size=PENDING_QUERY_MAX_SIZE,
+        requeue_queries_on_publisher_removed=REQUEUE_QUERIES_ON_PUBLISHER_REMOVED,
+        metrics_http_port=METRICS_HTTP_PORT,
+        metrics_redis_key=METRICS_REDIS_KEY,
+        metrics_redis_interval_seconds=METRICS_REDIS_INTERVAL_SECONDS,
+        key_scheme=KEY_SCHEME,
+        buffer_stream_sharing=BUFFER_STREAM_SHARING,
+        shard_id=SHARD_ID,
+        shard_ids=SHARD_IDS,
+        shard_virtual_nodes=SHARD_VIRTUAL_NODES,
+        shard_join_timeout_seconds=SHARD_JOIN_TIMEOUT_SECONDS,
+        parse_executor_workers=PARSE_EXECUTOR_WORKERS,
+        full_state_dump_min_interval_seconds=FULL_STATE_DUMP_MIN_INTERVAL_SECONDS,
+        event_dedupe_ttl_seconds=EVENT_DEDUPE_TTL_SECONDS,
+        event_dedupe_max_size=EVENT_DEDUPE_MAX_SIZE,
+        query_catalog=get_query_catalog(stream_factory),
     )
-    service.run()
+
+
+def run_service():
+    stream_factory = RedisStreamFactory(host=REDIS_ADDRESS, port=REDIS_PORT)
+    service = create_service(stream_factory)
+    if ASYNC_RUNTIME:
+        run_service_async(service)
+    else:
+        service.run()
 
 
 def main():
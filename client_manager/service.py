@@ -1,10 +1,34 @@
-import hashlib
+import logging
+import math
+import signal
 import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
 
 from event_service_utils.logging.decorators import timer_logger
 from event_service_utils.services.event_driven import BaseEventDrivenCMDService
-from event_service_utils.tracing.jaeger import init_tracer
-from gnosis_epl.main import QueryParser
+from prometheus_client import CollectorRegistry, generate_latest, start_http_server
+
+from client_manager.batching import stream_event_id_sort_key, write_events_pipelined
+from client_manager.bufferstreams import (
+    BUFFER_STREAM_SHARING_EXACT, BUFFER_STREAM_SHARING_SUPERSET, BufferStreamIndex, BufferStreamPlanner
+)
+from client_manager.dedupe import EventIdDedupeWindow
+from client_manager.dispatch import EventTypeHandler
+from client_manager.indexes import ManyToManyIndex, ManyToOneIndex
+from client_manager.keys import KEY_SCHEME_LEGACY, KeyGenerator
+from client_manager.metrics import ClientManagerMetricsCollector, EventTypeMetrics, LatencyHistogram
+from client_manager.parse_executor import QueryParseExecutor
+from client_manager.pending_queries import PendingQueryStore
+from client_manager.query_cache import LazyQueryParser, ParsedQueryCache, freeze, thaw
+from client_manager.records import BufferStreamRecord, PublisherRecord, QueryRecord, record_to_dict
+from client_manager.sharding import ConsistentHashRing, extract_query_publisher_id
+from client_manager.snapshots import (
+    SNAPSHOT_FORMAT_VERSION, get_snapshot_stream_id, serialize_snapshot, set_consumer_group_stream_ids
+)
+from client_manager.tracing import init_tracer
+from client_manager.tracking import TrackedDict
 
 
 class ClientManager(BaseEventDrivenCMDService):
@@ -14,90 +38,310 @@ class ClientManager(BaseEventDrivenCMDService):
                  stream_factory,
                  service_registry,
                  logging_level,
-                 tracer_configs):
-        tracer = init_tracer(self.__class__.__name__, **tracer_configs)
+                 tracer_configs,
+                 parsed_query_cache_size=1024,
+                 cmd_batch_size=1,
+                 cmd_batch_max_linger_ms=0,
+                 state_snapshot_store=None,
+                 state_snapshot_every_n_events=1000,
+                 state_snapshot_interval_seconds=60,
+                 pending_query_ttl_seconds=300,
+                 pending_query_max_size=10000,
+                 requeue_queries_on_publisher_removed=False,
+                 metrics_http_port=None,
+                 metrics_redis_key=None,
+                 metrics_redis_interval_seconds=10,
+                 key_scheme=KEY_SCHEME_LEGACY,
+                 buffer_stream_sharing=BUFFER_STREAM_SHARING_EXACT,
+                 shard_id=None,
+                 shard_ids=None,
+                 shard_virtual_nodes=64,
+                 shard_join_timeout_seconds=5,
+                 parse_executor_workers=0,
+                 full_state_dump_min_interval_seconds=60,
+                 event_dedupe_ttl_seconds=600,
+                 event_dedupe_max_size=10000,
+                 query_catalog=None):
+        # each shard has its own name, and so its own consumer group, reading all the events.
+        name = self.__class__.__name__
+        if shard_id is not None:
+            name = f'{name}-{shard_id}'
+        # the tracer is only initialized when first used (see the tracer property)
+        self.tracer_configs = tracer_configs
+        self._tracer = None
         super(ClientManager, self).__init__(
-            name=self.__class__.__name__,
+            name=name,
             service_stream_key=service_stream_key,
             service_cmd_key_list=service_cmd_key_list,
             pub_event_list=pub_event_list,
             service_details=service_details,
             stream_factory=stream_factory,
             logging_level=logging_level,
-            tracer=tracer,
+            tracer=None,
         )
 
         self.cmd_validation_fields = ['id']
         self.data_validation_fields = ['id']
 
-        self.query_parser = QueryParser()
+        self.query_parser = LazyQueryParser()
+        self.parsed_query_cache = ParsedQueryCache(self.query_parser, max_size=parsed_query_cache_size)
+        self.parse_executor = None
+        if parse_executor_workers > 0:
+            self.parse_executor = QueryParseExecutor(max_workers=parse_executor_workers)
 
-        self.queries = {}
-        self.buffer_hash_to_query_map = {}
-        self.publishers = {}
+        self.queries = TrackedDict()
+        self.bufferstreams = BufferStreamIndex()
+        self.publisher_to_query_map = ManyToOneIndex()
+        # publisher_id -> its buffer stream keys, so that they can be re-keyed when the publisher is updated
+        self.publisher_to_buffer_stream_map = ManyToOneIndex()
+        # content type -> shared bufferstream keys, the queries of a shared bufferstream depend on all its content types
+        self.content_type_to_buffer_stream_map = ManyToManyIndex()
+        self.bufferstream_planner = BufferStreamPlanner(mode=buffer_stream_sharing)
+        self.subscriber_to_query_map = ManyToOneIndex()
+        self.content_type_to_query_map = ManyToManyIndex()
+        self.publishers = TrackedDict()
+        self.pending_queries = PendingQueryStore(ttl_seconds=pending_query_ttl_seconds, max_size=pending_query_max_size)
+        self.requeue_queries_on_publisher_removed = requeue_queries_on_publisher_removed
+        self.key_generator = self.create_key_generator(key_scheme)
 
         self.service_registry = service_registry
 
+        self.cmd_batch_size = cmd_batch_size
+        self.cmd_batch_max_linger_ms = cmd_batch_max_linger_ms
+        self._buffered_pub_events = None
+        # when set (eg: by the async runtime), the published events are added to it instead of written
+        self.pub_events_sink = None
+        # once a write of published events fails, the state is no longer snapshotted as processed
+        self.pub_events_write_failed = False
+        # serialized snapshot taken while publishing to the sink, saved once the sink events are written
+        self.pending_state_snapshot = None
+
+        self.last_processed_stream_ids = {}
+        self.event_dedupe_window = EventIdDedupeWindow(
+            ttl_seconds=event_dedupe_ttl_seconds, max_size=event_dedupe_max_size)
+        self.state_snapshot_store = state_snapshot_store
+        self.query_catalog = query_catalog
+        self.state_snapshot_every_n_events = state_snapshot_every_n_events
+        self.state_snapshot_interval_seconds = state_snapshot_interval_seconds
+        self._events_since_state_snapshot = 0
+        self._last_state_snapshot_time = time.monotonic()
+
+        self.shard_id = shard_id
+        self.shard_ring = None
+        if shard_id is not None:
+            self.shard_ring = ConsistentHashRing(
+                shard_ids=set(shard_ids or []) | {shard_id}, virtual_nodes=shard_virtual_nodes)
+        self.shard_join_timeout_seconds = shard_join_timeout_seconds
+        # while joining, the events owned by a single shard wait until the other shards announced their membership
+        self.shard_join_deadline = None
+        self.shard_join_deferred_events = []
+
+        self.event_type_handlers = {}
+        self.event_type_metrics = {}
+        self.setup_event_type_handlers()
+
+        self.publish_latency = LatencyHistogram()
+        self.metrics_registry = CollectorRegistry()
+        self.metrics_registry.register(ClientManagerMetricsCollector(self))
+        self.metrics_http_port = metrics_http_port
+        self.metrics_redis_key = metrics_redis_key
+        self.metrics_redis_interval_seconds = metrics_redis_interval_seconds
+        self._metrics_redis_writer_stopped = threading.Event()
+        self._metrics_redis_writer = None
+
+        self.full_state_dump_min_interval_seconds = full_state_dump_min_interval_seconds
+        self._last_full_state_dump_time = None
+
+    @property
+    def tracer(self):
+        if self._tracer is None:
+            self._tracer = init_tracer(self.name, **self.tracer_configs)
+        return self._tracer
+
+    @tracer.setter
+    def tracer(self, tracer):
+        self._tracer = tracer
+
+    @property
+    def buffer_hash_to_query_map(self):
+        return self.bufferstreams.buffer_hash_to_query_map
+
+    @contextmanager
+    def batched_publishing(self):
+        if self._buffered_pub_events is not None:
+            yield
+            return
+
+        self._buffered_pub_events = []
+        try:
+            yield
+        finally:
+            buffered_pub_events = self._buffered_pub_events
+            self._buffered_pub_events = None
+            self.add_query_catalog_update(buffered_pub_events)
+            self.flush_pub_events(buffered_pub_events)
+
+    def flush_pub_events(self, buffered_pub_events):
+        if buffered_pub_events and self.pub_events_sink is not None:
+            self.pub_events_sink.extend(buffered_pub_events)
+        elif buffered_pub_events:
+            self.logger.debug(f'Flushing {len(buffered_pub_events)} published events')
+            start_time = time.perf_counter()
+            try:
+                # the catalog is updated atomically with the events, so it's read consistently with them
+                write_events_pipelined(buffered_pub_events, transaction=self.query_catalog is not None)
+            except Exception:
+                self.pub_events_write_failed = True
+                raise
+            self.publish_latency.observe(time.perf_counter() - start_time)
+
+    def get_query_catalog_buffer_stream_dict(self, buffer_stream_key):
+        query_ids = self.bufferstreams.get_query_ids(buffer_stream_key)
+        if not query_ids:
+            return None
+        query_ids = sorted(query_ids)
+        buffer_stream_dict = record_to_dict(self.queries[query_ids[0]]['buffer_stream'])
+        buffer_stream_dict['query_ids'] = query_ids
+        return buffer_stream_dict
+
+    def add_query_catalog_update(self, buffered_pub_events):
+        """Adds the query catalog changes of the published events, to be written along with them."""
+        if self.query_catalog is None:
+            return
+        update = self.query_catalog.pop_update(self.get_query_catalog_buffer_stream_dict, self.owns_shard_key)
+        if update is not None:
+            buffered_pub_events.append((self.query_catalog, update))
+
+    def rebuild_query_catalog(self):
+        if self.query_catalog is None:
+            return
+        for query in self.queries.values():
+            self.query_catalog.set_query(query)
+        self.logger.info(f'Rebuilding query catalog with {len(self.queries)} queries')
+        # with other shards, the entries of the publishers taken over from them are written by their handovers,
+        # which may still be on their way, so none of them is removed
+        with_other_shards = self.shard_ring is not None and len(self.shard_ring) > 1
+        self.query_catalog.rebuild(
+            self.query_catalog.pop_update(self.get_query_catalog_buffer_stream_dict, self.owns_shard_key),
+            (lambda publisher_id: False) if with_other_shards else self.owns_shard_key)
+
+    def publish_event_type_to_stream(self, event_type, new_event_data):
+        if self._buffered_pub_events is None:
+            start_time = time.perf_counter()
+            ret = super(ClientManager, self).publish_event_type_to_stream(event_type, new_event_data)
+            self.publish_latency.observe(time.perf_counter() - start_time)
+            return ret
+
+        pub_stream = self.pub_event_stream_map.get(event_type)
+        if pub_stream is None:
+            raise RuntimeError(f'No publishing stream defined for event type: {event_type}!')
+
+        self.logger.info(f'Publishing "{event_type}" entity: {new_event_data}')
+        event_data = self.inject_current_tracer_into_event_data(new_event_data)
+        self._buffered_pub_events.append((pub_stream, self.default_event_serializer(event_data)))
+
     def publish_query_created(self, query):
         new_event_data = query.copy()
         new_event_data['id'] = self.service_based_random_event_id()
         self.publish_event_type_to_stream(event_type='QueryCreated', new_event_data=new_event_data)
+        if self.query_catalog is not None:
+            self.query_catalog.set_query(query)
 
     def publish_query_removed(self, query):
         new_event_data = query.copy()
         new_event_data['id'] = self.service_based_random_event_id()
         new_event_data['deleted'] = True
         self.publish_event_type_to_stream(event_type='QueryRemoved', new_event_data=new_event_data)
+        if self.query_catalog is not None:
+            self.query_catalog.remove_query(query)
+
+    def create_key_generator(self, key_scheme):
+        return KeyGenerator(
+            scheme=key_scheme,
+            buffer_stream_key_in_use=lambda buffer_stream_key: buffer_stream_key in self.bufferstreams,
+            query_id_in_use=lambda query_id: query_id in self.queries or query_id in self.pending_queries,
+        )
 
     def get_unique_buffer_hash(self, query_content, publisher_id, resolution, fps):
-        keys_list = tuple(query_content) + tuple([publisher_id, resolution, fps])
-        unhashed_key = '-'.join(keys_list)
-        hash_key = hashlib.md5(unhashed_key.encode())
-        return hash_key.hexdigest()
+        return self.key_generator.get_buffer_stream_key(query_content, publisher_id, resolution, fps)
 
     def create_query_id(self, subscriber_id, query_name):
-        key = f'{subscriber_id}_{query_name}'
-        query_id = hashlib.md5(key.encode('utf-8')).hexdigest()
-        return query_id
+        return self.key_generator.get_query_id(subscriber_id, query_name)
+
+    def parse_query(self, query_text):
+        return self.parsed_query_cache.parse(query_text)
+
+    def get_cmd_event_query_texts(self, event_type, event_data):
+        if event_type == 'QueryReceived':
+            query_texts = [event_data['query']]
+        elif event_type == 'QueryBulkReceived':
+            query_texts = event_data['queries']
+        else:
+            return []
+        subscriber_id = event_data.get('subscriber_id')
+        return [
+            query_text for query_text in query_texts
+            if self.owns_shard_key(self.get_query_shard_key(subscriber_id, query_text))
+        ]
+
+    def prefetch_query_parses(self, cmd_events):
+        """
+        Submits the query texts of the batch events to the parse executor, so that they are parsed in parallel
+        while the events are processed in order. Invalid events are left to fail when processed.
+        """
+        query_texts = []
+        for event_type, _, json_msg in cmd_events:
+            try:
+                event_data = self.default_event_deserializer(json_msg)
+                if event_data.get('id') in self.event_dedupe_window:
+                    continue
+                query_texts.extend(self.get_cmd_event_query_texts(event_type, event_data))
+            except Exception:
+                continue
+        self.parsed_query_cache.prefetch(query_texts, self.parse_executor)
 
     def create_query_dict(self, query_received_event_id, subscriber_id, query_text):
-        parsed_query = self.query_parser.parse(query_text)
+        parsed_query = self.parse_query(query_text)
+        return self.create_query_dict_from_parsed_query(query_received_event_id, subscriber_id, parsed_query)
+
+    def create_query_dict_from_parsed_query(self, query_received_event_id, subscriber_id, parsed_query):
         query_id = self.create_query_id(subscriber_id, parsed_query['name'])
 
-        query = {
-            'subscriber_id': subscriber_id,
-            'query_id': query_id,
-            'parsed_query': {
-                'name': parsed_query['name'],
-                'output': parsed_query['output'],
-                'from': parsed_query['from'],
-                'content': parsed_query['content'],
-                'match': parsed_query['match'],
-                'optional_match': parsed_query.get('optional_match', ''),
-                'where': parsed_query.get('where', ''),
-                'window': parsed_query['window'],
-                'ret': parsed_query['ret'],
-                'qos_policies': parsed_query.get('qos_policies', {}),
-                # 'cypher_query': query['cypher_query'],
-            },
-            'query_received_event_id': query_received_event_id
-        }
+        query = QueryRecord(
+            subscriber_id=subscriber_id,
+            query_id=query_id,
+            parsed_query=parsed_query,
+            query_received_event_id=query_received_event_id,
+        )
         publisher_id = query['parsed_query']['from'][0]
         buffer_stream_dict = self.generate_query_bufferstream_dict(query)
         if buffer_stream_dict is None:
-            self.logger.info(f'Publisher id {publisher_id} not available. Will not process Query {query}')
+            self.logger.info(f'Publisher id {publisher_id} not available. Query {query_id} will wait for it')
             return
 
-        query['buffer_stream'] = buffer_stream_dict
+        query['buffer_stream'] = BufferStreamRecord.from_dict(buffer_stream_dict)
         query['service_chain'] = self.generate_query_service_chain(query)
         return query
 
+    def get_query_chain_content(self, query):
+        # queries of a shared bufferstream use its (superset) chain
+        buffer_stream = query['buffer_stream']
+        if buffer_stream is not None and buffer_stream.get('content') is not None:
+            return buffer_stream['content']
+        return query['parsed_query']['content']
+
     def generate_query_service_chain(self, query):
-        content_types = query['parsed_query']['content']
-        service_function_chain = self.service_registry.get_service_function_chain_by_content_type_list(content_types)
+        content_types = self.get_query_chain_content(query)
+        service_function_chain = self.service_registry.get_service_function_chain_by_content_type_list(
+            content_types, query['parsed_query'].get('qos_policies'))
         return service_function_chain
 
-    def generate_query_bufferstream_dict(self, query):
+    def get_publisher_buffer_stream_contents(self, publisher_id):
+        for buffer_stream_key in self.publisher_to_buffer_stream_map.get_items(publisher_id):
+            query_id = next(iter(self.bufferstreams.get_query_ids(buffer_stream_key)))
+            yield self.queries[query_id]['buffer_stream'].get('content')
+
+    def generate_query_bufferstream_dict(self, query, buffer_stream_content=None):
         publisher_id = query['parsed_query']['from'][0]
         publisher = self.publishers.get(publisher_id, None)
         if publisher is None:
@@ -106,114 +350,1087 @@ class ClientManager(BaseEventDrivenCMDService):
         source = publisher['source']
         resolution = publisher['meta']['resolution']
         fps = publisher['meta']['fps']
-        query_content = query['parsed_query']['content']
+        if buffer_stream_content is None:
+            buffer_stream_content = self.bufferstream_planner.plan_content(
+                query['parsed_query']['content'], self.get_publisher_buffer_stream_contents(publisher_id))
         buffer_stream_key = self.get_unique_buffer_hash(
-            query_content, publisher_id, resolution, fps
+            self.bufferstream_planner.get_key_content(buffer_stream_content), publisher_id, resolution, fps
         )
-        return {
+        buffer_stream_dict = {
             'publisher_id': publisher_id,
             'buffer_stream_key': buffer_stream_key,
             'source': source,
             'resolution': resolution,
             'fps': fps,
         }
+        if self.bufferstream_planner.shares_buffer_streams:
+            buffer_stream_dict['content'] = list(buffer_stream_content)
+        return buffer_stream_dict
 
     def update_bufferstreams_from_new_query(self, query):
         buffer_stream_key = query['buffer_stream']['buffer_stream_key']
-        buffer_query_set = self.buffer_hash_to_query_map.setdefault(buffer_stream_key, set())
-        query_id = query['query_id']
-        buffer_query_set.add(query_id)
+        self.bufferstreams.add(buffer_stream_key, query['query_id'])
 
     def update_bufferstreams_from_del_query(self, query_id):
-        buffer_to_remove = None
-        for buffer_hash, query_set in self.buffer_hash_to_query_map.items():
-            if query_id in query_set:
-                query_set.remove(query_id)
-                if len(query_set) == 0:
-                    buffer_to_remove = buffer_hash
-                    break
-        if buffer_to_remove:
-            del self.buffer_hash_to_query_map[buffer_to_remove]
+        return self.bufferstreams.remove(query_id)
+
+    def update_publisher_bufferstreams_from_del_keys(self, buffer_stream_keys):
+        for buffer_stream_key in buffer_stream_keys:
+            if buffer_stream_key not in self.bufferstreams:
+                self.publisher_to_buffer_stream_map.remove(buffer_stream_key)
+                self.content_type_to_buffer_stream_map.remove(buffer_stream_key)
+
+    def update_indexes_from_new_query(self, query):
+        self.update_bufferstreams_from_new_query(query=query)
+        buffer_stream_key = query['buffer_stream']['buffer_stream_key']
+        self.publisher_to_buffer_stream_map.add(query['buffer_stream']['publisher_id'], buffer_stream_key)
+        buffer_stream_content = query['buffer_stream'].get('content')
+        if buffer_stream_content is not None and not self.content_type_to_buffer_stream_map.get_keys(buffer_stream_key):
+            self.content_type_to_buffer_stream_map.add(buffer_stream_content, buffer_stream_key)
+        self.publisher_to_query_map.add(query['buffer_stream']['publisher_id'], query['query_id'])
+        self.subscriber_to_query_map.add(query['subscriber_id'], query['query_id'])
+        self.content_type_to_query_map.add(query['parsed_query']['content'], query['query_id'])
+
+    def update_indexes_from_del_query(self, query_id):
+        buffer_stream_key = self.update_bufferstreams_from_del_query(query_id)
+        if buffer_stream_key is not None:
+            self.update_publisher_bufferstreams_from_del_keys([buffer_stream_key])
+        self.publisher_to_query_map.remove(query_id)
+        self.subscriber_to_query_map.remove(query_id)
+        self.content_type_to_query_map.remove(query_id)
+
+    def is_duplicated_query_text(self, subscriber_id, query_text):
+        # only checks the already parsed queries, so that duplicated submissions are
+        # rejected without having to parse the same query text again.
+        parsed_query = self.parsed_query_cache.get(query_text)
+        if parsed_query is None:
+            return False
+        query_id = self.create_query_id(subscriber_id, parsed_query['name'])
+        return query_id in self.queries
 
     def process_query_received(self, query_received_event_id, subscriber_id, query_text):
-        query = self.create_query_dict(query_received_event_id, subscriber_id, query_text)
+        if self.is_duplicated_query_text(subscriber_id, query_text):
+            self.logger.info('Ignoring duplicated query addition')
+            return
+        parsed_query = self.parse_query(query_text)
+        query = self.create_query_dict_from_parsed_query(query_received_event_id, subscriber_id, parsed_query)
         if query is not None:
-            if query['query_id'] not in self.queries.keys():
-                self.queries[query['query_id']] = query
-                self.publish_query_created(query=query)
-                self.update_bufferstreams_from_new_query(query=query)
+            self.register_query(query)
+        else:
+            self.add_pending_query(query_received_event_id, subscriber_id, parsed_query)
+
+    def process_bulk_query_text(self, query_received_event_id, subscriber_id, query_text, batch_query_ids):
+        try:
+            parsed_query = self.parse_query(query_text)
+            query_name = parsed_query.get('name')
+            if not query_name:
+                raise ValueError('Query without name')
+            query_id = self.create_query_id(subscriber_id, query_name)
+        except Exception as e:
+            return {'query_name': None, 'query_id': None, 'status': 'error', 'error': str(e)}
+
+        result = {'query_name': query_name, 'query_id': query_id, 'status': None, 'error': None}
+        if query_id in batch_query_ids or query_id in self.queries:
+            result['status'] = 'duplicated'
+            return result
+        batch_query_ids.add(query_id)
+
+        try:
+            query = self.create_query_dict_from_parsed_query(query_received_event_id, subscriber_id, parsed_query)
+            if query is None:
+                self.add_pending_query(query_received_event_id, subscriber_id, parsed_query)
+                result['status'] = 'pending'
             else:
-                self.logger.info('Ignoring duplicated query addition')
+                self.register_query(query)
+                result['status'] = 'created'
+        except Exception as e:
+            self.logger.exception(e)
+            result['status'] = 'error'
+            result['error'] = str(e)
+        return result
+
+    def process_query_bulk_received(self, query_bulk_received_event_id, subscriber_id, query_texts):
+        """
+        Registers many queries of the same subscriber at once, publishing all the created queries
+        and a QueryBulkProcessed event with one result per query text (in the same order) in a single batch.
+        A query that fails to be parsed or registered is reported in its result, without affecting the others.
+        On the sharded mode, each shard only processes (and reports) the queries it owns.
+        """
+        results = []
+        batch_query_ids = set()
+        with self.batched_publishing():
+            for index, query_text in enumerate(query_texts):
+                try:
+                    shard_key = self.get_query_shard_key(subscriber_id, query_text)
+                except Exception:
+                    # invalid query texts (eg: not strings) are reported by the shard owning their subscriber
+                    shard_key = subscriber_id
+                if not self.owns_shard_key(shard_key):
+                    continue
+                result = self.process_bulk_query_text(
+                    query_bulk_received_event_id, subscriber_id, query_text, batch_query_ids)
+                result['index'] = index
+                results.append(result)
+            if not results:
+                return results
+            status_counts = Counter(result['status'] for result in results)
+            self.logger.info(f'Processed bulk of {len(results)} queries: {dict(status_counts)}')
+            self.publish_query_bulk_processed(query_bulk_received_event_id, subscriber_id, results)
+        return results
+
+    def publish_query_bulk_processed(self, query_bulk_received_event_id, subscriber_id, results):
+        new_event_data = {
+            'id': self.service_based_random_event_id(),
+            'query_bulk_received_event_id': query_bulk_received_event_id,
+            'subscriber_id': subscriber_id,
+            'results': results,
+        }
+        self.publish_event_type_to_stream(event_type='QueryBulkProcessed', new_event_data=new_event_data)
+
+    def register_query(self, query):
+        if query['query_id'] not in self.queries.keys():
+            self.queries[query['query_id']] = query
+            self.publish_query_created(query=query)
+            self.update_indexes_from_new_query(query=query)
+            return True
+        else:
+            self.logger.info('Ignoring duplicated query addition')
+            return False
+
+    def unregister_query(self, query_id):
+        query = self.queries.pop(query_id, None)
+        if query is not None:
+            self.update_indexes_from_del_query(query_id)
+        return query
+
+    def add_pending_query(self, query_received_event_id, subscriber_id, parsed_query):
+        query_id = self.create_query_id(subscriber_id, parsed_query['name'])
+        self.pending_queries.add(
+            query_id=query_id,
+            publisher_id=parsed_query['from'][0],
+            query_received_event_id=query_received_event_id,
+            subscriber_id=subscriber_id,
+            parsed_query=parsed_query,
+        )
+
+    def process_pending_queries_for_publisher(self, publisher_id):
+        pending_queries = self.pending_queries.pop_publisher(publisher_id)
+        if not pending_queries:
+            return
+
+        self.logger.info(f'Processing {len(pending_queries)} pending queries for publisher {publisher_id}')
+        with self.batched_publishing():
+            for pending_query in pending_queries:
+                query = self.create_query_dict_from_parsed_query(
+                    pending_query.query_received_event_id, pending_query.subscriber_id, pending_query.parsed_query
+                )
+                if query is not None:
+                    self.register_query(query)
+
+    def get_query_ids_by_subscriber(self, subscriber_id):
+        return self.subscriber_to_query_map.get_items(subscriber_id)
+
+    def get_query_ids_by_publisher(self, publisher_id):
+        return self.publisher_to_query_map.get_items(publisher_id)
+
+    def get_query_ids_by_content_type(self, content_type):
+        return self.content_type_to_query_map.get_items(content_type)
+
+    def lookup_queries(self, subscriber_id=None, publisher_id=None, content_type=None):
+        """
+        Returns the queries (sorted by query_id) matching all the given filters, using the secondary indexes.
+        With a single filter it takes O(result) time, with more filters O(smallest filter result).
+        """
+        query_id_sets = []
+        if subscriber_id is not None:
+            query_id_sets.append(self.get_query_ids_by_subscriber(subscriber_id))
+        if publisher_id is not None:
+            query_id_sets.append(self.get_query_ids_by_publisher(publisher_id))
+        if content_type is not None:
+            query_id_sets.append(self.get_query_ids_by_content_type(content_type))
+        if not query_id_sets:
+            raise ValueError('At least one of subscriber_id, publisher_id or content_type is required')
+
+        query_id_sets.sort(key=len)
+        query_ids = [
+            query_id for query_id in query_id_sets[0]
+            if all(query_id in query_id_set for query_id_set in query_id_sets[1:])
+        ]
+        return [self.queries[query_id] for query_id in sorted(query_ids)]
+
+    def process_query_lookup_requested(self, query_lookup_requested_event_id, subscriber_id, publisher_id,
+                                       content_type):
+        new_event_data = {
+            'id': self.service_based_random_event_id(),
+            'query_lookup_requested_event_id': query_lookup_requested_event_id,
+            'queries': [],
+            'error': None,
+        }
+        try:
+            queries = self.lookup_queries(
+                subscriber_id=subscriber_id, publisher_id=publisher_id, content_type=content_type)
+            new_event_data['queries'] = [record_to_dict(query) for query in queries]
+        except ValueError as e:
+            new_event_data['error'] = str(e)
+        self.publish_event_type_to_stream(event_type='QueryLookupResponded', new_event_data=new_event_data)
 
     def process_query_deletion_requested(self, subscriber_id, query_name):
         query_id = self.create_query_id(subscriber_id, query_name)
 
-        query = self.queries.pop(query_id, None)
+        query = self.unregister_query(query_id)
         if query is None:
-            self.logger.info('Ignoring removal of non-existing query')
+            if self.pending_queries.remove(query_id) is not None:
+                self.logger.info('Removed pending query')
+            else:
+                self.logger.info('Ignoring removal of non-existing query')
         else:
-            self.publish_query_removed(query=query)
-            self.update_bufferstreams_from_del_query(query_id)
+            with self.batched_publishing():
+                self.publish_query_removed(query=query)
+                self.replan_buffer_streams_without_host([query])
+
+    def replan_buffer_streams_without_host(self, removed_queries):
+        """
+        On the superset mode, the queries that joined a wider bufferstream use the chain of its content types,
+        which is only needed while a query with all of them (its host) uses it. Once the last host is removed,
+        the remaining queries are planned again (eg: joining another superset bufferstream or getting their own),
+        publishing them as removed and created again.
+        """
+        if self.bufferstream_planner.mode != BUFFER_STREAM_SHARING_SUPERSET:
+            return
+        replanned_queries = []
+        for buffer_stream_key in {query['buffer_stream']['buffer_stream_key'] for query in removed_queries}:
+            queries = [self.queries[query_id] for query_id in self.bufferstreams.get_query_ids(buffer_stream_key)]
+            if not queries:
+                continue
+            buffer_stream_content = set(queries[0]['buffer_stream']['content'])
+            if any(set(query['parsed_query']['content']) == buffer_stream_content for query in queries):
+                continue
+            for query in queries:
+                self.unregister_query(query['query_id'])
+            replanned_queries.extend(queries)
+
+        # the widest queries are planned first, so that the narrower ones can join their bufferstreams
+        replanned_queries.sort(key=lambda query: (-len(set(query['parsed_query']['content'])), query['query_id']))
+        for previous_query in replanned_queries:
+            query = QueryRecord.from_dict(previous_query.copy())
+            query['buffer_stream'] = BufferStreamRecord.from_dict(self.generate_query_bufferstream_dict(query))
+            query['service_chain'] = self.generate_query_service_chain(query)
+            self.logger.info(
+                f'Moving query {query["query_id"]} to bufferstream {query["buffer_stream"]["buffer_stream_key"]}')
+            self.publish_query_removed(query=previous_query)
+            self.register_query(query)
+
+    def unregister_subscriber_queries(self, subscriber_id):
+        """
+        Unregisters all queries of a subscriber in a single pass over its queries,
+        removing them from each bufferstream (and the other indexes) only once per key.
+        """
+        query_ids = self.subscriber_to_query_map.pop_key(subscriber_id)
+        queries = [self.queries.pop(query_id) for query_id in query_ids]
+        buffer_stream_removed_query_ids = self.bufferstreams.remove_items(query_ids)
+        self.update_publisher_bufferstreams_from_del_keys(buffer_stream_removed_query_ids.keys())
+        self.publisher_to_query_map.remove_items(query_ids)
+        for query_id in query_ids:
+            self.content_type_to_query_map.remove(query_id)
+        return queries
+
+    def process_subscriber_queries_deletion_requested(self, subscriber_id):
+        queries = self.unregister_subscriber_queries(subscriber_id)
+        pending_queries = self.pending_queries.pop_subscriber(subscriber_id)
+        if not queries and not pending_queries:
+            self.logger.info('Ignoring removal of queries of subscriber without queries')
+            return
+
+        self.logger.info(
+            f'Removing {len(queries)} queries and {len(pending_queries)} pending queries of subscriber {subscriber_id}')
+        with self.batched_publishing():
+            for query in sorted(queries, key=lambda query: query['query_id']):
+                self.publish_query_removed(query=query)
+            self.replan_buffer_streams_without_host(queries)
 
     def process_publisher_created(self, publisher_id, source, meta):
         if publisher_id not in self.publishers.keys():
-            self.publishers[publisher_id] = {
-                'id': publisher_id,
-                'source': source,
-                'meta': meta,
-            }
+            self.publishers[publisher_id] = PublisherRecord(id=publisher_id, source=source, meta=meta)
+            self.process_pending_queries_for_publisher(publisher_id)
         else:
             self.logger.info('Ignoring duplicated publisher incluson')
 
+    def rekey_publisher_bufferstreams(self, publisher_id):
+        """
+        Recomputes the bufferstreams of the publisher queries from its current record (eg: new resolution or fps),
+        moving the queries of each of its bufferstream keys to the new key in place.
+        Returns the (previous query dict, query) of the queries whose bufferstream changed, sorted by query id.
+        """
+        changed_queries = []
+        for buffer_stream_key in list(self.publisher_to_buffer_stream_map.get_items(publisher_id)):
+            # the new bufferstream only depends on its content, so it's computed once per content
+            content_buffer_streams = {}
+            for query_id in list(self.bufferstreams.get_query_ids(buffer_stream_key)):
+                query = self.queries[query_id]
+                buffer_stream_content = tuple(
+                    query['buffer_stream'].get('content') or query['parsed_query']['content'])
+                buffer_stream_dict = content_buffer_streams.get(buffer_stream_content)
+                if buffer_stream_dict is None:
+                    buffer_stream_dict = content_buffer_streams[buffer_stream_content] = \
+                        self.generate_query_bufferstream_dict(query, buffer_stream_content=buffer_stream_content)
+                if query['buffer_stream'] == buffer_stream_dict:
+                    continue
+
+                previous_query = query.copy()
+                query['buffer_stream'] = BufferStreamRecord.from_dict(buffer_stream_dict)
+                # moves the query to its new bufferstream key, the old one is removed once it has no queries left
+                self.update_indexes_from_new_query(query=query)
+                changed_queries.append((previous_query, query))
+            self.update_publisher_bufferstreams_from_del_keys([buffer_stream_key])
+        changed_queries.sort(key=lambda queries: queries[1]['query_id'])
+        return changed_queries
+
+    def process_publisher_updated(self, publisher_id, source, meta):
+        publisher = self.publishers.get(publisher_id, None)
+        if publisher is None:
+            self.logger.info('Ignoring update of non-existing publisher')
+            return
+
+        # missing fields (eg: an update with only the new fps) keep their current values
+        updated_publisher = PublisherRecord(
+            id=publisher_id,
+            source=source if source is not None else publisher['source'],
+            meta={**publisher['meta'], **(meta or {})},
+        )
+        if updated_publisher == publisher:
+            self.logger.info('Ignoring publisher update without changes')
+            return
+
+        self.publishers[publisher_id] = updated_publisher
+        changed_queries = self.rekey_publisher_bufferstreams(publisher_id)
+        if not changed_queries:
+            return
+
+        self.logger.info(f'Updating the bufferstream of {len(changed_queries)} queries from publisher {publisher_id}')
+        with self.batched_publishing():
+            for previous_query, query in changed_queries:
+                self.publish_query_removed(query=previous_query)
+                self.publish_query_created(query=query)
+
     def process_publisher_removed(self, publisher_id):
         publisher = self.publishers.pop(publisher_id, None)
         if publisher is None:
             self.logger.info('Ignoring removal of non-existing publisher')
+            return
+
+        # sorted, so the QueryRemoved events are published in the same order on every run
+        query_ids = sorted(self.publisher_to_query_map.get_items(publisher_id))
+        if not query_ids:
+            return
+
+        self.logger.info(f'Removing {len(query_ids)} queries from removed publisher {publisher_id}')
+        with self.batched_publishing():
+            for query_id in query_ids:
+                query = self.unregister_query(query_id)
+                self.publish_query_removed(query=query)
+                if self.requeue_queries_on_publisher_removed:
+                    self.add_pending_query(
+                        query['query_received_event_id'], query['subscriber_id'], freeze(query['parsed_query'])
+                    )
+
+    def update_service_chains_for_content_types(self, content_types):
+        query_ids = self.content_type_to_query_map.get_items_for_any_key(content_types)
+        for buffer_stream_key in self.content_type_to_buffer_stream_map.get_items_for_any_key(content_types):
+            query_ids.update(self.bufferstreams.get_query_ids(buffer_stream_key))
+        if not query_ids:
+            return
+
+        with self.batched_publishing():
+            for query_id in query_ids:
+                query = self.queries[query_id]
+                service_chain = self.generate_query_service_chain(query)
+                if service_chain != query['service_chain']:
+                    self.logger.info(f'Updating service chain of query {query_id} to: {service_chain}')
+                    self.publish_query_removed(query=query)
+                    query['service_chain'] = service_chain
+                    self.publish_query_created(query=query)
 
     def process_service_worker_announced(self, worker):
-        service_type = worker['service_type']
-        stream_key = worker['stream_key']
-        service_dict = self.service_registry.available_services.setdefault(service_type, {'workers': {}})
-        service_dict['workers'][stream_key] = worker
+        changed_content_types = self.service_registry.add_worker(worker)
+        self.update_service_chains_for_content_types(changed_content_types)
+
+    def process_service_worker_removed(self, worker):
+        changed_content_types = self.service_registry.remove_worker(worker['stream_key'])
+        if changed_content_types is None:
+            self.logger.info('Ignoring removal of non-existing service worker')
+            return
+        self.update_service_chains_for_content_types(changed_content_types)
+
+    def expire_service_workers(self):
+        expired_stream_keys, changed_content_types = self.service_registry.expire_workers()
+        if expired_stream_keys:
+            self.logger.info(f'Removed service workers without heartbeat: {expired_stream_keys}')
+            self.update_service_chains_for_content_types(changed_content_types)
+
+    def register_event_type_handler(self, event_type, handler, args_extractor, shard_key_extractor=None):
+        self.event_type_handlers[event_type] = EventTypeHandler(handler, args_extractor, shard_key_extractor)
+        self.event_type_metrics.setdefault(event_type, EventTypeMetrics())
+
+    def setup_event_type_handlers(self):
+        self.register_event_type_handler(
+            'QueryReceived', 'process_query_received',
+            {'query_received_event_id': 'id', 'subscriber_id': 'subscriber_id', 'query_text': 'query'},
+            lambda event_data: self.get_query_shard_key(event_data['subscriber_id'], event_data['query'])
+        )
+        self.register_event_type_handler(
+            'QueryBulkReceived', 'process_query_bulk_received',
+            {'query_bulk_received_event_id': 'id', 'subscriber_id': 'subscriber_id', 'query_texts': 'queries'}
+        )
+        self.register_event_type_handler(
+            'QueryDeletionRequested', 'process_query_deletion_requested',
+            {'subscriber_id': 'subscriber_id', 'query_name': 'query_name'}
+        )
+        self.register_event_type_handler(
+            'SubscriberQueriesDeletionRequested', 'process_subscriber_queries_deletion_requested',
+            {'subscriber_id': 'subscriber_id'}
+        )
+        self.register_event_type_handler(
+            'QueryLookupRequested', 'process_query_lookup_requested',
+            lambda event_data: {
+                'query_lookup_requested_event_id': event_data['id'],
+                'subscriber_id': event_data.get('subscriber_id'),
+                'publisher_id': event_data.get('publisher_id'),
+                'content_type': event_data.get('content_type'),
+            },
+            # on the sharded mode only the owner of the publisher answers, otherwise each shard answers with its queries
+            lambda event_data: event_data.get('publisher_id')
+        )
+        self.register_event_type_handler(
+            'PublisherCreated', 'process_publisher_created',
+            {'publisher_id': 'publisher_id', 'source': 'source', 'meta': 'meta'},
+            'publisher_id'
+        )
+        self.register_event_type_handler(
+            'PublisherUpdated', 'process_publisher_updated',
+            lambda event_data: {
+                'publisher_id': event_data['publisher_id'],
+                'source': event_data.get('source'),
+                'meta': event_data.get('meta'),
+            },
+            'publisher_id'
+        )
+        self.register_event_type_handler(
+            'PublisherRemoved', 'process_publisher_removed',
+            {'publisher_id': 'publisher_id'},
+            'publisher_id'
+        )
+        self.register_event_type_handler(
+            'ServiceWorkerAnnounced', 'process_service_worker_announced',
+            {'worker': 'worker'}
+        )
+        self.register_event_type_handler(
+            'ServiceWorkerRemoved', 'process_service_worker_removed',
+            {'worker': 'worker'}
+        )
+        self.register_event_type_handler(
+            'ClientManagerShardJoined', 'process_shard_joined',
+            lambda event_data: {
+                'shard_id': event_data['shard_id'],
+                'shard_ids': event_data.get('shard_ids', []),
+                'reply_to_shard_id': event_data.get('reply_to_shard_id'),
+            }
+        )
+        self.register_event_type_handler(
+            'ClientManagerShardLeft', 'process_shard_left',
+            {'shard_id': 'shard_id'}
+        )
+        self.register_event_type_handler(
+            'ClientManagerShardStateHandedOver', 'process_shard_state_handed_over',
+            {
+                'target_shard_id': 'target_shard_id',
+                'source_shard_id': 'source_shard_id',
+                'publishers': 'publishers',
+                'queries': 'queries',
+                'pending_queries': 'pending_queries',
+            }
+        )
 
     def process_event_type(self, event_type, event_data, json_msg):
         if not super(ClientManager, self).process_event_type(event_type, event_data, json_msg):
             return False
 
-        if event_type == 'QueryReceived':
-            self.process_query_received(
-                query_received_event_id=event_data['id'],
-                subscriber_id=event_data['subscriber_id'],
-                query_text=event_data['query'],
-            )
-        elif event_type == 'QueryDeletionRequested':
-            self.process_query_deletion_requested(
-                subscriber_id=event_data['subscriber_id'],
-                query_name=event_data['query_name']
-            )
-        elif event_type == 'PublisherCreated':
-            self.process_publisher_created(
-                publisher_id=event_data['publisher_id'],
-                source=event_data['source'],
-                meta=event_data['meta']
-            )
-        elif event_type == 'PublisherRemoved':
-            self.process_publisher_removed(
-                publisher_id=event_data['publisher_id']
-            )
+        event_type_handler = self.event_type_handlers.get(event_type)
+        if event_type_handler is None:
+            self.logger.info(f'Ignoring event of unknown type: {event_type}')
+            return False
+
+        shard_key = event_type_handler.get_shard_key(event_data)
+        if shard_key is not None and self.is_joining_shards():
+            self.shard_join_deferred_events.append((event_type, event_data, json_msg))
+            return False
+        if not self.owns_shard_key(shard_key):
+            self.logger.debug(f'Ignoring {event_type} event owned by another shard: {event_data["id"]}')
+            return False
+
+        event_type_metrics = self.event_type_metrics[event_type]
+        start_time = time.perf_counter()
+        error = True
+        try:
+            handler = event_type_handler.get_handler(self)
+            handler(**event_type_handler.get_handler_kwargs(event_data))
+            error = False
+        finally:
+            event_type_metrics.observe(time.perf_counter() - start_time, error=error)
+        return True
+
+    def get_query_shard_key(self, subscriber_id, query_text):
+        # queries without a FROM publisher are invalid, the shard owning their subscriber handles them
+        publisher_id = extract_query_publisher_id(query_text)
+        if publisher_id is None:
+            return subscriber_id
+        return publisher_id
+
+    def owns_shard_key(self, shard_key):
+        if self.shard_ring is None or shard_key is None:
+            return True
+        return self.shard_ring.get_shard(shard_key) == self.shard_id
+
+    def get_state_publisher_ids(self):
+        publisher_ids = set(self.publishers.keys())
+        publisher_ids.update(self.publisher_to_query_map.key_to_items_map.keys())
+        publisher_ids.update(self.pending_queries.publisher_to_query_ids.keys())
+        return publisher_ids
+
+    def rebalance_shards(self):
+        shard_publisher_ids = {}
+        for publisher_id in self.get_state_publisher_ids():
+            shard_id = self.shard_ring.get_shard(publisher_id)
+            if shard_id != self.shard_id:
+                shard_publisher_ids.setdefault(shard_id, []).append(publisher_id)
+
+        with self.batched_publishing():
+            for shard_id, publisher_ids in shard_publisher_ids.items():
+                self.hand_over_publishers(shard_id, publisher_ids)
+
+    def hand_over_publishers(self, target_shard_id, publisher_ids):
+        """
+        Moves the publishers, with their queries and pending queries, to another shard.
+        The queries are not removed from the system, so no QueryRemoved/QueryCreated events are published.
+        """
+        publishers = []
+        queries = []
+        pending_queries = []
+        for publisher_id in publisher_ids:
+            publisher = self.publishers.pop(publisher_id, None)
+            if publisher is not None:
+                publishers.append(record_to_dict(publisher))
+            for query_id in list(self.publisher_to_query_map.get_items(publisher_id)):
+                queries.append(record_to_dict(self.unregister_query(query_id)))
+            for pending_query in self.pending_queries.pop_publisher(publisher_id):
+                pending_queries.append({
+                    'query_received_event_id': pending_query.query_received_event_id,
+                    'subscriber_id': pending_query.subscriber_id,
+                    'parsed_query': thaw(pending_query.parsed_query),
+                })
 
-        elif event_type == 'ServiceWorkerAnnounced':
-            self.process_service_worker_announced(
-                worker=event_data['worker']
+        self.logger.info(
+            f'Handing over {len(publishers)} publishers, {len(queries)} queries and '
+            f'{len(pending_queries)} pending queries to shard {target_shard_id}'
+        )
+        self.publish_event_type_to_stream(event_type='ClientManagerShardStateHandedOver', new_event_data={
+            'id': self.service_based_random_event_id(),
+            'target_shard_id': target_shard_id,
+            'source_shard_id': self.shard_id,
+            'publishers': publishers,
+            'queries': queries,
+            'pending_queries': pending_queries,
+        })
+
+    def process_shard_state_handed_over(self, target_shard_id, source_shard_id, publishers, queries, pending_queries):
+        if self.shard_ring is None or target_shard_id != self.shard_id:
+            return
+
+        self.logger.info(
+            f'Receiving {len(publishers)} publishers, {len(queries)} queries and '
+            f'{len(pending_queries)} pending queries from shard {source_shard_id}'
+        )
+        for publisher in publishers:
+            self.publishers[publisher['id']] = PublisherRecord.from_dict(publisher)
+        for query in queries:
+            query = QueryRecord.from_dict(query)
+            self.unregister_query(query['query_id'])
+            self.queries[query['query_id']] = query
+            self.update_indexes_from_new_query(query=query)
+            if self.query_catalog is not None:
+                # the bufferstreams of queries handed over in the same batch they changed are left to this shard
+                self.query_catalog.set_query(query)
+        for pending_query in pending_queries:
+            self.add_pending_query(
+                pending_query['query_received_event_id'], pending_query['subscriber_id'],
+                freeze(pending_query['parsed_query'])
             )
+        # queries received before their publisher was handed over are waiting for it
+        for publisher in publishers:
+            self.process_pending_queries_for_publisher(publisher['id'])
+
+    def process_shard_joined(self, shard_id, shard_ids, reply_to_shard_id=None):
+        """
+        Adds the joined shard to the ring, announcing back this shard's membership (unless the event is itself
+        such a reply), so that a shard joining with an incomplete SHARD_IDS learns the whole ring.
+        While this shard is joining, it also merges the ring of the other shards and stops joining
+        on the first one that knows about it.
+        """
+        if self.shard_ring is None or shard_id == self.shard_id:
+            return
+        changed = self.shard_ring.add_shard(shard_id)
+        if reply_to_shard_id is None:
+            self.publish_shard_joined(reply_to_shard_id=shard_id)
+        if self.is_joining_shards():
+            for other_shard_id in shard_ids:
+                if other_shard_id != self.shard_id:
+                    self.shard_ring.add_shard(other_shard_id)
+            if self.shard_id in shard_ids:
+                self.finish_joining_shards()
+            return
+        if changed:
+            self.logger.info(f'Shard {shard_id} joined, shards: {sorted(self.shard_ring.shard_ids)}')
+            self.rebalance_shards()
+
+    def process_shard_left(self, shard_id):
+        if self.shard_ring is None or not self.shard_ring.remove_shard(shard_id):
+            return
+        self.logger.info(f'Shard {shard_id} left, shards: {sorted(self.shard_ring.shard_ids)}')
+        self.rebalance_shards()
+
+    def publish_shard_joined(self, reply_to_shard_id=None):
+        new_event_data = {
+            'id': self.service_based_random_event_id(),
+            'shard_id': self.shard_id,
+            'shard_ids': sorted(self.shard_ring.shard_ids),
+        }
+        if reply_to_shard_id is not None:
+            new_event_data['reply_to_shard_id'] = reply_to_shard_id
+        self.publish_event_type_to_stream(event_type='ClientManagerShardJoined', new_event_data=new_event_data)
+
+    def join_shards(self):
+        self.shard_join_deadline = time.monotonic() + self.shard_join_timeout_seconds
+        self.publish_shard_joined()
+
+    def is_joining_shards(self):
+        return self.shard_join_deadline is not None
+
+    def finish_joining_shards(self):
+        """Processes the events deferred while joining, now that the ring is known, and hands over the rest."""
+        self.shard_join_deadline = None
+        deferred_events = self.shard_join_deferred_events
+        self.shard_join_deferred_events = []
+        self.logger.info(
+            f'Joined shards: {sorted(self.shard_ring.shard_ids)}, processing {len(deferred_events)} deferred events')
+        for event_type, event_data, json_msg in deferred_events:
+            try:
+                self.process_event_type(event_type, event_data, json_msg)
+            except Exception as e:
+                self.logger.error(f'Error processing {json_msg}:')
+                self.logger.exception(e)
+        self.rebalance_shards()
+        # only now the ring is final, so the catalog entries this shard owns are known
+        self.rebuild_query_catalog()
+
+    def finish_joining_shards_if_due(self):
+        if self.is_joining_shards() and time.monotonic() >= self.shard_join_deadline:
+            # no other shard answered, eg: it's the first one
+            self.finish_joining_shards()
+
+    def leave_shards(self):
+        # hands over the whole state to the remaining shards before leaving
+        self.shard_ring.remove_shard(self.shard_id)
+        with self.batched_publishing():
+            self.publish_event_type_to_stream(event_type='ClientManagerShardLeft', new_event_data={
+                'id': self.service_based_random_event_id(),
+                'shard_id': self.shard_id,
+            })
+            if len(self.shard_ring) > 0:
+                self.rebalance_shards()
+
+    def get_state_sizes(self):
+        return {
+            'queries': len(self.queries),
+            'publishers': len(self.publishers),
+            'bufferstreams': len(self.bufferstreams),
+            'pending_queries': len(self.pending_queries),
+            'service_workers': len(self.service_registry.worker_service_types),
+        }
+
+    def get_metrics_text(self):
+        return generate_latest(self.metrics_registry)
+
+    def start_metrics_http_server(self):
+        if self.metrics_http_port:
+            start_http_server(self.metrics_http_port, registry=self.metrics_registry)
+            self.logger.info(f'Serving metrics on port {self.metrics_http_port}')
+
+    def write_metrics_to_redis(self):
+        redis_db = getattr(self.stream_factory, 'redis_db', None)
+        if not self.metrics_redis_key or redis_db is None:
+            return
+        try:
+            redis_db.set(self.metrics_redis_key, self.get_metrics_text())
+        except Exception as e:
+            self.logger.error('Error writing metrics to redis:')
+            self.logger.exception(e)
+
+    def run_metrics_redis_writer(self):
+        while not self._metrics_redis_writer_stopped.wait(self.metrics_redis_interval_seconds):
+            self.write_metrics_to_redis()
+
+    def start_metrics_redis_writer(self):
+        """
+        Writes the metrics to redis every `metrics_redis_interval_seconds` on a background thread (as the metrics
+        http server does), so they are kept fresh while the service is idle waiting for events.
+        """
+        if not self.metrics_redis_key or getattr(self.stream_factory, 'redis_db', None) is None:
+            return
+        self._metrics_redis_writer_stopped.clear()
+        self._metrics_redis_writer = threading.Thread(target=self.run_metrics_redis_writer, daemon=True)
+        self._metrics_redis_writer.start()
+
+    def stop_metrics_redis_writer(self):
+        if self._metrics_redis_writer is None:
+            return
+        self._metrics_redis_writer_stopped.set()
+        self._metrics_redis_writer.join()
+        self._metrics_redis_writer = None
+        self.write_metrics_to_redis()
+
+    def get_tracked_state(self):
+        return {
+            'Publishers': self.publishers,
+            'Queries': self.queries,
+            'Bufferstreams': self.buffer_hash_to_query_map,
+            'Service Workers': self.service_registry.worker_service_types,
+        }
+
+    def _log_state_changes(self, name, collection, changes):
+        added, updated, removed = changes
+        log_msg = f'- {name}: {len(collection)} (+{len(added)} ~{len(updated)} -{len(removed)})'
+        for sign, keys in [('+', added), ('~', updated)]:
+            for key in keys:
+                log_msg += f'\n-- {sign} {key}  ---  {collection[key]}'
+        for key in removed:
+            log_msg += f'\n-- - {key}'
+        self.logger.debug(log_msg)
 
     def log_state(self):
+        """
+        Logs the size of the state collections and only what changed on them since the last call.
+        The whole state is logged by `dump_full_state`.
+        """
+        state_changes = [
+            (name, collection, collection.pop_changes()) for name, collection in self.get_tracked_state().items()
+        ]
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+
         super(ClientManager, self).log_state()
-        self._log_dict('Publishers', self.publishers)
-        self._log_dict('Queries', self.queries)
-        self._log_dict('Bufferstreams', self.buffer_hash_to_query_map)
-        self._log_dict('Available Services', self.service_registry.available_services)
+        for name, collection, changes in state_changes:
+            self._log_state_changes(name, collection, changes)
+        self._log_dict('Parsed Query Cache', self.parsed_query_cache.stats())
+        self._log_dict('Pending Queries', self.pending_queries.stats())
+        self._log_dict('Event Dedupe', self.event_dedupe_window.stats())
+        self._log_dict('Event Types', {
+            event_type: metrics.summary() for event_type, metrics in self.event_type_metrics.items()
+        })
 
-    def run(self):
+    def dump_full_state(self):
+        """
+        Logs the whole state, at most once every `full_state_dump_min_interval_seconds`.
+        Only shallow copies of the collections are made here, they are rendered and logged on a background thread.
+        Returns the thread, or None if the dump was rate limited.
+        """
+        now = time.monotonic()
+        if (self._last_full_state_dump_time is not None and
+                now - self._last_full_state_dump_time < self.full_state_dump_min_interval_seconds):
+            self.logger.info('Ignoring full state dump request, the last one was too recent')
+            return None
+        self._last_full_state_dump_time = now
+
+        state = {name: dict(collection) for name, collection in self.get_tracked_state().items()}
+        state['Available Services'] = {
+            service_type: {'workers': dict(service_dict['workers'])}
+            for service_type, service_dict in self.service_registry.available_services.items()
+        }
+        thread = threading.Thread(target=self.log_full_state, args=(state,), daemon=True)
+        thread.start()
+        return thread
+
+    def log_full_state(self, state):
+        for name, collection in state.items():
+            log_msg = f'- {name}: {len(collection)}'
+            for key, value in collection.items():
+                log_msg += f'\n-- {key}  ---  {value}'
+            self.logger.info(log_msg)
+
+    def setup_full_state_dump_signal(self):
+        # `kill -USR1 <pid>` dumps the whole state (signal handlers can only be set on the main thread)
+        if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump_full_state())
+
+    def get_cmd_events(self, stream_event_list):
+        cmd_events = []
+        for stream_key, event_list in stream_event_list:
+            event_type = stream_key.decode('utf-8')
+            for event_id, json_msg in event_list:
+                cmd_events.append((event_type, event_id, json_msg))
+        return cmd_events
+
+    def read_cmd_stream_events(self, cmd_stream, count):
+        return self.get_cmd_events(cmd_stream.read_stream_events_list(count=count))
+
+    def get_cmd_read_block_ms(self, block):
+        """
+        Bounds the blocking read of the cmd events (None doesn't block and 0 blocks forever) by the next worker
+        expiration and the shard join timeout, so that they are also handled while no events arrive.
+        """
+        remaining_seconds = []
+        next_expiration_time = self.service_registry.get_next_expiration_time()
+        if next_expiration_time is not None:
+            remaining_seconds.append(next_expiration_time - self.service_registry.clock())
+        if self.is_joining_shards():
+            remaining_seconds.append(self.shard_join_deadline - time.monotonic())
+        if block is None or not remaining_seconds:
+            return block
+        remaining_ms = max(1, math.ceil(min(remaining_seconds) * 1000))
+        if block == 0:
+            return remaining_ms
+        return min(block, remaining_ms)
+
+    def read_cmd_events_batch(self, cmd_stream):
+        if hasattr(cmd_stream, 'block'):
+            original_block = cmd_stream.block
+            cmd_stream.block = self.get_cmd_read_block_ms(original_block)
+            try:
+                cmd_events = self.read_cmd_stream_events(cmd_stream, self.cmd_batch_size)
+            finally:
+                cmd_stream.block = original_block
+        else:
+            cmd_events = self.read_cmd_stream_events(cmd_stream, self.cmd_batch_size)
+
+        # only lingers on streams that support a block timeout, otherwise the read would block forever
+        if self.cmd_batch_max_linger_ms > 0 and hasattr(cmd_stream, 'block'):
+            original_block = cmd_stream.block
+            deadline = time.perf_counter() + self.cmd_batch_max_linger_ms / 1000
+            try:
+                while len(cmd_events) < self.cmd_batch_size:
+                    remaining_ms = int((deadline - time.perf_counter()) * 1000)
+                    if remaining_ms <= 0:
+                        break
+                    cmd_stream.block = remaining_ms
+                    new_cmd_events = self.read_cmd_stream_events(
+                        cmd_stream, self.cmd_batch_size - len(cmd_events))
+                    if not new_cmd_events:
+                        break
+                    cmd_events.extend(new_cmd_events)
+            finally:
+                cmd_stream.block = original_block
+
+        self.sort_cmd_events(cmd_events)
+        return cmd_events
+
+    def sort_cmd_events(self, cmd_events):
+        # events from different streams are read grouped by stream, so put them back in arrival order
+        cmd_events.sort(key=lambda cmd_event: stream_event_id_sort_key(cmd_event[1]))
+
+    def process_cmd(self, cg_sub_group=None):
+        if cg_sub_group is None:
+            cg_sub_group = 'default'
+
+        cmd_stream = self.service_cmd_cg_stream_map[cg_sub_group]
+        event_types = self.service_cmd_cg_keys_map[cg_sub_group]
+
+        self.logger.debug(f'Processing CMD-[{cg_sub_group}] from event types: {event_types}')
+
+        cmd_events = self.read_cmd_events_batch(cmd_stream)
+        if not cmd_events:
+            self.process_idle()
+            return
+        self.process_cmd_events(cmd_events, cg_sub_group)
+
+    def process_idle(self):
+        """Periodic work done when no events were read, otherwise it's done after each batch of events."""
+        with self.batched_publishing():
+            self.expire_service_workers()
+            self.finish_joining_shards_if_due()
+
+    def is_duplicated_event(self, event_type, event_data):
+        """
+        Checks the event id on the dedupe window, so that events delivered again are skipped
+        before being traced, routed to their shard or handled. Events without id are left to the validation.
+        """
+        event_id = event_data.get('id')
+        if event_id is None or not self.event_dedupe_window.enabled:
+            return False
+        if not self.event_dedupe_window.is_duplicate(event_id):
+            return False
+
+        event_type_metrics = self.event_type_metrics.get(event_type)
+        if event_type_metrics is not None:
+            event_type_metrics.observe_duplicate()
+        self.logger.debug(f'Skipping duplicated {event_type} event: {event_id}')
+        return True
+
+    def record_processed_event(self, event_data):
+        # only recorded once handled, so an event delivered again after its handler failed is still processed
+        event_id = event_data.get('id')
+        if event_id is not None and self.event_dedupe_window.enabled:
+            self.event_dedupe_window.add(event_id)
+
+    def process_cmd_events(self, cmd_events, cg_sub_group='default'):
+        if self.parse_executor is not None and self.parse_executor.running:
+            self.prefetch_query_parses(cmd_events)
+        with self.batched_publishing():
+            for event_type, event_id, json_msg in cmd_events:
+                try:
+                    event_data = self.default_event_deserializer(json_msg)
+                    if self.is_duplicated_event(event_type, event_data):
+                        continue
+                    self.process_event_type_wrapper(cg_sub_group, event_type, event_data, json_msg)
+                    self.record_processed_event(event_data)
+                except Exception as e:
+                    self.logger.error(f'Error processing {json_msg}:')
+                    self.logger.exception(e)
+                finally:
+                    self.update_last_processed_stream_id(event_type, event_id)
+            self.expire_service_workers()
+            self.finish_joining_shards_if_due()
+        self.parsed_query_cache.clear_prefetched()
+        self.log_state()
+        self.save_state_snapshot_if_due(len(cmd_events))
+
+    def update_last_processed_stream_id(self, event_type, event_id):
+        if isinstance(event_id, bytes):
+            event_id = event_id.decode('utf-8')
+        self.last_processed_stream_ids[event_type] = event_id
+
+    def get_state_snapshot(self):
+        return {
+            'version': SNAPSHOT_FORMAT_VERSION,
+            'created_at': time.time(),
+            'last_processed_stream_ids': dict(self.last_processed_stream_ids),
+            'queries': self.queries,
+            'publishers': self.publishers,
+            'available_services': self.service_registry.available_services,
+            'pending_queries': [
+                pending_query._replace(parsed_query=thaw(pending_query.parsed_query))
+                for pending_query in self.pending_queries.entries.values()
+            ],
+        }
+
+    def restore_state_snapshot(self, snapshot):
+        self.last_processed_stream_ids = dict(snapshot['last_processed_stream_ids'])
+        self.queries = TrackedDict(snapshot['queries'])
+        self.publishers = TrackedDict(snapshot['publishers'])
+        self.service_registry.load_available_services(snapshot['available_services'])
+        self.pending_queries.restore(snapshot['pending_queries'])
+        self.rebuild_indexes()
+        # the restored state is logged by the next full state dump, not as changes
+        for collection in self.get_tracked_state().values():
+            collection.pop_changes()
+
+    def rebuild_indexes(self):
+        self.bufferstreams.clear()
+        self.publisher_to_buffer_stream_map.clear()
+        self.content_type_to_buffer_stream_map.clear()
+        self.publisher_to_query_map.clear()
+        self.subscriber_to_query_map.clear()
+        self.content_type_to_query_map.clear()
+        for query in self.queries.values():
+            self.update_indexes_from_new_query(query=query)
+
+    def save_state_snapshot(self):
+        if self.state_snapshot_store is None:
+            return
+        if self.pub_events_write_failed:
+            # the events processed since the failed write would be restored as processed, without being published
+            self.logger.error('Not saving the state snapshot, writing some of the published events failed')
+            return
+        if self.is_joining_shards():
+            # the events deferred while joining would be restored as processed
+            self.logger.info('Not saving the state snapshot while joining the shards')
+            return
+        serialized_snapshot = serialize_snapshot(self.get_state_snapshot())
+        self._events_since_state_snapshot = 0
+        self._last_state_snapshot_time = time.monotonic()
+        if self.pub_events_sink is not None:
+            # the stream ids must only be saved once the events published until them are written
+            self.pending_state_snapshot = serialized_snapshot
+            return
+        self.state_snapshot_store.save_serialized(serialized_snapshot)
+        self.logger.debug(f'Saved state snapshot at stream ids: {self.last_processed_stream_ids}')
+
+    def save_pending_state_snapshot(self, serialized_snapshot):
+        try:
+            self.state_snapshot_store.save_serialized(serialized_snapshot)
+        except Exception as e:
+            self.logger.error('Error saving state snapshot:')
+            self.logger.exception(e)
+
+    def save_state_snapshot_if_due(self, processed_events):
+        if self.state_snapshot_store is None:
+            return
+        self._events_since_state_snapshot += processed_events
+        snapshot_age = time.monotonic() - self._last_state_snapshot_time
+        if (self._events_since_state_snapshot >= self.state_snapshot_every_n_events or
+                snapshot_age >= self.state_snapshot_interval_seconds):
+            try:
+                self.save_state_snapshot()
+            except Exception as e:
+                self.logger.error('Error saving state snapshot:')
+                self.logger.exception(e)
+
+    def load_state_snapshot(self):
+        if self.state_snapshot_store is None:
+            return False
+        snapshot = self.state_snapshot_store.load()
+        if snapshot is None:
+            self.logger.info('No state snapshot available, starting with an empty state')
+            return False
+        if snapshot.get('version') != SNAPSHOT_FORMAT_VERSION:
+            self.logger.info(f'Ignoring state snapshot with unsupported version: {snapshot.get("version")}')
+            return False
+
+        self.restore_state_snapshot(snapshot)
+        # replay only the events that arrived after the snapshot was taken, including on the streams
+        # without processed events, which would otherwise skip the events that arrived while stopped
+        default_stream_id = get_snapshot_stream_id(snapshot.get('created_at'))
+        for cg_sub_group, cmd_stream in self.service_cmd_cg_stream_map.items():
+            event_types = self.service_cmd_cg_keys_map[cg_sub_group]
+            stream_ids = {
+                event_type: self.last_processed_stream_ids.get(event_type, default_stream_id)
+                for event_type in event_types
+            }
+            set_consumer_group_stream_ids(cmd_stream, stream_ids)
+        self.logger.info(f'Restored state snapshot from stream ids: {self.last_processed_stream_ids}')
+        return True
+
+    def start(self):
         super(ClientManager, self).run()
-        self.run_forever(self.process_cmd)
+        self.load_state_snapshot()
+        if self.shard_ring is None:
+            self.rebuild_query_catalog()
+        self.setup_full_state_dump_signal()
+        self.start_metrics_http_server()
+        self.start_metrics_redis_writer()
+        if self.parse_executor is not None:
+            self.parse_executor.start()
+        if self.shard_ring is not None:
+            self.join_shards()
+
+    def stop(self):
+        if self.shard_ring is not None:
+            self.leave_shards()
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown()
+        self.save_state_snapshot()
+        self.stop_metrics_redis_writer()
+
+    def run(self):
+        self.start()
+        try:
+            self.run_forever(self.process_cmd)
+        finally:
+            self.stop()
@@ -1,18 +1,236 @@
+import heapq
+import time
+
+from client_manager.tracking import TrackedDict
+
+
+# qos policy -> worker metric used to order the service types of a content type
+QOS_POLICY_WORKER_METRICS = {
+    'accuracy': 'accuracy',
+    'latency': 'throughput',
+    'energy_consumption': 'energy_consumption',
+}
+# worker metric -> if higher metric values are better
+WORKER_METRICS = {
+    'accuracy': True,
+    'throughput': True,
+    'energy_consumption': False,
+}
+
+
 class ServiceRegistry():
 
-    def __init__(self):
+    def __init__(self, worker_heartbeat_ttl_seconds=None, clock=time.monotonic):
         self.available_services = {}
         # self.available_services = {'ObjectDetection': [], 'ColorDetection': []}
+        self.content_type_to_service_types = {}
+        self.worker_service_types = TrackedDict()
+        self.worker_heartbeat_ttl_seconds = worker_heartbeat_ttl_seconds
+        self.clock = clock
+        self.worker_last_seen = {}
+        self._worker_expiration_heap = []
+        self.version = 0
+        self._chain_cache = {}
+
+    def _registry_changed(self):
+        self.version += 1
+        self._chain_cache.clear()
+
+    def _get_worker_content_types(self, worker):
+        return worker.get('content_types', [worker['service_type']])
+
+    def _index_worker(self, worker):
+        service_type = worker['service_type']
+        for content_type in self._get_worker_content_types(worker):
+            self.content_type_to_service_types.setdefault(content_type, set()).add(service_type)
+
+    def _unindex_worker(self, worker):
+        service_type = worker['service_type']
+        service_workers = self.available_services.get(service_type, {}).get('workers', {})
+        remaining_content_types = set()
+        for other_worker in service_workers.values():
+            if other_worker is not worker:
+                remaining_content_types.update(self._get_worker_content_types(other_worker))
+        for content_type in self._get_worker_content_types(worker):
+            if content_type in remaining_content_types:
+                continue
+            service_types = self.content_type_to_service_types.get(content_type, set())
+            service_types.discard(service_type)
+            if len(service_types) == 0:
+                self.content_type_to_service_types.pop(content_type, None)
+
+    def _get_worker_rank_value(self, worker, metric):
+        value = worker.get(metric)
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return float('inf')
+        return -value if WORKER_METRICS[metric] else value
+
+    def _get_service_type_rank_value(self, service_type, metric):
+        # a service type is as good as its best worker
+        workers = self.available_services.get(service_type, {}).get('workers', {})
+        return min((self._get_worker_rank_value(worker, metric) for worker in workers.values()), default=float('inf'))
+
+    def _get_content_types_service_types(self, content_types):
+        # the service types of each content type in every order a query can ask for
+        return {
+            ct: tuple(
+                tuple(self.get_service_types_by_content_type(ct, ranking_metric))
+                for ranking_metric in (None, *WORKER_METRICS)
+            )
+            for ct in content_types
+        }
+
+    def _get_changed_content_types(self, before):
+        after = self._get_content_types_service_types(before.keys())
+        return {ct for ct, service_types in before.items() if after[ct] != service_types}
+
+    def _touch_worker(self, stream_key):
+        now = self.clock()
+        self.worker_last_seen[stream_key] = now
+        if self.worker_heartbeat_ttl_seconds:
+            heapq.heappush(self._worker_expiration_heap, (now + self.worker_heartbeat_ttl_seconds, stream_key))
+
+    def add_worker(self, worker):
+        """
+        Adds or refreshes (heartbeat) a worker.
+        Returns the set of content types whose service types changed, ie: the ones whose chains may be different now.
+        """
+        service_type = worker['service_type']
+        stream_key = worker['stream_key']
+        self._touch_worker(stream_key)
+
+        previous_service_type = self.worker_service_types.get(stream_key)
+        previous_worker = None
+        if previous_service_type is not None:
+            previous_worker = self.available_services[previous_service_type]['workers'][stream_key]
+            if previous_worker == worker:
+                return set()
+
+        content_types = set(self._get_worker_content_types(worker))
+        if previous_worker is not None:
+            content_types.update(self._get_worker_content_types(previous_worker))
+        before = self._get_content_types_service_types(content_types)
+
+        if previous_worker is not None:
+            self._remove_worker_from_services(previous_worker)
+        service_dict = self.available_services.setdefault(service_type, {'workers': {}})
+        service_dict['workers'][stream_key] = worker
+        self.worker_service_types[stream_key] = service_type
+        self._index_worker(worker)
+        self._registry_changed()
+        return self._get_changed_content_types(before)
+
+    def _remove_worker_from_services(self, worker):
+        service_type = worker['service_type']
+        self._unindex_worker(worker)
+        service_workers = self.available_services[service_type]['workers']
+        del service_workers[worker['stream_key']]
+        if len(service_workers) == 0:
+            del self.available_services[service_type]
+        del self.worker_service_types[worker['stream_key']]
+
+    def remove_worker(self, stream_key):
+        """
+        Removes a worker, returning the set of content types whose service types changed,
+        or None if the worker was not registered.
+        """
+        service_type = self.worker_service_types.get(stream_key)
+        if service_type is None:
+            return None
+        worker = self.available_services[service_type]['workers'][stream_key]
+        before = self._get_content_types_service_types(self._get_worker_content_types(worker))
+        self._remove_worker_from_services(worker)
+        self.worker_last_seen.pop(stream_key, None)
+        self._registry_changed()
+        return self._get_changed_content_types(before)
+
+    def expire_workers(self):
+        """
+        Removes the workers without a heartbeat for longer than the ttl.
+        Heap entries are invalidated lazily, so each heartbeat costs O(log n) and each expiration check
+        only looks at the entries that are already due.
+        """
+        changed_content_types = set()
+        expired_stream_keys = []
+        if not self.worker_heartbeat_ttl_seconds:
+            return expired_stream_keys, changed_content_types
+
+        now = self.clock()
+        heap = self._worker_expiration_heap
+        while heap and heap[0][0] <= now:
+            expires_at, stream_key = heapq.heappop(heap)
+            last_seen = self.worker_last_seen.get(stream_key)
+            if last_seen is None or last_seen + self.worker_heartbeat_ttl_seconds != expires_at:
+                continue
+            changed_content_types.update(self.remove_worker(stream_key))
+            expired_stream_keys.append(stream_key)
+        return expired_stream_keys, changed_content_types
+
+    def get_next_expiration_time(self):
+        """Clock time of the next expiration check that may remove a worker (None without ttl or workers)."""
+        if not self.worker_heartbeat_ttl_seconds or not self._worker_expiration_heap:
+            return None
+        return self._worker_expiration_heap[0][0]
+
+    def load_available_services(self, available_services):
+        self.available_services = available_services
+        self.content_type_to_service_types = {}
+        self.worker_service_types = TrackedDict()
+        self.worker_last_seen = {}
+        self._worker_expiration_heap = []
+        for service_type, service_dict in self.available_services.items():
+            for stream_key, worker in service_dict['workers'].items():
+                self.worker_service_types[stream_key] = service_type
+                self._touch_worker(stream_key)
+                self._index_worker(worker)
+        self.worker_service_types.pop_changes()
+        self._registry_changed()
+
+    def get_qos_ranking_metric(self, qos_policies):
+        """Worker metric of the qos policy with the highest (numeric) weight, or None without any."""
+        ranking_metric = None
+        highest_weight = None
+        for qos_policy, weight in (qos_policies or {}).items():
+            if qos_policy not in QOS_POLICY_WORKER_METRICS:
+                continue
+            try:
+                weight = float(weight)
+            except (TypeError, ValueError):
+                continue
+            if highest_weight is None or weight > highest_weight:
+                highest_weight = weight
+                ranking_metric = QOS_POLICY_WORKER_METRICS[qos_policy]
+        return ranking_metric
+
+    def get_service_types_by_content_type(self, content_type, ranking_metric=None):
+        service_types = self.content_type_to_service_types.get(content_type)
+        if not service_types:
+            return []
+        # a service with the same name of the content type is preferred, as in the original "hack" lookup.
+        if content_type in service_types:
+            service_types = [content_type] + sorted(service_types - {content_type})
+        else:
+            service_types = sorted(service_types)
+        if ranking_metric is not None:
+            # stable sort, so services with the same metric keep the order above
+            service_types.sort(key=lambda service_type: self._get_service_type_rank_value(service_type, ranking_metric))
+        return service_types
 
-    def get_service_function_chain_by_content_type_list(self, content_types):
-        service_type_list = []
-        for ct in content_types:
-            # hack, just to make it work in a similar data type as it is right now
-            if ct in self.available_services.keys():
-                service_type_list.append(ct)
-            # for service_type, service_data in self.available_services.items():
-                # for worker_stream, worker in service_data.items():
-                #     if ct in worker['content_types']:
-                #         service_type_list.append(service_type)
-                #         break
-        return service_type_list
+    def get_service_function_chain_by_content_type_list(self, content_types, qos_policies=None):
+        """
+        Service type of each content type, ordered by the worker metric of the query's main qos policy
+        (eg: the accuracy of the workers for `accuracy`, their throughput for `latency`).
+        """
+        ranking_metric = self.get_qos_ranking_metric(qos_policies)
+        cache_key = (tuple(content_types), ranking_metric)
+        service_type_list = self._chain_cache.get(cache_key)
+        if service_type_list is None:
+            service_type_list = []
+            for ct in content_types:
+                service_types = self.get_service_types_by_content_type(ct, ranking_metric)
+                if service_types and service_types[0] not in service_type_list:
+                    service_type_list.append(service_types[0])
+            self._chain_cache[cache_key] = service_type_list
+        return list(service_type_list)
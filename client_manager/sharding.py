@@ -0,0 +1,86 @@
+import bisect
+import hashlib
+import re
+
+from client_manager.query_cache import QUOTED_STRING_REGEX
+
+
+# FROM is the clause right before WITHIN, the first publisher in it is the one used by the query.
+QUERY_FROM_REGEX = re.compile(r'\bFROM\s+([^\s,]+)(?:\s*,\s*[^\s,]+)*\s+WITHIN\b', re.IGNORECASE)
+
+
+def extract_query_publisher_id(query_text):
+    """
+    Finds the (first) FROM publisher of a query without parsing it, so that the shards can route
+    the queries they don't own without paying for parsing them. Returns None if it's not found.
+    """
+    query_text_without_strings = QUOTED_STRING_REGEX.sub("''", query_text)
+    match = QUERY_FROM_REGEX.search(query_text_without_strings)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+class ConsistentHashRing():
+    """
+    Consistent hashing of keys (eg: publisher ids) to shards, with `virtual_nodes` positions per shard
+    to spread each shard's ranges around the ring.
+    When a shard joins or leaves, only the keys in the ranges it takes or gives away change owner.
+    """
+
+    def __init__(self, shard_ids=(), virtual_nodes=64, key_cache_size=65536):
+        self.virtual_nodes = virtual_nodes
+        self.key_cache_size = key_cache_size
+        self.shard_ids = set()
+        self.positions = []
+        self.position_shard_ids = []
+        self._key_shard_cache = {}
+        for shard_id in shard_ids:
+            self.add_shard(shard_id)
+
+    def _hash(self, value):
+        return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def _shard_positions(self, shard_id):
+        return [self._hash(f'{shard_id}#{virtual_node}') for virtual_node in range(self.virtual_nodes)]
+
+    def add_shard(self, shard_id):
+        if shard_id in self.shard_ids:
+            return False
+        self.shard_ids.add(shard_id)
+        for position in self._shard_positions(shard_id):
+            index = bisect.bisect_left(self.positions, position)
+            self.positions.insert(index, position)
+            self.position_shard_ids.insert(index, shard_id)
+        self._key_shard_cache.clear()
+        return True
+
+    def remove_shard(self, shard_id):
+        if shard_id not in self.shard_ids:
+            return False
+        self.shard_ids.discard(shard_id)
+        for position in self._shard_positions(shard_id):
+            index = bisect.bisect_left(self.positions, position)
+            while self.position_shard_ids[index] != shard_id:
+                index += 1
+            del self.positions[index]
+            del self.position_shard_ids[index]
+        self._key_shard_cache.clear()
+        return True
+
+    def get_shard(self, key):
+        shard_id = self._key_shard_cache.get(key)
+        if shard_id is None:
+            if not self.positions:
+                return None
+            index = bisect.bisect_right(self.positions, self._hash(key)) % len(self.positions)
+            if len(self._key_shard_cache) >= self.key_cache_size:
+                self._key_shard_cache.clear()
+            shard_id = self._key_shard_cache[key] = self.position_shard_ids[index]
+        return shard_id
+
+    def __contains__(self, shard_id):
+        return shard_id in self.shard_ids
+
+    def __len__(self):
+        return len(self.shard_ids)
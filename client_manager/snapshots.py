@@ -0,0 +1,80 @@
+import os
+import pickle
+import tempfile
+
+from walrus.containers import make_python_attr as walrus_normalized_cg_stream_key
+
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def serialize_snapshot(snapshot):
+    return pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class FileStateSnapshotStore():
+
+    def __init__(self, path):
+        self.path = path
+
+    def save(self, snapshot):
+        self.save_serialized(serialize_snapshot(snapshot))
+
+    def save_serialized(self, serialized_snapshot):
+        # writes to a temp file in the same dir and renames it, so a crash never leaves a half written snapshot.
+        snapshot_dir = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(snapshot_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=snapshot_dir, prefix='.snapshot-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(serialized_snapshot)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as snapshot_file:
+            return pickle.load(snapshot_file)
+
+
+class RedisStateSnapshotStore():
+
+    def __init__(self, redis_db, key):
+        self.redis_db = redis_db
+        self.key = key
+
+    def save(self, snapshot):
+        self.save_serialized(serialize_snapshot(snapshot))
+
+    def save_serialized(self, serialized_snapshot):
+        self.redis_db.set(self.key, serialized_snapshot)
+
+    def load(self):
+        serialized_snapshot = self.redis_db.get(self.key)
+        if serialized_snapshot is None:
+            return None
+        return pickle.loads(serialized_snapshot)
+
+
+def get_snapshot_stream_id(created_at):
+    """Redis stream id of the snapshot creation time (a timestamp), or of the start of the stream if unknown."""
+    if not created_at:
+        return '0'
+    return f'{int(created_at * 1000)}-0'
+
+
+def set_consumer_group_stream_ids(cmd_stream, stream_ids):
+    consumer_group = getattr(cmd_stream, 'input_consumer_group', None)
+    if consumer_group is None:
+        return False
+    for stream_key, stream_id in stream_ids.items():
+        cg_stream = getattr(consumer_group, walrus_normalized_cg_stream_key(stream_key), None)
+        if cg_stream is not None:
+            cg_stream.set_id(stream_id)
+    return True
@@ -0,0 +1,24 @@
+import opentracing
+
+
+class NoopTracer(opentracing.Tracer):
+    """Tracer used when tracing is disabled, closed like the jaeger tracer."""
+
+    def close(self):
+        pass
+
+
+def init_tracer(service_name, reporting_host=None, reporting_port=None, **kwargs):
+    """
+    Tracing is opt-in: without a reporting host a no-op tracer is used, and jaeger (slow to import) is
+    only imported when tracing is enabled.
+    """
+    if not reporting_host:
+        return NoopTracer()
+
+    from event_service_utils.tracing import jaeger
+    tracer = jaeger.init_tracer(service_name, reporting_host=reporting_host, reporting_port=reporting_port, **kwargs)
+    if tracer is None:
+        # jaeger only initializes the first tracer of the process, the other services share it.
+        tracer = opentracing.global_tracer()
+    return tracer
@@ -0,0 +1,68 @@
+class TrackedDict(dict):
+    """
+    Dict keeping track of the keys added, updated and removed since the last `pop_changes` call,
+    so that the state can be logged incrementally.
+    Only the (top level) key assignments and removals are tracked, not the changes inside the values.
+    It's pickled (and copied) as a plain dict, so the state snapshots don't depend on it.
+    """
+
+    __slots__ = ('_initially_present',)
+
+    def __init__(self, *args, **kwargs):
+        super(TrackedDict, self).__init__(*args, **kwargs)
+        # key -> if it was present when first changed since the last pop_changes
+        self._initially_present = {}
+
+    def _touch(self, key):
+        if key not in self._initially_present:
+            self._initially_present[key] = key in self
+
+    def __setitem__(self, key, value):
+        self._touch(key)
+        super(TrackedDict, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._touch(key)
+        super(TrackedDict, self).__delitem__(key)
+
+    def pop(self, key, *default):
+        self._touch(key)
+        return super(TrackedDict, self).pop(key, *default)
+
+    def popitem(self):
+        key, value = super(TrackedDict, self).popitem()
+        self._initially_present.setdefault(key, True)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._touch(key)
+        return super(TrackedDict, self).setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in self:
+            self._touch(key)
+        super(TrackedDict, self).clear()
+
+    def pop_changes(self):
+        """Returns the (added, updated, removed) keys since the last call."""
+        added = []
+        updated = []
+        removed = []
+        for key, was_present in self._initially_present.items():
+            if key in self:
+                if was_present:
+                    updated.append(key)
+                else:
+                    added.append(key)
+            elif was_present:
+                removed.append(key)
+        self._initially_present = {}
+        return added, updated, removed
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
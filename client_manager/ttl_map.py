@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+
+
+class BoundedTTLMap():
+    """
+    Map with the same TTL for all its entries and a max size.
+    Entries are kept in insertion order, which is also their expiration order,
+    so expiring and evicting the oldest entries is done from the front of the queue.
+    `on_remove(key, value)` is called for each expired or evicted entry (eg: to update other indexes).
+    """
+
+    def __init__(self, ttl_seconds, max_size, clock=time.monotonic, on_remove=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.clock = clock
+        self.on_remove = on_remove
+        self.entries = OrderedDict()
+        self.expiration_times = {}
+        self.expired = 0
+        self.evicted = 0
+
+    def get_expires_at(self, now=None):
+        if not self.ttl_seconds:
+            return None
+        if now is None:
+            now = self.clock()
+        return now + self.ttl_seconds
+
+    def add(self, key, value, expires_at):
+        """Adds the entry as the newest one, evicting the oldest entries over `max_size`."""
+        self.pop(key)
+        self.entries[key] = value
+        self.expiration_times[key] = expires_at
+        while len(self.entries) > self.max_size:
+            self._remove_oldest()
+            self.evicted += 1
+
+    def pop(self, key, default=None):
+        if key not in self.entries:
+            return default
+        del self.expiration_times[key]
+        return self.entries.pop(key)
+
+    def _remove_oldest(self):
+        key, value = self.entries.popitem(last=False)
+        del self.expiration_times[key]
+        if self.on_remove is not None:
+            self.on_remove(key, value)
+
+    def purge_expired(self, now=None):
+        if now is None:
+            now = self.clock()
+        entries = self.entries
+        while entries:
+            expires_at = self.expiration_times[next(iter(entries))]
+            if expires_at is None or expires_at > now:
+                break
+            self._remove_oldest()
+            self.expired += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.expiration_times.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -7,5 +7,6 @@ setup(
     author='Felipe Arruda Pontes',
     author_email='felipe.arruda.pontes@insight-centre.org',
     packages=['client_manager'],
+    python_requires='>=3.9',
     zip_safe=False
 )
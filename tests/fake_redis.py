@@ -0,0 +1,85 @@
+import itertools
+
+
+def to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+class FakeRedisPipeline():
+
+    def __init__(self, redis_db, transaction):
+        self.redis_db = redis_db
+        self.transaction = transaction
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis_db, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        self.redis_db.executed_pipelines.append(self.transaction)
+        return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+class FakeRedis():
+    """Minimal in-memory redis, with only the commands used by the catalog, storing the values as bytes."""
+
+    def __init__(self):
+        self.data = {}
+        self.stream_ids = itertools.count(1)
+        self.executed_pipelines = []
+
+    def pipeline(self, transaction=True):
+        return FakeRedisPipeline(self, transaction)
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def set(self, name, value):
+        self.data[name] = to_bytes(value)
+        return True
+
+    def incr(self, name, amount=1):
+        value = int(self.data.get(name, 0)) + amount
+        self.data[name] = to_bytes(value)
+        return value
+
+    def delete(self, *names):
+        return sum(self.data.pop(name, None) is not None for name in names)
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        hash_value = self.data.setdefault(name, {})
+        added = 0
+        for item_key, item_value in items.items():
+            item_key = to_bytes(item_key)
+            added += item_key not in hash_value
+            hash_value[item_key] = to_bytes(item_value)
+        return added
+
+    def hdel(self, name, *keys):
+        hash_value = self.data.get(name, {})
+        return sum(hash_value.pop(to_bytes(key), None) is not None for key in keys)
+
+    def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    def xadd(self, name, fields, **kwargs):
+        event_id = to_bytes(f'{next(self.stream_ids)}-0')
+        self.data.setdefault(name, []).append((event_id, {to_bytes(k): to_bytes(v) for k, v in fields.items()}))
+        return event_id
+
+    def xrevrange(self, name, max='+', min='-', count=None):
+        events = list(reversed(self.data.get(name, [])))
+        if count is not None:
+            events = events[:count]
+        return events
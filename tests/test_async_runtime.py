@@ -0,0 +1,191 @@
+import asyncio
+import json
+import pickle
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from benchmarks.workload import SyntheticWorkload, create_service
+from client_manager.async_runtime import (
+    AsyncRedisCmdReader,
+    AsyncServiceRuntime,
+    StreamCmdReaderAdapter,
+    StreamEventWriterAdapter,
+)
+from client_manager.in_memory_streams import InMemoryStreamFactory
+from client_manager.service_registry import ServiceRegistry
+
+
+class SlowEventWriter(StreamEventWriterAdapter):
+
+    def __init__(self):
+        self.max_queued = 0
+        self.runtime = None
+
+    async def write_events(self, stream_event_msg_list):
+        self.max_queued = max(self.max_queued, self.runtime.publish_queue.qsize())
+        await asyncio.sleep(0.001)
+        return await super(SlowEventWriter, self).write_events(stream_event_msg_list)
+
+
+class TestAsyncServiceRuntime(TestCase):
+
+    def write_workload_events(self, stream_factory):
+        SyntheticWorkload(publishers=10, workers=5, queries=40, churn=0.3, seed=5).write_events(stream_factory)
+
+    def get_published_query_ids(self, stream_factory):
+        published_stream = stream_factory.create('QueryCreated', stype='streamOnly')
+        return published_stream, lambda: [
+            json.loads(event_msg['event'])['query_id'] for _, event_msg in published_stream.read_events(count=1000)
+        ]
+
+    def run_sync(self):
+        stream_factory = InMemoryStreamFactory()
+        service = create_service(stream_factory=stream_factory, cmd_batch_size=10)
+        _, read_published_query_ids = self.get_published_query_ids(stream_factory)
+        self.write_workload_events(stream_factory)
+        while service.service_cmd.pending_events_count() > 0:
+            service.process_cmd()
+        return service, read_published_query_ids()
+
+    def run_async(self, event_writer, max_in_flight_publishes=2):
+        stream_factory = InMemoryStreamFactory()
+        service = create_service(stream_factory=stream_factory, cmd_batch_size=10)
+        _, read_published_query_ids = self.get_published_query_ids(stream_factory)
+        self.write_workload_events(stream_factory)
+        runtime = AsyncServiceRuntime(
+            service, StreamCmdReaderAdapter(service.service_cmd, idle_seconds=0), event_writer,
+            max_in_flight_publishes=max_in_flight_publishes
+        )
+        if isinstance(event_writer, SlowEventWriter):
+            event_writer.runtime = runtime
+
+        async def run_until_drained():
+            run_task = asyncio.ensure_future(runtime.run())
+            while service.service_cmd.pending_events_count() > 0 and not run_task.done():
+                await asyncio.sleep(0)
+            runtime.stop()
+            await run_task
+
+        asyncio.run(run_until_drained())
+        return service, read_published_query_ids()
+
+    def test_same_state_and_published_events_as_sync_runtime(self):
+        sync_service, sync_published_query_ids = self.run_sync()
+        service, published_query_ids = self.run_async(StreamEventWriterAdapter())
+
+        self.assertGreater(len(published_query_ids), 0)
+        self.assertEqual(published_query_ids, sync_published_query_ids)
+        self.assertEqual(list(service.queries.keys()), list(sync_service.queries.keys()))
+        self.assertIsNone(service.pub_events_sink)
+
+    def test_in_flight_publishes_are_bounded(self):
+        event_writer = SlowEventWriter()
+        _, published_query_ids = self.run_async(event_writer, max_in_flight_publishes=2)
+
+        self.assertGreater(len(published_query_ids), 0)
+        self.assertLessEqual(event_writer.max_queued, 2)
+
+    def test_failed_write_stops_runtime(self):
+        event_writer = MagicMock()
+
+        async def write_events(stream_event_msg_list):
+            raise ConnectionError('redis is down')
+        event_writer.write_events = write_events
+
+        with self.assertRaises(ConnectionError):
+            self.run_async(event_writer)
+
+    def read_and_publish_once(self, runtime):
+        async def read_and_publish():
+            runtime.publish_queue = asyncio.Queue()
+            await runtime.read_and_process_cmd_events()
+            self.assertFalse(runtime.service.state_snapshot_store.save_serialized.called)
+            await runtime.publish_queue.put(None)
+            await runtime.publish_loop()
+
+        asyncio.run(read_and_publish())
+
+    def test_state_snapshot_should_be_saved_by_the_writer_after_its_batch_events_are_written(self):
+        stream_factory = InMemoryStreamFactory()
+        service = create_service(
+            stream_factory=stream_factory, cmd_batch_size=100,
+            state_snapshot_store=MagicMock(), state_snapshot_every_n_events=1)
+        self.write_workload_events(stream_factory)
+        written_pub_events = []
+        event_writer = MagicMock()
+
+        async def write_events(stream_event_msg_list):
+            written_pub_events.append(stream_event_msg_list)
+        event_writer.write_events = write_events
+        service.state_snapshot_store.save_serialized.side_effect = (
+            lambda serialized_snapshot: self.assertEqual(len(written_pub_events), 1))
+        runtime = AsyncServiceRuntime(
+            service, StreamCmdReaderAdapter(service.service_cmd, idle_seconds=0), event_writer)
+
+        self.read_and_publish_once(runtime)
+
+        service.state_snapshot_store.save_serialized.assert_called_once()
+        snapshot = pickle.loads(service.state_snapshot_store.save_serialized.call_args[0][0])
+        self.assertDictEqual(snapshot['last_processed_stream_ids'], service.last_processed_stream_ids)
+        self.assertIsNone(service.pending_state_snapshot)
+
+    def test_state_snapshot_should_not_be_saved_after_failed_write(self):
+        stream_factory = InMemoryStreamFactory()
+        service = create_service(
+            stream_factory=stream_factory, cmd_batch_size=100,
+            state_snapshot_store=MagicMock(), state_snapshot_every_n_events=1)
+        self.write_workload_events(stream_factory)
+        event_writer = MagicMock()
+
+        async def write_events(stream_event_msg_list):
+            raise ConnectionError('redis is down')
+        event_writer.write_events = write_events
+        runtime = AsyncServiceRuntime(
+            service, StreamCmdReaderAdapter(service.service_cmd, idle_seconds=0), event_writer)
+
+        with self.assertRaises(ConnectionError):
+            self.read_and_publish_once(runtime)
+        service.save_state_snapshot()
+
+        self.assertTrue(service.pub_events_write_failed)
+        self.assertFalse(service.state_snapshot_store.save_serialized.called)
+
+    def test_idle_reads_should_expire_workers(self):
+        stream_factory = InMemoryStreamFactory()
+        now = [0]
+        service = create_service(
+            stream_factory=stream_factory,
+            service_registry=ServiceRegistry(worker_heartbeat_ttl_seconds=10, clock=lambda: now[0]))
+        service.process_service_worker_announced({'service_type': 'ObjectDetection', 'stream_key': 'w1'})
+        now[0] = 10
+        runtime = AsyncServiceRuntime(
+            service, StreamCmdReaderAdapter(service.service_cmd, idle_seconds=0), StreamEventWriterAdapter())
+
+        async def read_once():
+            runtime.publish_queue = asyncio.Queue()
+            await runtime.read_and_process_cmd_events()
+
+        asyncio.run(read_once())
+
+        self.assertDictEqual(service.service_registry.available_services, {})
+        self.assertIsNone(service.pub_events_sink)
+
+
+class TestAsyncRedisCmdReader(TestCase):
+
+    def test_reads_service_consumer_group(self):
+        service = create_service(stream_factory=InMemoryStreamFactory())
+        redis_client = MagicMock()
+
+        async def xreadgroup(*args, **kwargs):
+            return [(b'QueryReceived', [])]
+        redis_client.xreadgroup = MagicMock(side_effect=xreadgroup)
+
+        reader = AsyncRedisCmdReader.from_service(service, redis_client, block_ms=100)
+        asyncio.run(reader.read_stream_events_list(count=10))
+
+        args, kwargs = redis_client.xreadgroup.call_args
+        self.assertEqual(args[0], 'cg-ClientManager')
+        self.assertEqual(args[1], 'cg-ClientManager.c1')
+        self.assertEqual(set(args[2].keys()), set(service.service_cmd_cg_keys_map['default']))
+        self.assertEqual(kwargs, {'count': 10, 'block': 100})
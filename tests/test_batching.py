@@ -0,0 +1,42 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from client_manager.batching import stream_event_id_sort_key, write_events_pipelined
+
+
+class TestBatching(TestCase):
+
+    def test_stream_event_id_sort_key_for_redis_ids(self):
+        ids = [b'1526919030474-55', b'1526919030474-3', '1526919030000-0']
+        self.assertListEqual(
+            sorted(ids, key=stream_event_id_sort_key),
+            ['1526919030000-0', b'1526919030474-3', b'1526919030474-55']
+        )
+
+    def test_stream_event_id_sort_key_for_non_redis_ids(self):
+        self.assertEqual(stream_event_id_sort_key('some-uuid'), (0, 0))
+
+    def test_write_events_pipelined_should_use_single_pipeline_for_redis_streams(self):
+        redis_db = MagicMock()
+        pipeline = redis_db.pipeline.return_value
+        stream1 = MagicMock(key='QueryCreated', redis_db=redis_db, default_write_kwargs={})
+        stream2 = MagicMock(key='QueryRemoved', redis_db=redis_db, default_write_kwargs={'maxlen': 10})
+
+        write_events_pipelined([(stream1, {'event': '1'}), (stream2, {'event': '2'}), (stream1, {'event': '3'})])
+
+        redis_db.pipeline.assert_called_once_with(transaction=False)
+        self.assertEqual(pipeline.xadd.call_count, 3)
+        pipeline.xadd.assert_any_call('QueryRemoved', {'event': '2'}, maxlen=10)
+        pipeline.execute.assert_called_once_with()
+        self.assertFalse(stream1.write_events.called)
+
+    def test_write_events_pipelined_should_fallback_to_stream_writes_in_order(self):
+        stream1 = MagicMock(spec=['key', 'write_events'], key='QueryCreated')
+        stream1.write_events.return_value = []
+        stream2 = MagicMock(spec=['key', 'write_events'], key='QueryRemoved')
+        stream2.write_events.return_value = []
+
+        write_events_pipelined([(stream1, {'event': '1'}), (stream1, {'event': '2'}), (stream2, {'event': '3'})])
+
+        stream1.write_events.assert_called_once_with({'event': '1'}, {'event': '2'})
+        stream2.write_events.assert_called_once_with({'event': '3'})
@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from benchmarks.benchmark_client_manager import run_benchmark, save_results
+from benchmarks.benchmark_bufferstream_sharing import run_sharing_benchmark
+from benchmarks.benchmark_startup import run_startup_benchmark
+from benchmarks.compare_results import compare_results
+from benchmarks.workload import SyntheticWorkload
+
+
+class TestSyntheticWorkload(TestCase):
+
+    def test_generate_events_is_reproducible(self):
+        events1 = SyntheticWorkload(publishers=10, workers=5, queries=20, seed=1).generate_events()
+        events2 = SyntheticWorkload(publishers=10, workers=5, queries=20, seed=1).generate_events()
+        self.assertEqual(events1, events2)
+
+    def test_generate_events_has_churn_events(self):
+        events = SyntheticWorkload(publishers=10, workers=10, queries=20, churn=0.5).generate_events()
+        event_types = {event_type for event_type, _ in events}
+        self.assertEqual(event_types, {
+            'PublisherCreated', 'PublisherUpdated', 'PublisherRemoved', 'QueryReceived', 'QueryDeletionRequested',
+            'ServiceWorkerAnnounced', 'ServiceWorkerRemoved',
+        })
+
+
+class TestBenchmarkClientManager(TestCase):
+
+    def test_run_benchmark_processes_all_events(self):
+        results = run_benchmark(publishers=5, workers=5, queries=10, churn=0.2, seed=1, cmd_batch_size=10)
+
+        processed_events = sum(summary['count'] for summary in results['event_types'].values())
+        self.assertEqual(processed_events, results['events'])
+        self.assertEqual(sum(summary['errors'] for summary in results['event_types'].values()), 0)
+        self.assertGreater(results['state_sizes']['queries'], 0)
+
+    def test_save_results_and_compare(self):
+        results = run_benchmark(publishers=2, workers=2, queries=2, churn=0, seed=1, cmd_batch_size=10)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = save_results(results, os.path.join(tmp_dir, 'results.json'))
+            with open(output_path) as f:
+                saved_results = json.load(f)
+
+        rows = dict((name, (old, new)) for name, old, new in compare_results(saved_results, saved_results))
+        self.assertEqual(rows['events_per_second'], (results['events_per_second'], results['events_per_second']))
+        self.assertIn('QueryReceived.latency_p99', rows)
+
+    def test_sharing_benchmark_should_reduce_bufferstreams(self):
+        mode_results = run_sharing_benchmark(publishers=3, workers=5, queries=60, churn=0, seed=1, cmd_batch_size=10)
+
+        self.assertEqual(len({summary['queries'] for summary in mode_results.values()}), 1)
+        self.assertLessEqual(mode_results['canonical']['bufferstreams'], mode_results['exact']['bufferstreams'])
+        self.assertLess(mode_results['superset']['bufferstreams'], mode_results['canonical']['bufferstreams'])
+
+
+class TestBenchmarkStartup(TestCase):
+
+    def test_run_startup_benchmark_measures_import_and_ready(self):
+        results = run_startup_benchmark(repeat=1)
+
+        self.assertEqual(results['runs'], 1)
+        startup = results['startup']
+        self.assertGreater(startup['import_seconds']['median'], 0)
+        self.assertGreaterEqual(startup['ready_seconds']['median'], startup['import_seconds']['median'])
+        self.assertGreaterEqual(startup['process_seconds']['median'], startup['ready_seconds']['median'])
@@ -0,0 +1,91 @@
+from unittest import TestCase
+
+from client_manager.bufferstreams import (
+    BUFFER_STREAM_SHARING_CANONICAL,
+    BUFFER_STREAM_SHARING_EXACT,
+    BUFFER_STREAM_SHARING_SUPERSET,
+    BufferStreamIndex,
+    BufferStreamPlanner,
+)
+
+
+class TestBufferStreamIndex(TestCase):
+
+    def setUp(self):
+        self.index = BufferStreamIndex()
+
+    def test_add_should_update_both_directions(self):
+        self.index.add('buffer-1', 'query-1')
+        self.index.add('buffer-1', 'query-2')
+
+        self.assertDictEqual(self.index.buffer_hash_to_query_map, {'buffer-1': {'query-1', 'query-2'}})
+        self.assertEqual(self.index.get_buffer_stream_key('query-1'), 'buffer-1')
+        self.assertEqual(self.index.get_buffer_stream_key('query-2'), 'buffer-1')
+
+    def test_add_same_query_to_other_buffer_should_move_it(self):
+        self.index.add('buffer-1', 'query-1')
+        self.index.add('buffer-2', 'query-1')
+
+        self.assertDictEqual(self.index.buffer_hash_to_query_map, {'buffer-2': {'query-1'}})
+        self.assertEqual(self.index.get_buffer_stream_key('query-1'), 'buffer-2')
+
+    def test_remove_should_only_touch_query_buffer(self):
+        self.index.add('buffer-1', 'query-1')
+        self.index.add('buffer-1', 'query-2')
+        self.index.add('buffer-2', 'query-3')
+
+        removed_key = self.index.remove('query-1')
+
+        self.assertEqual(removed_key, 'buffer-1')
+        self.assertDictEqual(
+            self.index.buffer_hash_to_query_map,
+            {'buffer-1': {'query-2'}, 'buffer-2': {'query-3'}}
+        )
+        self.assertIsNone(self.index.get_buffer_stream_key('query-1'))
+
+    def test_remove_last_query_should_remove_buffer(self):
+        self.index.add('buffer-1', 'query-1')
+        self.index.add('buffer-2', 'query-2')
+
+        self.index.remove('query-2')
+
+        self.assertNotIn('buffer-2', self.index)
+        self.assertEqual(len(self.index), 1)
+
+    def test_remove_non_existing_query_should_be_ignored(self):
+        self.index.add('buffer-1', 'query-1')
+
+        self.assertIsNone(self.index.remove('query-2'))
+        self.assertDictEqual(self.index.buffer_hash_to_query_map, {'buffer-1': {'query-1'}})
+
+
+class TestBufferStreamPlanner(TestCase):
+
+    def test_exact_mode_should_keep_query_content(self):
+        planner = BufferStreamPlanner(mode=BUFFER_STREAM_SHARING_EXACT)
+        self.assertFalse(planner.shares_buffer_streams)
+        self.assertEqual(planner.plan_content(['B', 'A'], [('A', 'B', 'C')]), ('B', 'A'))
+
+    def test_canonical_mode_should_only_sort_the_key_content(self):
+        planner = BufferStreamPlanner(mode=BUFFER_STREAM_SHARING_CANONICAL)
+        self.assertTrue(planner.shares_buffer_streams)
+        self.assertEqual(planner.plan_content(['B', 'A', 'B'], [('A', 'B', 'C')]), ('B', 'A'))
+        self.assertEqual(planner.get_key_content(('B', 'A')), ('A', 'B'))
+        self.assertEqual(BufferStreamPlanner(mode=BUFFER_STREAM_SHARING_EXACT).get_key_content(['B', 'A']), ('B', 'A'))
+
+    def test_superset_mode_should_join_smallest_superset_bufferstream(self):
+        planner = BufferStreamPlanner(mode=BUFFER_STREAM_SHARING_SUPERSET)
+        buffer_stream_contents = [('A', 'B', 'C'), ('A', 'C'), ('B', 'D'), None]
+        self.assertEqual(planner.plan_content(['C', 'A'], buffer_stream_contents), ('C', 'A'))
+        self.assertEqual(planner.plan_content(['A'], buffer_stream_contents), ('A', 'C'))
+        self.assertEqual(planner.plan_content(['B'], buffer_stream_contents), ('B', 'D'))
+        self.assertEqual(planner.plan_content(['A', 'B'], buffer_stream_contents), ('A', 'B', 'C'))
+        self.assertEqual(planner.plan_content(['D', 'A'], buffer_stream_contents), ('D', 'A'))
+
+    def test_superset_mode_should_keep_the_superset_bufferstream_order(self):
+        planner = BufferStreamPlanner(mode=BUFFER_STREAM_SHARING_SUPERSET)
+        self.assertEqual(planner.plan_content(['A', 'C'], [['C', 'B', 'A']]), ('C', 'B', 'A'))
+
+    def test_unknown_mode_should_raise_error(self):
+        with self.assertRaises(ValueError):
+            BufferStreamPlanner(mode='unknown')
@@ -0,0 +1,185 @@
+import json
+from unittest import TestCase
+
+from benchmarks.workload import SyntheticWorkload, create_service
+from client_manager.batching import write_events_pipelined
+from client_manager.catalog import RedisQueryCatalog
+from client_manager.in_memory_streams import InMemoryStreamFactory
+from client_manager.records import record_to_dict
+
+from tests.fake_redis import FakeRedis
+
+
+def new_query(query_id, publisher_id='pub1', buffer_stream_key='bs1'):
+    return {
+        'query_id': query_id,
+        'buffer_stream': {'publisher_id': publisher_id, 'buffer_stream_key': buffer_stream_key},
+        'service_chain': ['ObjectDetection'],
+    }
+
+
+class FakeRedisStream():
+
+    def __init__(self, redis_db, key):
+        self.redis_db = redis_db
+        self.key = key
+
+
+class TestRedisQueryCatalog(TestCase):
+
+    def setUp(self):
+        self.redis_db = FakeRedis()
+        self.catalog = RedisQueryCatalog(self.redis_db, 'cm:catalog')
+        self.buffer_streams = {}
+
+    def get_buffer_stream_dict(self, buffer_stream_key):
+        return self.buffer_streams.get(buffer_stream_key)
+
+    def test_pop_update_without_changes_should_return_none(self):
+        self.assertIsNone(self.catalog.pop_update(self.get_buffer_stream_dict))
+
+    def test_write_update_should_set_and_remove_entries(self):
+        self.buffer_streams['bs1'] = {'publisher_id': 'pub1', 'buffer_stream_key': 'bs1', 'query_ids': ['q1']}
+        self.catalog.set_query(new_query('q1'))
+        self.catalog.set_query(new_query('q2', buffer_stream_key='bs2'))
+        self.catalog.write_events(self.catalog.pop_update(self.get_buffer_stream_dict))
+
+        catalog = self.catalog.read()
+        self.assertEqual(catalog['version'], 1)
+        self.assertEqual(catalog['queries'], {'q1': new_query('q1'), 'q2': new_query('q2', buffer_stream_key='bs2')})
+        self.assertEqual(catalog['bufferstreams'], {'bs1': self.buffer_streams['bs1']})
+
+        del self.buffer_streams['bs1']
+        self.catalog.remove_query(new_query('q1'))
+        update = self.catalog.pop_update(self.get_buffer_stream_dict)
+        self.assertEqual(update.del_query_ids, ['q1'])
+        self.assertEqual(update.del_buffer_stream_keys, ['bs1'])
+        self.catalog.write_events(update)
+
+        catalog = self.catalog.read()
+        self.assertEqual(catalog['version'], 2)
+        self.assertEqual(list(catalog['queries'].keys()), ['q2'])
+        self.assertEqual(catalog['bufferstreams'], {})
+        self.assertEqual(self.redis_db.executed_pipelines, [True, True, True, True])
+
+    def test_pop_update_should_skip_buffer_streams_not_owned(self):
+        self.buffer_streams['bs1'] = {'publisher_id': 'pub1', 'buffer_stream_key': 'bs1', 'query_ids': ['q1']}
+        self.catalog.set_query(new_query('q1'))
+        update = self.catalog.pop_update(self.get_buffer_stream_dict, owns_publisher_id=lambda p_id: p_id != 'pub1')
+        self.assertEqual(list(update.set_queries.keys()), ['q1'])
+        self.assertEqual(update.set_buffer_streams, {})
+        self.assertIsNone(self.catalog.pop_update(self.get_buffer_stream_dict))
+
+    def test_rebuild_should_remove_stale_entries_of_owned_publishers_only(self):
+        self.buffer_streams['bs1'] = {'publisher_id': 'pub1', 'buffer_stream_key': 'bs1', 'query_ids': ['q1']}
+        self.buffer_streams['bs2'] = {'publisher_id': 'pub2', 'buffer_stream_key': 'bs2', 'query_ids': ['q2']}
+        self.catalog.set_query(new_query('q1'))
+        self.catalog.set_query(new_query('q2', publisher_id='pub2', buffer_stream_key='bs2'))
+        self.catalog.write_events(self.catalog.pop_update(self.get_buffer_stream_dict))
+
+        self.catalog.rebuild(None, owns_publisher_id=lambda p_id: p_id == 'pub1')
+
+        catalog = self.catalog.read()
+        self.assertEqual(list(catalog['queries'].keys()), ['q2'])
+        self.assertEqual(list(catalog['bufferstreams'].keys()), ['bs2'])
+
+    def test_read_should_include_last_stream_ids(self):
+        self.redis_db.xadd('QueryCreated', {'event': '{}'})
+        last_id = self.redis_db.xadd('QueryCreated', {'event': '{}'})
+
+        catalog = self.catalog.read(stream_keys=['QueryCreated', 'QueryRemoved'])
+        self.assertEqual(catalog['version'], 0)
+        self.assertEqual(catalog['last_stream_ids'], {'QueryCreated': last_id.decode('utf-8'), 'QueryRemoved': None})
+
+    def test_write_events_pipelined_should_write_update_with_events_in_one_transaction(self):
+        stream = FakeRedisStream(self.redis_db, 'QueryCreated')
+        self.catalog.set_query(new_query('q1'))
+        update = self.catalog.pop_update(self.get_buffer_stream_dict)
+
+        write_events_pipelined([(stream, {'event': '{}'}), (self.catalog, update)], transaction=True)
+
+        self.assertEqual(self.redis_db.executed_pipelines, [True])
+        catalog = self.catalog.read(stream_keys=['QueryCreated'])
+        self.assertEqual(catalog['version'], 1)
+        self.assertEqual(list(catalog['queries'].keys()), ['q1'])
+        self.assertIsNotNone(catalog['last_stream_ids']['QueryCreated'])
+
+
+class TestClientManagerQueryCatalog(TestCase):
+
+    def setUp(self):
+        self.redis_db = FakeRedis()
+        self.stream_factory = InMemoryStreamFactory()
+        self.workload = SyntheticWorkload(publishers=20, workers=5, queries=60, churn=0.3, seed=5)
+
+    def create_service(self, **kwargs):
+        return create_service(
+            stream_factory=self.stream_factory, cmd_batch_size=50,
+            query_catalog=RedisQueryCatalog(self.redis_db, 'cm:catalog'), **kwargs)
+
+    def drain(self, *services):
+        while any(service.service_cmd.pending_events_count() > 0 for service in services):
+            for service in services:
+                service.process_cmd()
+
+    def assert_catalog_matches(self, services):
+        catalog = RedisQueryCatalog(self.redis_db, 'cm:catalog').read()
+        queries = {
+            query_id: json.loads(json.dumps(record_to_dict(query)))
+            for service in services for query_id, query in service.queries.items()
+        }
+        self.assertEqual(catalog['queries'], queries)
+        buffer_streams = {}
+        for service in services:
+            for buffer_stream_key in service.bufferstreams.buffer_hash_to_query_map.keys():
+                buffer_streams[buffer_stream_key] = service.get_query_catalog_buffer_stream_dict(buffer_stream_key)
+        self.assertEqual(catalog['bufferstreams'], buffer_streams)
+        self.assertGreater(catalog['version'], 0)
+
+    def test_catalog_should_match_service_state(self):
+        service = self.create_service()
+        self.workload.write_events(self.stream_factory)
+        self.drain(service)
+
+        self.assertGreater(len(service.queries), 0)
+        self.assert_catalog_matches([service])
+
+    def test_catalog_should_match_state_of_all_shards(self):
+        shards = [
+            self.create_service(shard_id=shard_id, shard_ids=['shard_a', 'shard_b'])
+            for shard_id in ['shard_a', 'shard_b']
+        ]
+        self.workload.write_events(self.stream_factory)
+        self.drain(*shards)
+
+        self.assert_catalog_matches(shards)
+
+    def test_catalog_should_keep_the_queries_of_all_shards_when_a_shard_joins_with_incomplete_shard_ids(self):
+        shards = [
+            self.create_service(shard_id=shard_id, shard_ids=['shard_a', 'shard_b'])
+            for shard_id in ['shard_a', 'shard_b']
+        ]
+        self.workload.write_events(self.stream_factory)
+        self.drain(*shards)
+        num_queries = len(RedisQueryCatalog(self.redis_db, 'cm:catalog').read()['queries'])
+
+        new_shard = self.create_service(shard_id='shard_c', shard_ids=[])
+        shards.append(new_shard)
+        new_shard.start()
+        self.assertEqual(len(RedisQueryCatalog(self.redis_db, 'cm:catalog').read()['queries']), num_queries)
+        self.drain(*shards)
+
+        self.assertFalse(new_shard.is_joining_shards())
+        self.assertGreater(len(new_shard.queries), 0)
+        self.assertEqual(len(RedisQueryCatalog(self.redis_db, 'cm:catalog').read()['queries']), num_queries)
+        self.assert_catalog_matches(shards)
+
+    def test_rebuild_query_catalog_should_replace_stale_entries(self):
+        service = self.create_service()
+        self.workload.write_events(self.stream_factory)
+        self.drain(service)
+        self.redis_db.hset('cm:catalog:queries', 'stale', json.dumps(new_query('stale', publisher_id='publisher_0')))
+
+        service.rebuild_query_catalog()
+
+        self.assert_catalog_matches([service])
@@ -1,9 +1,17 @@
 import copy
+import json
+import pickle
+import threading
 from unittest.mock import patch, MagicMock
 
 from event_service_utils.tests.base_test_case import MockedEventDrivenServiceStreamTestCase
 from event_service_utils.tests.json_msg_helper import prepare_event_msg_tuple
 
+from client_manager.bufferstreams import (
+    BUFFER_STREAM_SHARING_CANONICAL, BUFFER_STREAM_SHARING_SUPERSET, BufferStreamPlanner
+)
+from client_manager.keys import KEY_SCHEME_COMPAT, blake2b_query_id
+from client_manager.records import PublisherRecord, QueryRecord
 from client_manager.service import ClientManager
 from client_manager.service_registry import ServiceRegistry
 
@@ -64,6 +72,207 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
         self.assertTrue(mocked_process_event_type.called)
         self.service.process_event_type.assert_called_once_with(event_type=event_type, event_data=event_data, json_msg=msg_tuple[1])
 
+    @patch('client_manager.service.ClientManager.flush_pub_events')
+    @patch('client_manager.service.ClientManager.process_event_type')
+    def test_process_cmd_should_process_batch_in_order_and_flush_once(self, mocked_process_event_type, mocked_flush):
+        mocked_process_event_type.__name__ = 'process_event_type'
+
+        def process_event_type(event_type, event_data, json_msg):
+            self.service.publish_query_created({'query_id': event_data['id']})
+        mocked_process_event_type.side_effect = process_event_type
+
+        first = ('1000-0', prepare_event_msg_tuple({'id': 'first'})[1])
+        second = ('1000-1', prepare_event_msg_tuple({'id': 'second'})[1])
+        third = ('1001-0', prepare_event_msg_tuple({'id': 'third'})[1])
+        self.service.cmd_batch_size = 2
+        self.service.service_cmd.mocked_values_dict = {
+            b'QueryReceived': [first, third],
+            b'PublisherCreated': [second, None],
+        }
+        self.service.process_cmd()
+
+        processed_ids = [c[1]['event_data']['id'] for c in mocked_process_event_type.call_args_list]
+        self.assertListEqual(processed_ids, ['first', 'second', 'third'])
+        mocked_flush.assert_called_once()
+        buffered_pub_events = mocked_flush.call_args[0][0]
+        self.assertEqual(len(buffered_pub_events), 3)
+        self.assertTrue(all(stream.key == 'QueryCreated' for stream, _ in buffered_pub_events))
+
+    @patch('client_manager.service.ClientManager.process_event_type')
+    def test_process_cmd_should_skip_duplicated_events(self, mocked_process_event_type):
+        mocked_process_event_type.__name__ = 'process_event_type'
+        first = ('1000-0', prepare_event_msg_tuple({'id': 'first'})[1])
+        second = ('1000-1', prepare_event_msg_tuple({'id': 'second'})[1])
+        redelivered_first = ('1000-2', prepare_event_msg_tuple({'id': 'first'})[1])
+        self.service.cmd_batch_size = 3
+        self.service.service_cmd.mocked_values_dict = {
+            b'PublisherRemoved': [first, second, redelivered_first],
+        }
+        self.service.process_cmd()
+
+        processed_ids = [c[1]['event_data']['id'] for c in mocked_process_event_type.call_args_list]
+        self.assertListEqual(processed_ids, ['first', 'second'])
+        self.assertEqual(self.service.event_type_metrics['PublisherRemoved'].duplicates, 1)
+        self.assertEqual(self.service.event_dedupe_window.duplicates, 1)
+        self.assertDictEqual(self.service.last_processed_stream_ids, {'PublisherRemoved': '1000-2'})
+        self.assertIn(
+            'client_manager_event_duplicates_total{event_type="PublisherRemoved"} 1.0',
+            self.service.get_metrics_text().decode('utf-8'))
+
+    @patch('client_manager.service.ClientManager.process_event_type')
+    def test_process_cmd_should_process_event_delivered_again_after_its_handler_failed(
+            self, mocked_process_event_type):
+        mocked_process_event_type.__name__ = 'process_event_type'
+        mocked_process_event_type.side_effect = [Exception('handler failed'), None, None]
+        self.service.cmd_batch_size = 3
+        self.service.service_cmd.mocked_values_dict = {
+            b'PublisherRemoved': [
+                (f'1000-{i}', prepare_event_msg_tuple({'id': 'first'})[1]) for i in range(3)
+            ],
+        }
+        self.service.process_cmd()
+
+        processed_ids = [c[1]['event_data']['id'] for c in mocked_process_event_type.call_args_list]
+        self.assertListEqual(processed_ids, ['first', 'first'])
+        self.assertEqual(self.service.event_dedupe_window.duplicates, 1)
+        self.assertIn('first', self.service.event_dedupe_window)
+
+    @patch('client_manager.query_cache.ParsedQueryCache.prefetch')
+    def test_prefetch_query_parses_should_skip_duplicated_events(self, mocked_prefetch):
+        self.service.event_dedupe_window.check_and_add('first')
+        cmd_events = [
+            ('QueryReceived', '1000-0',
+             prepare_event_msg_tuple({'id': 'first', 'subscriber_id': 'sub1', 'query': 'q1'})[1]),
+            ('QueryReceived', '1000-1',
+             prepare_event_msg_tuple({'id': 'second', 'subscriber_id': 'sub1', 'query': 'q2'})[1]),
+        ]
+        self.service.prefetch_query_parses(cmd_events)
+
+        mocked_prefetch.assert_called_once_with(['q2'], self.service.parse_executor)
+
+    @patch('client_manager.service.ClientManager.process_event_type')
+    def test_process_cmd_should_update_last_processed_stream_ids(self, mocked_process_event_type):
+        mocked_process_event_type.__name__ = 'process_event_type'
+        self.service.service_cmd.mocked_values_dict = {
+            b'QueryReceived': [(b'1000-0', prepare_event_msg_tuple({'id': 'first'})[1])],
+        }
+        self.service.process_cmd()
+
+        self.assertDictEqual(self.service.last_processed_stream_ids, {'QueryReceived': '1000-0'})
+
+    def test_state_snapshot_should_restore_state_and_rebuild_bufferstreams(self):
+        query = {
+            'subscriber_id': 'sub1',
+            'query_id': 'q1',
+            'parsed_query': {'content': ['ObjectDetection']},
+            'buffer_stream': {'buffer_stream_key': 'b1', 'publisher_id': 'pub1'},
+        }
+        self.service.publishers = {'pub1': {'id': 'pub1'}}
+        self.service.queries = {'q1': query}
+        self.service.last_processed_stream_ids = {'QueryReceived': '1000-0'}
+        snapshot = copy.deepcopy(self.service.get_state_snapshot())
+
+        self.service.queries = {}
+        self.service.publishers = {}
+        self.service.bufferstreams.clear()
+        self.service.state_snapshot_store = MagicMock()
+        self.service.state_snapshot_store.load.return_value = snapshot
+        self.assertTrue(self.service.load_state_snapshot())
+
+        self.assertDictEqual(self.service.queries, {'q1': query})
+        self.assertDictEqual(self.service.publishers, {'pub1': {'id': 'pub1'}})
+        self.assertDictEqual(self.service.buffer_hash_to_query_map, {'b1': {'q1'}})
+        self.assertEqual(self.service.bufferstreams.get_buffer_stream_key('q1'), 'b1')
+        self.assertSetEqual(self.service.publisher_to_query_map.get_items('pub1'), {'q1'})
+        self.assertSetEqual(self.service.subscriber_to_query_map.get_items('sub1'), {'q1'})
+
+    def test_state_snapshot_should_restore_query_and_publisher_records(self):
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        self.service.process_query_received('event1', 'sub1', query_text=self.SIMPLE_QUERY_TEXT)
+        query_id = self.service.create_query_id('sub1', 'my_first_query')
+        query = self.service.queries[query_id]
+        snapshot = pickle.loads(pickle.dumps(self.service.get_state_snapshot()))
+
+        self.service.queries = {}
+        self.service.publishers = {}
+        self.service.restore_state_snapshot(snapshot)
+
+        self.assertIsInstance(self.service.queries[query_id], QueryRecord)
+        self.assertIsInstance(self.service.publishers['test'], PublisherRecord)
+        self.assertEqual(self.service.queries[query_id].to_dict(), query.to_dict())
+        buffer_stream_key = query['buffer_stream']['buffer_stream_key']
+        self.assertSetEqual(self.service.bufferstreams.get_query_ids(buffer_stream_key), {query_id})
+
+    @patch('client_manager.service.set_consumer_group_stream_ids')
+    def test_load_state_snapshot_should_replay_streams_without_ids_from_snapshot_time(self, mocked_set_ids):
+        self.service.last_processed_stream_ids = {'QueryReceived': '1000-0'}
+        snapshot = self.service.get_state_snapshot()
+        snapshot['created_at'] = 2.5
+        self.service.state_snapshot_store = MagicMock()
+        self.service.state_snapshot_store.load.return_value = snapshot
+
+        self.assertTrue(self.service.load_state_snapshot())
+
+        stream_ids = mocked_set_ids.call_args[0][1]
+        self.assertEqual(stream_ids['QueryReceived'], '1000-0')
+        self.assertEqual(stream_ids['PublisherCreated'], '2500-0')
+        self.assertEqual(set(stream_ids.keys()), set(self.service.service_cmd_cg_keys_map['default']))
+
+    @patch('client_manager.service.write_events_pipelined')
+    def test_state_snapshot_should_not_be_saved_after_failed_publish_write(self, mocked_write_events):
+        mocked_write_events.side_effect = ConnectionError('redis is down')
+        self.service.state_snapshot_store = MagicMock()
+
+        with self.assertRaises(ConnectionError):
+            with self.service.batched_publishing():
+                self.service.publish_query_created({'query_id': 'q1'})
+        self.service.stop()
+
+        self.assertTrue(self.service.pub_events_write_failed)
+        self.assertFalse(self.service.state_snapshot_store.save_serialized.called)
+
+    def test_idle_cmd_read_should_be_bounded_by_next_worker_expiration_and_expire_workers(self):
+        now = [0]
+        self.service.service_registry = ServiceRegistry(worker_heartbeat_ttl_seconds=10, clock=lambda: now[0])
+        self.service.process_service_worker_announced({'service_type': 'ObjectDetection', 'stream_key': 'w1'})
+        now[0] = 2.5
+        read_blocks = []
+        cmd_stream = MagicMock(block=0)
+
+        def read_stream_events_list(count):
+            read_blocks.append(cmd_stream.block)
+            now[0] = 10
+            return []
+        cmd_stream.read_stream_events_list.side_effect = read_stream_events_list
+        self.service.service_cmd_cg_stream_map['default'] = cmd_stream
+
+        self.service.process_cmd()
+
+        self.assertListEqual(read_blocks, [7500])
+        self.assertEqual(cmd_stream.block, 0)
+        self.assertDictEqual(self.service.service_registry.available_services, {})
+
+    def test_cmd_read_block_should_keep_shorter_or_non_blocking_reads(self):
+        now = [0]
+        self.service.service_registry = ServiceRegistry(worker_heartbeat_ttl_seconds=10, clock=lambda: now[0])
+        self.assertEqual(self.service.get_cmd_read_block_ms(0), 0)
+        self.service.process_service_worker_announced({'service_type': 'ObjectDetection', 'stream_key': 'w1'})
+
+        self.assertEqual(self.service.get_cmd_read_block_ms(100), 100)
+        self.assertIsNone(self.service.get_cmd_read_block_ms(None))
+        now[0] = 11
+        self.assertEqual(self.service.get_cmd_read_block_ms(0), 1)
+
+    def test_save_state_snapshot_if_due_should_save_after_n_events(self):
+        self.service.state_snapshot_store = MagicMock()
+        self.service.state_snapshot_every_n_events = 3
+
+        self.service.save_state_snapshot_if_due(2)
+        self.assertFalse(self.service.state_snapshot_store.save_serialized.called)
+        self.service.save_state_snapshot_if_due(1)
+        self.assertTrue(self.service.state_snapshot_store.save_serialized.called)
+        self.assertEqual(self.service._events_since_state_snapshot, 0)
+
     @patch('client_manager.service.ClientManager.process_query_received')
     def test_process_event_type_should_call_process_query_received_with_proper_parameters(self, mocked_q_created_event):
         event_data = {
@@ -114,6 +323,23 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
             meta=event_data['meta'],
         )
 
+    @patch('client_manager.service.ClientManager.process_publisher_updated')
+    def test_process_event_type_should_call_process_publisher_updated_with_proper_parameters(self, mocked_pub_upd):
+        event_data = {
+            'id': 1,
+            'publisher_id': 'pub1',
+            'meta': {'fps': '10'}
+        }
+
+        event_type = 'PublisherUpdated'
+        json_msg = prepare_event_msg_tuple(event_data)[1]
+        self.service.process_event_type(event_type, event_data, json_msg)
+        mocked_pub_upd.assert_called_once_with(
+            publisher_id=event_data['publisher_id'],
+            source=None,
+            meta=event_data['meta'],
+        )
+
     @patch('client_manager.service.ClientManager.process_publisher_removed')
     def test_process_event_type_should_call_process_publisher_removed_with_proper_parameters(self, mocked_pub_leave):
         event_data = {
@@ -128,6 +354,80 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
             publisher_id=event_data['publisher_id'],
         )
 
+    def test_process_event_type_should_ignore_unknown_event_type(self):
+        event_data = {'id': 1}
+        json_msg = prepare_event_msg_tuple(event_data)[1]
+        self.assertFalse(self.service.process_event_type('UnknownEvent', event_data, json_msg))
+
+    def test_register_event_type_handler_should_dispatch_to_plugin_handler(self):
+        plugin_handler = MagicMock()
+        self.service.register_event_type_handler(
+            'SomePluginEvent', plugin_handler, lambda event_data: {'value': event_data['value'] * 2})
+        event_data = {'id': 1, 'value': 21}
+        json_msg = prepare_event_msg_tuple(event_data)[1]
+
+        self.assertTrue(self.service.process_event_type('SomePluginEvent', event_data, json_msg))
+        plugin_handler.assert_called_once_with(value=42)
+        self.assertEqual(self.service.event_type_metrics['SomePluginEvent'].count, 1)
+
+    @patch('client_manager.service.ClientManager.process_publisher_removed')
+    def test_process_event_type_should_count_handler_errors(self, mocked_pub_leave):
+        mocked_pub_leave.side_effect = ValueError('error')
+        event_data = {'id': 1, 'publisher_id': 'pub1'}
+        json_msg = prepare_event_msg_tuple(event_data)[1]
+
+        with self.assertRaises(ValueError):
+            self.service.process_event_type('PublisherRemoved', event_data, json_msg)
+
+        metrics = self.service.event_type_metrics['PublisherRemoved']
+        self.assertEqual(metrics.count, 1)
+        self.assertEqual(metrics.errors, 1)
+
+    def test_get_metrics_text_should_include_event_type_cache_and_state_metrics(self):
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        event_data = {'id': 1, 'subscriber_id': 'sub1', 'query': self.SIMPLE_QUERY_TEXT}
+        self.service.process_event_type('QueryReceived', event_data, prepare_event_msg_tuple(event_data)[1])
+        self.service.process_event_type('QueryReceived', event_data, prepare_event_msg_tuple(event_data)[1])
+
+        metrics_text = self.service.get_metrics_text().decode('utf-8')
+
+        self.assertIn('client_manager_events_total{event_type="QueryReceived"} 2.0', metrics_text)
+        self.assertIn('client_manager_event_latency_seconds_count{event_type="QueryReceived"} 2.0', metrics_text)
+        self.assertIn('client_manager_event_latency_p99_seconds{event_type="QueryReceived"}', metrics_text)
+        self.assertIn('client_manager_events_per_second{event_type="QueryReceived"}', metrics_text)
+        self.assertIn('client_manager_query_parse_latency_seconds_count 1.0', metrics_text)
+        self.assertIn('client_manager_publish_latency_seconds_count 1.0', metrics_text)
+        self.assertIn('client_manager_parsed_query_cache_total{result="misses"} 1.0', metrics_text)
+        self.assertIn('client_manager_state_size{collection="queries"} 1.0', metrics_text)
+        self.assertIn('client_manager_state_size{collection="bufferstreams"} 1.0', metrics_text)
+
+    def test_metrics_redis_writer_should_write_metrics_while_idle(self):
+        self.service.stream_factory = MagicMock()
+        self.service.metrics_redis_key = 'cm-metrics'
+        self.service.metrics_redis_interval_seconds = 0.01
+        redis_db = self.service.stream_factory.redis_db
+        written = threading.Event()
+        redis_db.set.side_effect = lambda *args: written.set()
+
+        self.service.start_metrics_redis_writer()
+        try:
+            self.assertTrue(written.wait(5))
+        finally:
+            self.service.stop_metrics_redis_writer()
+
+        self.assertIsNone(self.service._metrics_redis_writer)
+        self.assertEqual(redis_db.set.call_args[0][0], 'cm-metrics')
+
+    def test_start_metrics_redis_writer_without_key_should_not_start_thread(self):
+        self.service.stream_factory = MagicMock()
+        self.service.metrics_redis_key = ''
+
+        self.service.start_metrics_redis_writer()
+        self.service.stop_metrics_redis_writer()
+
+        self.assertIsNone(self.service._metrics_redis_writer)
+        self.service.stream_factory.redis_db.set.assert_not_called()
+
     def test_create_query_id_properly_working(self):
         subscriber_id = 'sub_1'
         query_name = 'my incredible query'
@@ -137,7 +437,7 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
 
     @patch('client_manager.service.ClientManager.publish_query_created')
     @patch('client_manager.service.ClientManager.update_bufferstreams_from_new_query')
-    @patch('client_manager.service.ClientManager.create_query_dict')
+    @patch('client_manager.service.ClientManager.create_query_dict_from_parsed_query')
     def test_process_query_received_should_properly_include_query_into_datastructure(
             self, mocked_query_dict, mocked_buffer, mocked_pub):
         query_received_event_id = 'a_event_id'
@@ -174,7 +474,8 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
         mocked_query_dict.return_value = registered_query
         self.service.process_query_received(query_received_event_id, subscriber_id, query_text=self.SIMPLE_QUERY_TEXT)
 
-        mocked_query_dict.assert_called_once_with(query_received_event_id, subscriber_id, self.SIMPLE_QUERY_TEXT)
+        mocked_query_dict.assert_called_once_with(
+            query_received_event_id, subscriber_id, self.service.parse_query(self.SIMPLE_QUERY_TEXT))
         mocked_buffer.assert_called_once_with(query=registered_query)
         self.assertIn(query_id, self.service.queries.keys())
         self.assertIn(registered_query, self.service.queries.values())
@@ -182,7 +483,7 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
 
     @patch('client_manager.service.ClientManager.publish_query_created')
     @patch('client_manager.service.ClientManager.update_bufferstreams_from_new_query')
-    @patch('client_manager.service.ClientManager.create_query_dict')
+    @patch('client_manager.service.ClientManager.create_query_dict_from_parsed_query')
     def test_process_query_received_shouldnt_process_query_if_no_pub_registered(
             self, mocked_query_dict, mocked_buffer, mocked_pub):
         query_received_event_id = 'a_event_id'
@@ -192,7 +493,8 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
         mocked_query_dict.return_value = None
         self.service.process_query_received(query_received_event_id, subscriber_id, query_text=self.SIMPLE_QUERY_TEXT)
 
-        mocked_query_dict.assert_called_once_with(query_received_event_id, subscriber_id, self.SIMPLE_QUERY_TEXT)
+        mocked_query_dict.assert_called_once_with(
+            query_received_event_id, subscriber_id, self.service.parse_query(self.SIMPLE_QUERY_TEXT))
         self.assertFalse(mocked_buffer.called)
         self.assertFalse(mocked_pub.called)
 
@@ -201,7 +503,7 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
 
     @patch('client_manager.service.ClientManager.publish_query_created')
     @patch('client_manager.service.ClientManager.update_bufferstreams_from_new_query')
-    @patch('client_manager.service.ClientManager.create_query_dict')
+    @patch('client_manager.service.ClientManager.create_query_dict_from_parsed_query')
     def test_process_query_received_shouldn_include_duplicated_query(
             self, mocked_query_dict, mocked_buffer, mocked_pub):
         query_received_event_id = 'a_event_id'
@@ -249,6 +551,135 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
         self.assertNotIn(registered_query2, self.service.queries.values())
 
 
+    def test_process_query_received_should_parse_pending_query_once(self):
+        self.service.process_query_received('a_event_id', 'sub1', query_text=self.SIMPLE_QUERY_TEXT)
+
+        self.assertEqual(len(self.service.pending_queries), 1)
+        self.assertEqual(self.service.parsed_query_cache.misses, 1)
+        self.assertEqual(self.service.parsed_query_cache.hits, 0)
+
+    @patch('client_manager.service.ClientManager.create_query_dict_from_parsed_query')
+    def test_process_query_received_should_reject_cached_duplicated_query_before_parsing(self, mocked_query_dict):
+        subscriber_id = 'sub1'
+        parsed_query = self.service.parse_query(self.SIMPLE_QUERY_TEXT)
+        query_id = self.service.create_query_id(subscriber_id, parsed_query['name'])
+        self.service.queries[query_id] = {'query_id': query_id}
+        self.service.query_parser = MagicMock()
+        self.service.parsed_query_cache.query_parser = self.service.query_parser
+
+        self.service.process_query_received('a_event_id', subscriber_id, query_text=self.SIMPLE_QUERY_TEXT)
+
+        self.assertFalse(mocked_query_dict.called)
+        self.assertFalse(self.service.query_parser.parse.called)
+
+    @patch('client_manager.service.ClientManager.process_query_bulk_received')
+    def test_process_event_type_should_call_process_query_bulk_received_with_proper_parameters(self, mocked_bulk):
+        event_data = {
+            'id': 1,
+            'subscriber_id': 'sub_id',
+            'queries': [self.SIMPLE_QUERY_TEXT]
+        }
+        json_msg = prepare_event_msg_tuple(event_data)[1]
+        self.service.process_event_type('QueryBulkReceived', event_data, json_msg)
+        mocked_bulk.assert_called_once_with(
+            query_bulk_received_event_id=1, subscriber_id='sub_id', query_texts=[self.SIMPLE_QUERY_TEXT])
+
+    @patch('client_manager.service.ClientManager.flush_pub_events')
+    def test_process_query_bulk_received_should_report_each_query_in_one_batch(self, mocked_flush):
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        mocked_flush.reset_mock()
+        other_query_text = self.SIMPLE_QUERY_TEXT.replace('my_first_query', 'other_query')
+        query_texts = [self.SIMPLE_QUERY_TEXT, 'invalid query', other_query_text, self.SIMPLE_QUERY_TEXT]
+
+        results = self.service.process_query_bulk_received('bulk_event_id', 'sub1', query_texts)
+
+        self.assertEqual([result['status'] for result in results], ['created', 'error', 'created', 'duplicated'])
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3])
+        self.assertIsNotNone(results[1]['error'])
+        self.assertEqual(results[3]['query_id'], self.service.create_query_id('sub1', 'my_first_query'))
+        self.assertEqual(len(self.service.queries), 2)
+        self.assertEqual(self.service.parsed_query_cache.misses, 3)
+
+        mocked_flush.assert_called_once()
+        pub_events = mocked_flush.call_args[0][0]
+        self.assertEqual(len(pub_events), 3)
+        bulk_processed_stream = self.service.pub_event_stream_map['QueryBulkProcessed']
+        self.assertIs(pub_events[-1][0], bulk_processed_stream)
+
+    def test_process_query_bulk_received_should_report_empty_and_non_string_queries_as_errors(self):
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        query_texts = ['', None, 42, self.SIMPLE_QUERY_TEXT]
+
+        results = self.service.process_query_bulk_received('bulk_event_id', 'sub1', query_texts)
+
+        self.assertEqual([result['status'] for result in results], ['error', 'error', 'error', 'created'])
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3])
+        self.assertTrue(all(result['error'] for result in results[:3]))
+        self.assertEqual(len(self.service.queries), 1)
+
+    def test_process_query_bulk_received_without_publisher_should_keep_queries_pending(self):
+        results = self.service.process_query_bulk_received('bulk_event_id', 'sub1', [self.SIMPLE_QUERY_TEXT])
+
+        self.assertEqual(results[0]['status'], 'pending')
+        self.assertIn(results[0]['query_id'], self.service.pending_queries)
+        self.assertDictEqual(self.service.queries, {})
+
+    def test_process_query_bulk_received_should_mark_already_registered_query_as_duplicated(self):
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        self.service.process_query_received('event1', 'sub1', query_text=self.SIMPLE_QUERY_TEXT)
+
+        results = self.service.process_query_bulk_received('bulk_event_id', 'sub1', [self.SIMPLE_QUERY_TEXT])
+
+        self.assertEqual(results[0]['status'], 'duplicated')
+        self.assertEqual(self.service.queries[results[0]['query_id']]['query_received_event_id'], 'event1')
+
+    def test_compat_key_scheme_should_keep_legacy_keys_in_use(self):
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        self.service.process_query_received('event1', 'sub1', query_text=self.SIMPLE_QUERY_TEXT)
+        legacy_query_id = self.service.create_query_id('sub1', 'my_first_query')
+        legacy_buffer_stream_key = self.service.queries[legacy_query_id]['buffer_stream']['buffer_stream_key']
+
+        self.service.key_generator = self.service.create_key_generator(KEY_SCHEME_COMPAT)
+        self.service.process_query_received('event2', 'sub2', query_text=self.SIMPLE_QUERY_TEXT)
+
+        new_query_id = self.service.create_query_id('sub2', 'my_first_query')
+        self.assertEqual(new_query_id, blake2b_query_id('sub2', 'my_first_query'))
+        self.assertEqual(self.service.create_query_id('sub1', 'my_first_query'), legacy_query_id)
+        self.assertSetEqual(
+            self.service.bufferstreams.get_query_ids(legacy_buffer_stream_key), {legacy_query_id, new_query_id})
+
+        self.service.process_query_deletion_requested('sub1', 'my_first_query')
+        self.assertNotIn(legacy_query_id, self.service.queries)
+
+    def test_process_query_received_without_publisher_should_keep_query_pending(self):
+        self.service.process_query_received('a_event_id', 'sub1', query_text=self.SIMPLE_QUERY_TEXT)
+
+        query_id = self.service.create_query_id('sub1', 'my_first_query')
+        self.assertDictEqual(self.service.queries, {})
+        self.assertIn(query_id, self.service.pending_queries)
+        self.assertEqual(self.service.pending_queries.entries[query_id].publisher_id, 'test')
+
+    @patch('client_manager.service.ClientManager.flush_pub_events')
+    def test_process_publisher_created_should_register_pending_queries_in_one_batch(self, mocked_flush):
+        self.service.process_query_received('event1', 'sub1', query_text=self.SIMPLE_QUERY_TEXT)
+        self.service.process_query_received('event2', 'sub2', query_text=self.SIMPLE_QUERY_TEXT)
+
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+
+        query_ids = {self.service.create_query_id(sub_id, 'my_first_query') for sub_id in ['sub1', 'sub2']}
+        self.assertSetEqual(set(self.service.queries.keys()), query_ids)
+        self.assertEqual(len(self.service.pending_queries), 0)
+        self.assertEqual(len(self.service.buffer_hash_to_query_map), 1)
+        mocked_flush.assert_called_once()
+        self.assertEqual(len(mocked_flush.call_args[0][0]), 2)
+
+    def test_process_query_deletion_requested_should_remove_pending_query(self):
+        self.service.process_query_received('a_event_id', 'sub1', query_text=self.SIMPLE_QUERY_TEXT)
+
+        self.service.process_query_deletion_requested('sub1', 'my_first_query')
+
+        self.assertEqual(len(self.service.pending_queries), 0)
+
     @patch('client_manager.service.ClientManager.publish_query_removed')
     @patch('client_manager.service.ClientManager.update_bufferstreams_from_del_query')
     @patch('client_manager.service.ClientManager.create_query_id')
@@ -324,6 +755,275 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
         self.assertNotIn(publisher_id, self.service.publishers.keys())
         self.assertNotIn(publisher, self.service.publishers.values())
 
+    @patch('client_manager.service.ClientManager.flush_pub_events')
+    def test_process_publisher_removed_should_remove_its_queries_and_bufferstreams(self, mocked_flush):
+        meta = {'resolution': '300x300', 'fps': '30'}
+        self.service.process_publisher_created('test', 'rtmp://source', meta)
+        self.service.process_publisher_created('other', 'rtmp://other', meta)
+        self.service.process_query_received('event1', 'sub1', query_text=self.SIMPLE_QUERY_TEXT)
+        self.service.process_query_received(
+            'event2', 'sub1',
+            query_text=self.SIMPLE_QUERY_TEXT.replace('FROM test', 'FROM other').replace(
+                'my_first_query', 'other_query'))
+        self.service.process_query_received('event3', 'sub2', query_text=self.SIMPLE_QUERY_TEXT)
+        self.service.process_query_received('event4', 'sub3', query_text=self.SIMPLE_QUERY_TEXT)
+        removed_query_ids = sorted(
+            self.service.create_query_id(subscriber_id, 'my_first_query') for subscriber_id in ['sub1', 'sub2', 'sub3'])
+        mocked_flush.reset_mock()
+
+        self.service.process_publisher_removed('test')
+
+        remaining_query_id = self.service.create_query_id('sub1', 'other_query')
+        self.assertListEqual(list(self.service.queries.keys()), [remaining_query_id])
+        self.assertEqual(len(self.service.buffer_hash_to_query_map), 1)
+        self.assertNotIn('test', self.service.publisher_to_query_map)
+        mocked_flush.assert_called_once()
+        removed_events = mocked_flush.call_args[0][0]
+        self.assertTrue(all(stream.key == 'QueryRemoved' for stream, _ in removed_events))
+        self.assertListEqual(
+            [json.loads(event['event'])['query_id'] for _, event in removed_events], removed_query_ids)
+        self.assertEqual(len(self.service.pending_queries), 0)
+
+    def test_process_publisher_removed_should_requeue_queries_if_enabled(self):
+        self.service.requeue_queries_on_publisher_removed = True
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        self.service.process_query_received('event1', 'sub1', query_text=self.SIMPLE_QUERY_TEXT)
+
+        self.service.process_publisher_removed('test')
+        self.assertDictEqual(self.service.queries, {})
+        self.assertEqual(len(self.service.pending_queries), 1)
+
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        self.assertEqual(len(self.service.queries), 1)
+        self.assertEqual(len(self.service.pending_queries), 0)
+
+    @patch('client_manager.service.ClientManager.flush_pub_events')
+    def test_process_publisher_updated_should_rekey_only_its_changed_bufferstreams(self, mocked_flush):
+        meta = {'resolution': '300x300', 'fps': '30'}
+        self.service.process_publisher_created('test', 'rtmp://source', meta)
+        self.service.process_publisher_created('other', 'rtmp://other', meta)
+        self.service.process_query_received('event1', 'sub1', query_text=self.SIMPLE_QUERY_TEXT)
+        self.service.process_query_received('event2', 'sub2', query_text=self.SIMPLE_QUERY_TEXT)
+        self.service.process_query_received(
+            'event3', 'sub1',
+            query_text=self.SIMPLE_QUERY_TEXT.replace('FROM test', 'FROM other').replace(
+                'my_first_query', 'other_query'))
+        other_query_id = self.service.create_query_id('sub1', 'other_query')
+        other_buffer_stream_key = self.service.queries[other_query_id]['buffer_stream']['buffer_stream_key']
+        old_buffer_stream_key = self.service.queries[
+            self.service.create_query_id('sub1', 'my_first_query')]['buffer_stream']['buffer_stream_key']
+        mocked_flush.reset_mock()
+
+        self.service.process_publisher_updated('test', None, {'fps': '10'})
+
+        new_buffer_stream_key = self.service.get_unique_buffer_hash(
+            ('ObjectDetection', 'ColorDetection'), 'test', '300x300', '10')
+        test_query_ids = self.service.get_query_ids_by_publisher('test')
+        self.assertEqual(self.service.publishers['test']['meta'], {'resolution': '300x300', 'fps': '10'})
+        self.assertEqual(self.service.publishers['test']['source'], 'rtmp://source')
+        self.assertDictEqual(self.service.buffer_hash_to_query_map, {
+            new_buffer_stream_key: test_query_ids,
+            other_buffer_stream_key: {other_query_id},
+        })
+        self.assertEqual(self.service.publisher_to_buffer_stream_map.get_items('test'), {new_buffer_stream_key})
+        for query_id in test_query_ids:
+            self.assertEqual(self.service.queries[query_id]['buffer_stream']['fps'], '10')
+
+        mocked_flush.assert_called_once()
+        published_events = mocked_flush.call_args[0][0]
+        self.assertListEqual(
+            [stream.key for stream, _ in published_events], ['QueryRemoved', 'QueryCreated'] * 2)
+        removed_query = json.loads(published_events[0][1]['event'])
+        created_query = json.loads(published_events[1][1]['event'])
+        self.assertEqual(removed_query['query_id'], created_query['query_id'])
+        self.assertEqual(removed_query['buffer_stream']['buffer_stream_key'], old_buffer_stream_key)
+        self.assertEqual(created_query['buffer_stream']['buffer_stream_key'], new_buffer_stream_key)
+
+        mocked_flush.reset_mock()
+        self.service.process_publisher_updated('test', None, {'fps': '10'})
+        self.service.process_publisher_updated('missing', 'rtmp://missing', meta)
+        mocked_flush.assert_not_called()
+        self.assertNotIn('missing', self.service.publishers)
+
+    def test_query_service_chain_should_follow_the_query_qos_policy(self):
+        self.service.service_registry = ServiceRegistry()
+        self.service.process_service_worker_announced({
+            'service_type': 'FastDetection', 'stream_key': 'fast', 'content_types': ['ObjectDetection'],
+            'throughput': 50, 'accuracy': 0.5,
+        })
+        self.service.process_service_worker_announced({
+            'service_type': 'PreciseDetection', 'stream_key': 'precise', 'content_types': ['ObjectDetection'],
+            'throughput': 10, 'accuracy': 0.9,
+        })
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        for query_name, qos in [('q1', 'accuracy = 5, latency = 1'), ('q2', 'accuracy = 1, latency = 5')]:
+            self.service.process_query_received(
+                f'event-{query_name}', 'sub1', query_text=self.SIMPLE_QUERY_TEXT.replace(
+                    'my_first_query', query_name).replace('ObjectDetection, ColorDetection', 'ObjectDetection').replace(
+                    'RETURN *', f'WITH_QOS {qos}\n    RETURN *'))
+
+        self.assertListEqual(
+            self.service.queries[self.service.create_query_id('sub1', 'q1')]['service_chain'], ['PreciseDetection'])
+        self.assertListEqual(
+            self.service.queries[self.service.create_query_id('sub1', 'q2')]['service_chain'], ['FastDetection'])
+
+    def test_superset_bufferstream_sharing_should_share_bufferstream_and_chain(self):
+        self.service.bufferstream_planner = BufferStreamPlanner(mode=BUFFER_STREAM_SHARING_SUPERSET)
+        self.service.service_registry = ServiceRegistry()
+        self.service.process_service_worker_announced({'service_type': 'ObjectDetection', 'stream_key': 'obj'})
+        self.service.process_service_worker_announced({'service_type': 'ColorDetection', 'stream_key': 'clr'})
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        self.register_lookup_test_queries()
+        queries = [
+            ('q4', 'ColorDetection, ObjectDetection'),
+            ('q5', 'ColorDetection, ObjectDetection, PersonDetection'),
+        ]
+        for query_name, content in queries:
+            self.service.process_query_received(
+                f'event-{query_name}', 'sub3', query_text=self.SIMPLE_QUERY_TEXT.replace(
+                    'my_first_query', query_name).replace('ObjectDetection, ColorDetection', content))
+
+        # q1 (ObjectDetection) and q3 (ColorDetection) came before any superset bufferstream on their publisher
+        buffer_stream_keys = {
+            query['parsed_query']['name']: query['buffer_stream']['buffer_stream_key']
+            for query in self.service.queries.values()
+        }
+        self.assertEqual(len(set(buffer_stream_keys.values())), 5)
+        self.assertEqual(buffer_stream_keys['q4'], self.service.get_unique_buffer_hash(
+            ('ColorDetection', 'ObjectDetection'), 'test', '300x300', '30'))
+
+        self.service.process_query_received(
+            'event-q6', 'sub3', query_text=self.SIMPLE_QUERY_TEXT.replace('my_first_query', 'q6').replace(
+                'ObjectDetection, ColorDetection', 'ColorDetection'))
+        q6_query = self.service.queries[self.service.create_query_id('sub3', 'q6')]
+        self.assertEqual(q6_query['buffer_stream']['buffer_stream_key'], buffer_stream_keys['q3'])
+
+        self.service.process_query_deletion_requested('sub1', 'q1')
+        self.service.process_query_deletion_requested('sub2', 'q3')
+        self.service.process_query_received(
+            'event-q7', 'sub3', query_text=self.SIMPLE_QUERY_TEXT.replace('my_first_query', 'q7').replace(
+                'ObjectDetection, ColorDetection', 'ObjectDetection'))
+        q7_query = self.service.queries[self.service.create_query_id('sub3', 'q7')]
+        self.assertEqual(q7_query['buffer_stream']['buffer_stream_key'], buffer_stream_keys['q4'])
+        self.assertListEqual(q7_query['buffer_stream'].to_dict()['content'], ['ColorDetection', 'ObjectDetection'])
+        self.assertListEqual(q7_query['service_chain'], ['ColorDetection', 'ObjectDetection'])
+
+        # q4 was the last query with all the content types of q7's bufferstream, so q7 joins the q5 one
+        self.service.process_query_deletion_requested('sub3', 'q4')
+        q7_query = self.service.queries[self.service.create_query_id('sub3', 'q7')]
+        q5_query = self.service.queries[self.service.create_query_id('sub3', 'q5')]
+        self.assertEqual(
+            q7_query['buffer_stream']['buffer_stream_key'], q5_query['buffer_stream']['buffer_stream_key'])
+        self.assertListEqual(q7_query['service_chain'], ['ColorDetection', 'ObjectDetection'])
+        self.assertNotIn(buffer_stream_keys['q4'], self.service.bufferstreams)
+
+        self.service.process_query_deletion_requested('sub3', 'q6')
+        self.service.process_service_worker_removed({'stream_key': 'clr'})
+        self.assertListEqual(q7_query['service_chain'], ['ObjectDetection'])
+
+        self.service.process_publisher_updated('test', None, {'fps': '10'})
+        self.assertEqual(q7_query['buffer_stream']['buffer_stream_key'], self.service.get_unique_buffer_hash(
+            ('ColorDetection', 'ObjectDetection', 'PersonDetection'), 'test', '300x300', '10'))
+        self.assertEqual(
+            self.service.content_type_to_buffer_stream_map.get_keys(q7_query['buffer_stream']['buffer_stream_key']),
+            {'ColorDetection', 'ObjectDetection', 'PersonDetection'})
+        self.assertEqual(
+            set(self.service.content_type_to_buffer_stream_map.item_to_keys_map.keys()),
+            set(self.service.buffer_hash_to_query_map.keys()))
+
+    def register_bufferstream_sharing_test_queries(self, mode, queries):
+        self.service.bufferstream_planner = BufferStreamPlanner(mode=mode)
+        self.service.service_registry = ServiceRegistry()
+        for service_type in ['ObjectDetection', 'ColorDetection', 'PersonDetection']:
+            self.service.process_service_worker_announced({'service_type': service_type, 'stream_key': service_type})
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        for subscriber_id, query_name, content in queries:
+            self.service.process_query_received(
+                f'event-{query_name}', subscriber_id, query_text=self.SIMPLE_QUERY_TEXT.replace(
+                    'my_first_query', query_name).replace('ObjectDetection, ColorDetection', content))
+        return {
+            query['parsed_query']['name']: query for query in self.service.queries.values()
+        }
+
+    def test_canonical_bufferstream_sharing_should_keep_the_declared_chain_order(self):
+        queries = self.register_bufferstream_sharing_test_queries(BUFFER_STREAM_SHARING_CANONICAL, [
+            ('sub1', 'q1', 'ObjectDetection, ColorDetection'),
+            ('sub1', 'q2', 'ColorDetection, ObjectDetection'),
+        ])
+
+        self.assertEqual(
+            queries['q1']['buffer_stream']['buffer_stream_key'], queries['q2']['buffer_stream']['buffer_stream_key'])
+        self.assertListEqual(queries['q1']['service_chain'], ['ObjectDetection', 'ColorDetection'])
+        self.assertListEqual(queries['q2']['service_chain'], ['ColorDetection', 'ObjectDetection'])
+
+    @patch('client_manager.service.ClientManager.flush_pub_events')
+    def test_superset_bufferstream_guests_should_be_replanned_when_the_host_is_removed(self, mocked_flush):
+        queries = self.register_bufferstream_sharing_test_queries(BUFFER_STREAM_SHARING_SUPERSET, [
+            ('sub1', 'host', 'PersonDetection, ObjectDetection, ColorDetection'),
+            ('sub2', 'guest', 'ColorDetection, ObjectDetection'),
+        ])
+        host_buffer_stream_key = queries['host']['buffer_stream']['buffer_stream_key']
+        self.assertEqual(queries['guest']['buffer_stream']['buffer_stream_key'], host_buffer_stream_key)
+        self.assertListEqual(
+            queries['guest']['service_chain'], ['PersonDetection', 'ObjectDetection', 'ColorDetection'])
+        mocked_flush.reset_mock()
+
+        self.service.process_subscriber_queries_deletion_requested('sub1')
+
+        guest_query = self.service.queries[self.service.create_query_id('sub2', 'guest')]
+        self.assertNotEqual(guest_query['buffer_stream']['buffer_stream_key'], host_buffer_stream_key)
+        self.assertNotIn(host_buffer_stream_key, self.service.bufferstreams)
+        self.assertListEqual(guest_query['buffer_stream'].to_dict()['content'], ['ColorDetection', 'ObjectDetection'])
+        self.assertListEqual(guest_query['service_chain'], ['ColorDetection', 'ObjectDetection'])
+        published_events = mocked_flush.call_args[0][0]
+        published_event_types = [stream.key for stream, _ in published_events]
+        self.assertListEqual(published_event_types, ['QueryRemoved', 'QueryRemoved', 'QueryCreated'])
+
+    @patch('client_manager.service.ClientManager.flush_pub_events')
+    def test_service_worker_changes_should_only_update_chains_of_affected_queries(self, mocked_flush):
+        self.service.service_registry = ServiceRegistry()
+        self.service.process_service_worker_announced({'service_type': 'ObjectDetection', 'stream_key': 'obj'})
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        self.service.process_query_received('event1', 'sub1', query_text=self.SIMPLE_QUERY_TEXT)
+        self.service.process_query_received(
+            'event2', 'sub1',
+            query_text=self.SIMPLE_QUERY_TEXT.replace(', ColorDetection', '').replace('my_first_query', 'obj_query'))
+        color_query_id = self.service.create_query_id('sub1', 'my_first_query')
+        obj_query_id = self.service.create_query_id('sub1', 'obj_query')
+        self.assertListEqual(self.service.queries[color_query_id]['service_chain'], ['ObjectDetection'])
+        mocked_flush.reset_mock()
+
+        self.service.process_service_worker_announced({'service_type': 'ColorDetection', 'stream_key': 'clr'})
+
+        self.assertListEqual(
+            self.service.queries[color_query_id]['service_chain'], ['ObjectDetection', 'ColorDetection'])
+        published_events = mocked_flush.call_args[0][0]
+        self.assertListEqual([stream.key for stream, _ in published_events], ['QueryRemoved', 'QueryCreated'])
+
+        mocked_flush.reset_mock()
+        self.service.process_service_worker_removed({'stream_key': 'obj'})
+
+        self.assertListEqual(self.service.queries[color_query_id]['service_chain'], ['ColorDetection'])
+        self.assertListEqual(self.service.queries[obj_query_id]['service_chain'], [])
+        self.assertEqual(len(mocked_flush.call_args[0][0]), 4)
+
+    @patch('client_manager.service.ClientManager.process_service_worker_removed')
+    def test_process_event_type_should_call_process_service_worker_removed_with_proper_parameters(self, mocked_p_sw):
+        event_data = {
+            'id': 1,
+            'worker': {
+                'service_type': 'SomeService',
+                'stream_key': 'ss-data'
+            }
+        }
+
+        event_type = 'ServiceWorkerRemoved'
+        json_msg = prepare_event_msg_tuple(event_data)[1]
+        self.service.process_event_type(event_type, event_data, json_msg)
+        mocked_p_sw.assert_called_once_with(
+            worker=event_data['worker'],
+        )
+
     def test_get_unique_buffer_hash(self):
         query_content = ['abc', 'dfg']
         publisher_id = 'pub_id1'
@@ -459,7 +1159,7 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
     def test_update_bufferstreams_from_del_query_should_update_bufferstreams(self):
         query_id = '123'
         bufferstream_key = 'bufferstream-key'
-        self.service.buffer_hash_to_query_map = {bufferstream_key: set({query_id})}
+        self.service.bufferstreams.add(bufferstream_key, query_id)
 
         self.service.update_bufferstreams_from_del_query(query_id)
         self.assertDictEqual(
@@ -470,7 +1170,8 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
     def test_update_bufferstreams_from_del_query_shouldn_remove_bufferstream_if_not_empty(self):
         query_id = '123'
         bufferstream_key = 'bufferstream-key'
-        self.service.buffer_hash_to_query_map = {bufferstream_key: set({query_id, 'query_2'})}
+        self.service.bufferstreams.add(bufferstream_key, query_id)
+        self.service.bufferstreams.add(bufferstream_key, 'query_2')
 
         self.service.update_bufferstreams_from_del_query(query_id)
         self.assertDictEqual(
@@ -494,3 +1195,117 @@ class TestClientManager(MockedEventDrivenServiceStreamTestCase):
         mocked_p_sw.assert_called_once_with(
             worker=event_data['worker'],
         )
+
+    def test_log_state_should_only_log_changes_since_last_call(self):
+        self.service.logger.setLevel('DEBUG')
+        self.service.log_state()
+        self.service.publishers['pub1'] = PublisherRecord(id='pub1', source='rtmp://source', meta={})
+        self.service.publishers['pub2'] = PublisherRecord(id='pub2', source='rtmp://source', meta={})
+
+        with self.assertLogs(self.service.logger, level='DEBUG') as logs:
+            self.service.log_state()
+        publishers_log = [log for log in logs.output if '- Publishers:' in log][0]
+        self.assertIn('- Publishers: 2 (+2 ~0 -0)', publishers_log)
+        self.assertIn('-- + pub1', publishers_log)
+
+        del self.service.publishers['pub1']
+        with self.assertLogs(self.service.logger, level='DEBUG') as logs:
+            self.service.log_state()
+        publishers_log = [log for log in logs.output if '- Publishers:' in log][0]
+        self.assertIn('- Publishers: 1 (+0 ~0 -1)', publishers_log)
+        self.assertNotIn('pub2', publishers_log)
+
+    def test_log_state_should_skip_formatting_when_debug_is_disabled(self):
+        self.service.logger.setLevel('ERROR')
+        self.service.publishers['pub1'] = MagicMock()
+        self.service.log_state()
+
+        self.service.publishers['pub1'].__str__.assert_not_called()
+        self.assertEqual(self.service.publishers.pop_changes(), ([], [], []))
+
+    def test_dump_full_state_should_be_rate_limited(self):
+        self.service.full_state_dump_min_interval_seconds = 60
+        self.service.publishers['pub1'] = PublisherRecord(id='pub1', source='rtmp://source', meta={})
+
+        with self.assertLogs(self.service.logger, level='INFO') as logs:
+            thread = self.service.dump_full_state()
+            thread.join()
+            self.assertIsNone(self.service.dump_full_state())
+        self.assertTrue(any('- Publishers: 1' in log and 'pub1' in log for log in logs.output))
+        self.assertTrue(any('Ignoring full state dump request' in log for log in logs.output))
+
+    def register_lookup_test_queries(self):
+        self.service.process_publisher_created('test', 'rtmp://source', {'resolution': '300x300', 'fps': '30'})
+        self.service.process_publisher_created('other', 'rtmp://other', {'resolution': '300x300', 'fps': '30'})
+        queries = [
+            ('sub1', 'q1', 'test', 'ObjectDetection'),
+            ('sub1', 'q2', 'other', 'ObjectDetection, ColorDetection'),
+            ('sub2', 'q3', 'test', 'ColorDetection'),
+        ]
+        for subscriber_id, query_name, publisher_id, content in queries:
+            query_text = self.SIMPLE_QUERY_TEXT.replace('my_first_query', query_name).replace(
+                'FROM test', f'FROM {publisher_id}').replace('ObjectDetection, ColorDetection', content)
+            self.service.process_query_received(f'event-{query_name}', subscriber_id, query_text=query_text)
+
+    def get_lookup_query_names(self, **filters):
+        return sorted(query['parsed_query']['name'] for query in self.service.lookup_queries(**filters))
+
+    def test_lookup_queries_should_use_indexes_and_combine_filters(self):
+        self.register_lookup_test_queries()
+
+        self.assertEqual(self.get_lookup_query_names(subscriber_id='sub1'), ['q1', 'q2'])
+        self.assertEqual(self.get_lookup_query_names(publisher_id='test'), ['q1', 'q3'])
+        self.assertEqual(self.get_lookup_query_names(content_type='ColorDetection'), ['q2', 'q3'])
+        self.assertEqual(self.get_lookup_query_names(subscriber_id='sub1', content_type='ColorDetection'), ['q2'])
+        self.assertEqual(self.get_lookup_query_names(subscriber_id='sub3'), [])
+        with self.assertRaises(ValueError):
+            self.service.lookup_queries()
+
+        self.service.process_query_deletion_requested('sub1', 'q1')
+        self.assertEqual(self.get_lookup_query_names(subscriber_id='sub1'), ['q2'])
+
+    @patch('client_manager.service.ClientManager.publish_event_type_to_stream')
+    def test_process_query_lookup_requested_should_publish_found_queries(self, mocked_pub):
+        self.register_lookup_test_queries()
+        mocked_pub.reset_mock()
+        event_data = {'id': 'lookup-1', 'subscriber_id': 'sub2'}
+        self.service.process_event_type('QueryLookupRequested', event_data, prepare_event_msg_tuple(event_data)[1])
+
+        mocked_pub.assert_called_once()
+        self.assertEqual(mocked_pub.call_args[1]['event_type'], 'QueryLookupResponded')
+        new_event_data = mocked_pub.call_args[1]['new_event_data']
+        self.assertEqual(new_event_data['query_lookup_requested_event_id'], 'lookup-1')
+        self.assertIsNone(new_event_data['error'])
+        self.assertEqual([query['parsed_query']['name'] for query in new_event_data['queries']], ['q3'])
+        self.assertIsInstance(new_event_data['queries'][0], dict)
+
+    @patch('client_manager.service.ClientManager.publish_event_type_to_stream')
+    def test_process_query_lookup_requested_without_filters_should_publish_error(self, mocked_pub):
+        event_data = {'id': 'lookup-1'}
+        self.service.process_event_type('QueryLookupRequested', event_data, prepare_event_msg_tuple(event_data)[1])
+
+        new_event_data = mocked_pub.call_args[1]['new_event_data']
+        self.assertEqual(new_event_data['queries'], [])
+        self.assertIsNotNone(new_event_data['error'])
+
+    @patch('client_manager.service.ClientManager.flush_pub_events')
+    def test_process_subscriber_queries_deletion_requested_should_remove_all_its_queries(self, mocked_flush):
+        self.register_lookup_test_queries()
+        self.service.add_pending_query('event-q4', 'sub1', self.service.parse_query(
+            self.SIMPLE_QUERY_TEXT.replace('my_first_query', 'q4').replace('FROM test', 'FROM missing')))
+        mocked_flush.reset_mock()
+
+        self.service.process_subscriber_queries_deletion_requested('sub1')
+
+        self.assertEqual(self.get_lookup_query_names(publisher_id='test'), ['q3'])
+        self.assertEqual(self.get_lookup_query_names(subscriber_id='sub1'), [])
+        self.assertEqual(self.get_lookup_query_names(content_type='ObjectDetection'), [])
+        self.assertEqual(len(self.service.queries), 1)
+        self.assertEqual(len(self.service.pending_queries), 0)
+        self.assertEqual(set().union(*self.service.buffer_hash_to_query_map.values()), set(self.service.queries.keys()))
+
+        mocked_flush.assert_called_once()
+        published_events = mocked_flush.call_args[0][0]
+        self.assertEqual(len(published_events), 2)
+        query_removed_stream = self.service.pub_event_stream_map['QueryRemoved']
+        self.assertTrue(all(stream is query_removed_stream for stream, _ in published_events))
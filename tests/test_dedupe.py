@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from client_manager.dedupe import EventIdDedupeWindow
+
+
+class TestEventIdDedupeWindow(TestCase):
+
+    def setUp(self):
+        self.now = 100
+        self.window = EventIdDedupeWindow(ttl_seconds=10, max_size=3, clock=lambda: self.now)
+
+    def test_check_and_add_should_detect_duplicates(self):
+        self.assertFalse(self.window.check_and_add('event-1'))
+        self.assertFalse(self.window.check_and_add('event-2'))
+        self.assertTrue(self.window.check_and_add('event-1'))
+
+        self.assertEqual(self.window.duplicates, 1)
+        self.assertListEqual(list(self.window.entries.keys()), ['event-1', 'event-2'])
+
+    def test_expired_ids_should_not_be_duplicates(self):
+        self.window.check_and_add('event-1')
+        self.now = 105
+        self.window.check_and_add('event-2')
+        self.now = 110
+
+        self.assertFalse(self.window.check_and_add('event-1'))
+        self.assertTrue(self.window.check_and_add('event-2'))
+        self.assertEqual(self.window.expired, 1)
+
+    def test_max_size_should_evict_oldest(self):
+        for i in range(4):
+            self.window.check_and_add(f'event-{i}')
+
+        self.assertNotIn('event-0', self.window)
+        self.assertEqual(len(self.window), 3)
+        self.assertDictEqual(self.window.stats(), {'size': 3, 'duplicates': 0, 'expired': 0, 'evicted': 1})
+
+    def test_zero_ttl_should_only_evict_by_size(self):
+        window = EventIdDedupeWindow(ttl_seconds=0, max_size=3, clock=lambda: self.now)
+        window.check_and_add('event-1')
+        self.now = 10000
+        self.assertTrue(window.check_and_add('event-1'))
+        self.assertFalse(EventIdDedupeWindow(ttl_seconds=10, max_size=0).enabled)
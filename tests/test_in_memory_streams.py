@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+from client_manager.in_memory_streams import InMemoryStreamFactory
+
+
+class TestInMemoryStreamFactory(TestCase):
+
+    def setUp(self):
+        self.stream_factory = InMemoryStreamFactory()
+
+    def test_stream_only_read_events_after_creation(self):
+        writer = self.stream_factory.create('some-key', stype='streamOnly')
+        writer.write_events({'event': '1'})
+        reader = self.stream_factory.create('some-key', stype='streamOnly')
+        writer.write_events({'event': '2'}, {'event': '3'})
+
+        events = list(reader.read_events(count=10))
+        self.assertEqual([msg for _, msg in events], [{'event': '2'}, {'event': '3'}])
+        self.assertEqual(list(reader.read_events(count=10)), [])
+
+    def test_many_key_consumer_group_reads_only_keys_with_events(self):
+        cg_stream = self.stream_factory.create(['key1', 'key2'], stype='manyKeyConsumerOnly', cg_id='cg')
+        self.stream_factory.create('key2', stype='streamOnly').write_events({'event': '1'})
+
+        stream_event_list = cg_stream.read_stream_events_list(count=10)
+        self.assertEqual(len(stream_event_list), 1)
+        self.assertEqual(stream_event_list[0][0], b'key2')
+        self.assertEqual(stream_event_list[0][1][0][1], {'event': '1'})
+        self.assertEqual(cg_stream.read_stream_events_list(count=10), [])
+
+    def test_many_key_consumer_group_respects_count_and_pending_events_count(self):
+        cg_stream = self.stream_factory.create(['key1'], stype='manyKeyConsumerOnly', cg_id='cg')
+        self.stream_factory.create('key1', stype='streamOnly').write_events({'a': 1}, {'b': 2}, {'c': 3})
+
+        self.assertEqual(cg_stream.pending_events_count(), 3)
+        stream_event_list = cg_stream.read_stream_events_list(count=2)
+        self.assertEqual(len(stream_event_list[0][1]), 2)
+        self.assertEqual(cg_stream.pending_events_count(), 1)
+
+    def test_consumer_groups_with_same_id_share_cursors(self):
+        cg_stream1 = self.stream_factory.create(['key1'], stype='manyKeyConsumerOnly', cg_id='cg')
+        cg_stream2 = self.stream_factory.create(['key1'], stype='manyKeyConsumerOnly', cg_id='cg')
+        other_cg_stream = self.stream_factory.create(['key1'], stype='manyKeyConsumerOnly', cg_id='other-cg')
+        self.stream_factory.create('key1', stype='streamOnly').write_events({'a': 1})
+
+        self.assertEqual(len(cg_stream1.read_stream_events_list(count=10)), 1)
+        self.assertEqual(cg_stream2.read_stream_events_list(count=10), [])
+        self.assertEqual(len(other_cg_stream.read_stream_events_list(count=10)), 1)
+
+    def test_event_ids_are_ordered_across_streams(self):
+        event_id1 = self.stream_factory.create('key1', stype='streamOnly').write_events({'a': 1})[0]
+        event_id2 = self.stream_factory.create('key2', stype='streamOnly').write_events({'b': 2})[0]
+        self.assertEqual(event_id1, b'0-1')
+        self.assertEqual(event_id2, b'0-2')
+
+    def test_factories_sharing_a_store_see_the_same_streams(self):
+        other_stream_factory = InMemoryStreamFactory(store=self.stream_factory.store)
+        reader = other_stream_factory.create('key1', stype='streamOnly')
+        self.stream_factory.create('key1', stype='streamOnly').write_events({'a': 1})
+        self.assertEqual(len(list(reader.read_events(count=10))), 1)
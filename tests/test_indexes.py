@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+from client_manager.indexes import ManyToOneIndex
+
+
+class TestManyToOneIndex(TestCase):
+
+    def setUp(self):
+        self.index = ManyToOneIndex()
+
+    def test_pop_key_should_remove_all_items_of_key(self):
+        self.index.add('pub1', 'q1')
+        self.index.add('pub1', 'q2')
+        self.index.add('pub2', 'q3')
+
+        self.assertSetEqual(self.index.pop_key('pub1'), {'q1', 'q2'})
+        self.assertIsNone(self.index.get_key('q1'))
+        self.assertNotIn('pub1', self.index)
+        self.assertEqual(self.index.get_key('q3'), 'pub2')
+
+    def test_pop_non_existing_key_should_return_empty_set(self):
+        self.assertSetEqual(self.index.pop_key('pub1'), set())
+
+    def test_remove_items_should_remove_items_of_many_keys(self):
+        self.index.add('pub1', 'q1')
+        self.index.add('pub1', 'q2')
+        self.index.add('pub2', 'q3')
+        self.index.add('pub2', 'q4')
+
+        self.assertDictEqual(self.index.remove_items(['q1', 'q2', 'q3', 'q5']), {'pub1': ['q1', 'q2'], 'pub2': ['q3']})
+        self.assertNotIn('pub1', self.index)
+        self.assertSetEqual(self.index.get_items('pub2'), {'q4'})
+        self.assertIsNone(self.index.get_key('q3'))
@@ -0,0 +1,112 @@
+import hashlib
+from unittest import TestCase
+
+from client_manager.keys import (
+    KEY_SCHEME_BLAKE2B,
+    KEY_SCHEME_COMPAT,
+    KEY_SCHEME_LEGACY,
+    KeyGenerator,
+    blake2b_buffer_stream_key,
+    blake2b_query_id,
+    legacy_buffer_stream_key,
+    legacy_query_id,
+    unambiguous_encoding,
+)
+
+
+class TestKeyFunctions(TestCase):
+
+    def test_legacy_keys_are_the_same_as_before(self):
+        self.assertEqual(
+            legacy_buffer_stream_key(['ObjectDetection', 'ColorDetection'], 'pub1', '640x480', '30'),
+            hashlib.md5(b'ObjectDetection-ColorDetection-pub1-640x480-30').hexdigest()
+        )
+        self.assertEqual(legacy_query_id('sub1', 'query'), hashlib.md5(b'sub1_query').hexdigest())
+
+    def test_legacy_keys_collide_on_ambiguous_values(self):
+        self.assertEqual(
+            legacy_buffer_stream_key(['a-b'], 'pub1', '640x480', '30'),
+            legacy_buffer_stream_key(['a', 'b'], 'pub1', '640x480', '30'),
+        )
+        self.assertEqual(legacy_query_id('sub_1', 'query'), legacy_query_id('sub', '1_query'))
+
+    def test_blake2b_keys_dont_collide_on_ambiguous_values(self):
+        self.assertNotEqual(
+            blake2b_buffer_stream_key(('a-b',), 'pub1', '640x480', '30'),
+            blake2b_buffer_stream_key(('a', 'b'), 'pub1', '640x480', '30'),
+        )
+        self.assertNotEqual(
+            blake2b_buffer_stream_key(('a', 'pub1'), '640x480', '30', ''),
+            blake2b_buffer_stream_key(('a',), 'pub1', '640x480', '30'),
+        )
+        self.assertNotEqual(blake2b_query_id('sub_1', 'query'), blake2b_query_id('sub', '1_query'))
+
+    def test_unambiguous_encoding_with_nul_in_values(self):
+        encodings = {
+            unambiguous_encoding(('a', 'b')),
+            unambiguous_encoding(('a\x00b',)),
+            unambiguous_encoding(('a\x00', 'b')),
+            unambiguous_encoding(('a', '\x00b')),
+            unambiguous_encoding(('1:a\x00', 'b')),
+        }
+        self.assertEqual(len(encodings), 5)
+
+    def test_blake2b_keys_have_the_same_length_as_legacy_keys(self):
+        self.assertEqual(len(blake2b_buffer_stream_key(('a',), 'pub1', '640x480', '30')), 32)
+        self.assertEqual(len(blake2b_query_id('sub1', 'query')), 32)
+
+
+class TestKeyGenerator(TestCase):
+
+    def test_legacy_scheme_uses_legacy_keys(self):
+        key_generator = KeyGenerator(scheme=KEY_SCHEME_LEGACY)
+        self.assertEqual(
+            key_generator.get_buffer_stream_key(['a'], 'pub1', '640x480', '30'),
+            legacy_buffer_stream_key(['a'], 'pub1', '640x480', '30'),
+        )
+        self.assertEqual(key_generator.get_query_id('sub1', 'query'), legacy_query_id('sub1', 'query'))
+
+    def test_blake2b_scheme_uses_blake2b_keys(self):
+        key_generator = KeyGenerator(scheme=KEY_SCHEME_BLAKE2B)
+        self.assertEqual(
+            key_generator.get_buffer_stream_key(['a'], 'pub1', '640x480', '30'),
+            blake2b_buffer_stream_key(('a',), 'pub1', '640x480', '30'),
+        )
+        self.assertEqual(key_generator.get_query_id('sub1', 'query'), blake2b_query_id('sub1', 'query'))
+
+    def test_keys_are_memoized(self):
+        key_generator = KeyGenerator(scheme=KEY_SCHEME_BLAKE2B)
+        key_generator.get_buffer_stream_key(['a'], 'pub1', '640x480', '30')
+        key_generator.get_buffer_stream_key(('a',), 'pub1', '640x480', '30')
+        key_generator.get_query_id('sub1', 'query')
+        key_generator.get_query_id('sub1', 'query')
+
+        cache_info = key_generator.cache_info()
+        self.assertEqual(cache_info['buffer_stream_keys']['hits'], 1)
+        self.assertEqual(cache_info['query_ids']['hits'], 1)
+
+    def test_compat_scheme_keeps_legacy_keys_in_use(self):
+        legacy_keys_in_use = {
+            legacy_buffer_stream_key(['a'], 'pub1', '640x480', '30'),
+            legacy_query_id('sub1', 'query'),
+        }
+        key_generator = KeyGenerator(
+            scheme=KEY_SCHEME_COMPAT,
+            buffer_stream_key_in_use=legacy_keys_in_use.__contains__,
+            query_id_in_use=legacy_keys_in_use.__contains__,
+        )
+        self.assertEqual(
+            key_generator.get_buffer_stream_key(['a'], 'pub1', '640x480', '30'),
+            legacy_buffer_stream_key(['a'], 'pub1', '640x480', '30'),
+        )
+        self.assertEqual(key_generator.get_query_id('sub1', 'query'), legacy_query_id('sub1', 'query'))
+
+        self.assertEqual(
+            key_generator.get_buffer_stream_key(['b'], 'pub1', '640x480', '30'),
+            blake2b_buffer_stream_key(('b',), 'pub1', '640x480', '30'),
+        )
+        self.assertEqual(key_generator.get_query_id('sub2', 'query'), blake2b_query_id('sub2', 'query'))
+
+    def test_unknown_scheme_raises_error(self):
+        with self.assertRaises(ValueError):
+            KeyGenerator(scheme='sha1')
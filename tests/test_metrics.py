@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+from client_manager.metrics import EventTypeMetrics, LatencyHistogram
+
+
+class TestLatencyHistogram(TestCase):
+
+    def test_percentile_without_observations_should_be_zero(self):
+        self.assertEqual(LatencyHistogram().percentile(99), 0.0)
+
+    def test_percentile_should_interpolate_inside_bucket(self):
+        histogram = LatencyHistogram(buckets=(1.0, 2.0, float('inf')))
+        for value in [0.5] * 50 + [1.5] * 50:
+            histogram.observe(value)
+
+        self.assertAlmostEqual(histogram.percentile(50), 1.0)
+        self.assertAlmostEqual(histogram.percentile(75), 1.25)
+        self.assertLessEqual(histogram.percentile(100), 1.5)
+        self.assertAlmostEqual(histogram.mean(), 1.0)
+
+    def test_percentile_on_last_bucket_should_be_limited_to_max(self):
+        histogram = LatencyHistogram(buckets=(1.0, float('inf')))
+        histogram.observe(30.0)
+        self.assertAlmostEqual(histogram.percentile(99), 1.0 + 29.0 * 0.99)
+        self.assertListEqual(list(histogram.cumulative_bucket_counts()), [(1.0, 0), (float('inf'), 1)])
+
+
+class TestEventTypeMetrics(TestCase):
+
+    def test_observe_should_count_events_and_errors(self):
+        metrics = EventTypeMetrics()
+        metrics.observe(0.001)
+        metrics.observe(0.002, error=True)
+
+        summary = metrics.summary()
+        self.assertEqual(summary['count'], 2)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['duplicates'], 0)
+        self.assertEqual(summary['latency_max'], 0.002)
@@ -0,0 +1,37 @@
+import json
+from unittest import TestCase
+
+from benchmarks.workload import SyntheticWorkload, create_service
+from client_manager.in_memory_streams import InMemoryStreamFactory
+
+
+class TestQueryParseExecutor(TestCase):
+
+    def run_workload(self, **service_kwargs):
+        stream_factory = InMemoryStreamFactory()
+        service = create_service(stream_factory=stream_factory, cmd_batch_size=50, **service_kwargs)
+        SyntheticWorkload(publishers=10, workers=5, queries=40, churn=0.3, seed=7).write_events(stream_factory)
+        published_stream = stream_factory.create('QueryCreated', stype='streamOnly')
+        if service.parse_executor is not None:
+            service.parse_executor.start()
+        try:
+            while service.service_cmd.pending_events_count() > 0:
+                service.process_cmd()
+        finally:
+            if service.parse_executor is not None:
+                service.parse_executor.shutdown()
+        published_query_ids = [
+            json.loads(event_msg['event'])['query_id'] for _, event_msg in published_stream.read_events(count=1000)
+        ]
+        return service, published_query_ids
+
+    def test_same_state_and_published_events_as_inline_parsing(self):
+        inline_service, inline_published_query_ids = self.run_workload()
+        service, published_query_ids = self.run_workload(parse_executor_workers=2)
+
+        self.assertGreater(service.parsed_query_cache.prefetches, 0)
+        self.assertEqual(service.parsed_query_cache.prefetched, {})
+        self.assertFalse(service.parse_executor.running)
+        self.assertEqual(list(service.queries.keys()), list(inline_service.queries.keys()))
+        self.assertGreater(len(published_query_ids), 0)
+        self.assertEqual(published_query_ids, inline_published_query_ids)
@@ -0,0 +1,71 @@
+from unittest import TestCase
+
+from client_manager.pending_queries import PendingQueryStore
+
+
+class TestPendingQueryStore(TestCase):
+
+    def setUp(self):
+        self.now = 100
+        self.store = PendingQueryStore(ttl_seconds=10, max_size=3, clock=lambda: self.now)
+
+    def add(self, query_id, publisher_id):
+        return self.store.add(query_id, publisher_id, f'event-{query_id}', 'sub1', {'name': query_id})
+
+    def test_pop_publisher_should_return_only_its_queries_in_order(self):
+        self.add('q1', 'pub1')
+        self.add('q2', 'pub2')
+        self.add('q3', 'pub1')
+
+        pending_queries = self.store.pop_publisher('pub1')
+
+        self.assertListEqual([p.query_id for p in pending_queries], ['q1', 'q3'])
+        self.assertListEqual(list(self.store.entries.keys()), ['q2'])
+        self.assertListEqual(self.store.pop_publisher('pub1'), [])
+
+    def test_expired_queries_should_be_dropped(self):
+        self.add('q1', 'pub1')
+        self.now = 105
+        self.add('q2', 'pub1')
+        self.now = 111
+
+        pending_queries = self.store.pop_publisher('pub1')
+
+        self.assertListEqual([p.query_id for p in pending_queries], ['q2'])
+        self.assertEqual(self.store.expired, 1)
+
+    def test_max_size_should_evict_oldest(self):
+        for i in range(4):
+            self.add(f'q{i}', 'pub1')
+
+        self.assertNotIn('q0', self.store)
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store.evicted, 1)
+
+    def test_add_existing_query_should_refresh_it(self):
+        self.add('q1', 'pub1')
+        self.now = 105
+        self.add('q1', 'pub2')
+        self.now = 111
+
+        self.assertListEqual(self.store.pop_publisher('pub1'), [])
+        self.assertListEqual([p.query_id for p in self.store.pop_publisher('pub2')], ['q1'])
+
+    def test_remove_should_clean_publisher_index(self):
+        self.add('q1', 'pub1')
+        self.assertEqual(self.store.remove('q1').query_id, 'q1')
+        self.assertDictEqual(self.store.publisher_to_query_ids, {})
+        self.assertIsNone(self.store.remove('q1'))
+
+    def test_pop_subscriber_should_return_only_its_queries_and_clean_indexes(self):
+        self.add('q1', 'pub1')
+        self.store.add('q2', 'pub1', 'event-q2', 'sub2', {'name': 'q2'})
+        self.add('q3', 'pub2')
+
+        pending_queries = self.store.pop_subscriber('sub1')
+
+        self.assertListEqual([p.query_id for p in pending_queries], ['q1', 'q3'])
+        self.assertListEqual(list(self.store.entries.keys()), ['q2'])
+        self.assertDictEqual(self.store.publisher_to_query_ids, {'pub1': {'q2': None}})
+        self.assertListEqual([p.query_id for p in self.store.pop_publisher('pub1')], ['q2'])
+        self.assertDictEqual(self.store.subscriber_to_query_ids, {})
@@ -0,0 +1,97 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from client_manager.query_cache import LazyQueryParser, ParsedQueryCache, normalize_query_text, thaw
+
+
+class TestParsedQueryCache(TestCase):
+
+    def setUp(self):
+        self.query_parser = MagicMock()
+        self.query_parser.parse.side_effect = lambda text: {
+            'name': text.split()[2],
+            'from': ['pub1'],
+            'window': {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]},
+        }
+        self.cache = ParsedQueryCache(self.query_parser, max_size=2)
+
+    def test_normalize_query_text_should_collapse_whitespaces_outside_quotes(self):
+        query_text = "REGISTER QUERY  q1\n    MATCH (c:Car {color:'dark  blue'})\n"
+        self.assertEqual(
+            normalize_query_text(query_text),
+            "REGISTER QUERY q1 MATCH (c:Car {color:'dark  blue'})"
+        )
+
+    def test_parse_should_only_call_parser_once_for_same_normalized_text(self):
+        first = self.cache.parse('REGISTER QUERY q1')
+        second = self.cache.parse('  REGISTER   QUERY q1\n')
+
+        self.assertIs(first, second)
+        self.assertEqual(self.query_parser.parse.call_count, 1)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_parse_should_return_immutable_result(self):
+        parsed_query = self.cache.parse('REGISTER QUERY q1')
+
+        with self.assertRaises(TypeError):
+            parsed_query['name'] = 'other'
+        with self.assertRaises(TypeError):
+            parsed_query['window']['args'] = [3]
+        self.assertIsInstance(parsed_query['from'], tuple)
+
+    def test_thaw_should_return_mutable_copy(self):
+        parsed_query = thaw(self.cache.parse('REGISTER QUERY q1'))
+
+        parsed_query['window']['args'].append(3)
+        self.assertEqual(parsed_query['from'], ['pub1'])
+        self.assertEqual(self.cache.parse('REGISTER QUERY q1')['window']['args'], (2,))
+
+    def test_parse_should_evict_least_recently_used(self):
+        self.cache.parse('REGISTER QUERY q1')
+        self.cache.parse('REGISTER QUERY q2')
+        self.cache.parse('REGISTER QUERY q1')
+        self.cache.parse('REGISTER QUERY q3')
+
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNotNone(self.cache.get('REGISTER QUERY q1'))
+        self.assertIsNone(self.cache.get('REGISTER QUERY q2'))
+        self.assertDictEqual(
+            self.cache.stats(),
+            {'size': 2, 'max_size': 2, 'hits': 1, 'misses': 3, 'evictions': 1}
+        )
+
+    def test_parse_should_use_prefetched_result(self):
+        parse_executor = MagicMock()
+        parse_executor.submit.return_value.result.return_value = {'name': 'prefetched', 'from': ['pub1']}
+
+        self.cache.prefetch(['REGISTER QUERY q1', 'REGISTER  QUERY q1'], parse_executor)
+        parsed_query = self.cache.parse('REGISTER QUERY q1')
+
+        self.assertEqual(parse_executor.submit.call_count, 1)
+        self.assertEqual(parsed_query['name'], 'prefetched')
+        self.assertEqual(self.query_parser.parse.call_count, 0)
+        self.assertEqual(self.cache.prefetched, {})
+
+    def test_clear_prefetched_should_cancel_unused_results(self):
+        parse_executor = MagicMock()
+        self.cache.prefetch(['REGISTER QUERY q1'], parse_executor)
+        self.cache.clear_prefetched()
+
+        parse_executor.submit.return_value.cancel.assert_called_once()
+        self.cache.parse('REGISTER QUERY q1')
+        self.assertEqual(self.query_parser.parse.call_count, 1)
+
+
+class TestLazyQueryParser(TestCase):
+
+    @patch('gnosis_epl.main.QueryParser')
+    def test_parser_is_only_constructed_on_first_parse(self, mocked_query_parser_cls):
+        query_parser = LazyQueryParser()
+        self.assertFalse(mocked_query_parser_cls.called)
+
+        query_parser.parse('REGISTER QUERY q1')
+        query_parser.parse('REGISTER QUERY q2')
+
+        mocked_query_parser_cls.assert_called_once_with()
+        self.assertEqual(mocked_query_parser_cls.return_value.parse.call_count, 2)
@@ -0,0 +1,111 @@
+import json
+import pickle
+from unittest import TestCase
+
+from client_manager.query_cache import freeze
+from client_manager.records import BufferStreamRecord, PublisherRecord, QueryRecord
+
+
+class TestRecords(TestCase):
+
+    def setUp(self):
+        self.parsed_query = {
+            'name': 'my_query',
+            'output': ['K_GRAPH_JSON'],
+            'content': ['ObjectDetection', 'ColorDetection'],
+            'match': "MATCH (c1:Car {color:'blue'})",
+            'from': ['pub1'],
+            'window': {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]},
+            'ret': 'RETURN *',
+        }
+        self.buffer_stream_dict = {
+            'publisher_id': 'pub1',
+            'buffer_stream_key': 'key1',
+            'source': 'rtmp://source',
+            'resolution': '640x480',
+            'fps': '30',
+        }
+        self.query = QueryRecord(
+            subscriber_id='sub1',
+            query_id='q1',
+            parsed_query=freeze(self.parsed_query),
+            query_received_event_id='event1',
+            buffer_stream=BufferStreamRecord.from_dict(self.buffer_stream_dict),
+            service_chain=['ObjectDetection'],
+        )
+        self.expected_query_dict = {
+            'subscriber_id': 'sub1',
+            'query_id': 'q1',
+            'parsed_query': {
+                'name': 'my_query',
+                'output': ['K_GRAPH_JSON'],
+                'from': ['pub1'],
+                'content': ['ObjectDetection', 'ColorDetection'],
+                'match': "MATCH (c1:Car {color:'blue'})",
+                'optional_match': '',
+                'where': '',
+                'window': {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]},
+                'ret': 'RETURN *',
+                'qos_policies': {},
+            },
+            'query_received_event_id': 'event1',
+            'buffer_stream': self.buffer_stream_dict,
+            'service_chain': ['ObjectDetection'],
+        }
+
+    def test_query_to_dict_keeps_event_format(self):
+        self.assertEqual(json.dumps(self.query.to_dict()), json.dumps(self.expected_query_dict))
+        self.assertDictEqual(self.query.copy(), self.expected_query_dict)
+
+    def test_query_item_access_and_update(self):
+        self.assertEqual(self.query['query_id'], 'q1')
+        self.assertEqual(self.query['buffer_stream']['publisher_id'], 'pub1')
+        self.assertEqual(self.query['parsed_query']['from'][0], 'pub1')
+        self.assertEqual(self.query.get('missing', 'default'), 'default')
+        self.assertIn('service_chain', self.query.keys())
+
+        self.query['service_chain'] = ['ColorDetection']
+        self.assertEqual(self.query.service_chain, ['ColorDetection'])
+        with self.assertRaises(KeyError):
+            self.query['missing'] = 1
+
+    def test_records_are_equal_to_their_dicts(self):
+        self.assertEqual(self.query, self.expected_query_dict)
+        self.assertNotEqual(self.query, {'query_id': 'q1'})
+        publisher = PublisherRecord(id='pub1', source='rtmp://source', meta={'fps': '30'})
+        self.assertEqual(publisher, {'id': 'pub1', 'source': 'rtmp://source', 'meta': {'fps': '30'}})
+
+    def test_records_have_no_instance_dict(self):
+        self.assertFalse(hasattr(self.query, '__dict__'))
+        self.assertFalse(hasattr(self.query.buffer_stream, '__dict__'))
+
+    def test_repeated_strings_are_interned(self):
+        publisher_id = ''.join(['pub', '1'])
+        other_publisher_id = ''.join(['pub', '1'])
+        self.assertIsNot(publisher_id, other_publisher_id)
+
+        buffer_stream_dict = dict(self.buffer_stream_dict, publisher_id=publisher_id)
+        other_buffer_stream_dict = dict(self.buffer_stream_dict, publisher_id=other_publisher_id)
+        self.assertIs(
+            BufferStreamRecord.from_dict(buffer_stream_dict).publisher_id,
+            BufferStreamRecord.from_dict(other_buffer_stream_dict).publisher_id,
+        )
+
+    def test_buffer_stream_content_is_only_in_dict_when_shared(self):
+        self.assertNotIn('content', self.query.buffer_stream.to_dict())
+        self.assertEqual(self.query.buffer_stream, self.buffer_stream_dict)
+
+        buffer_stream_dict = dict(self.buffer_stream_dict, content=['ColorDetection', 'ObjectDetection'])
+        buffer_stream = BufferStreamRecord.from_dict(buffer_stream_dict)
+        self.assertEqual(buffer_stream['content'], ('ColorDetection', 'ObjectDetection'))
+        self.assertEqual(buffer_stream.to_dict(), buffer_stream_dict)
+        self.assertEqual(pickle.loads(pickle.dumps(buffer_stream)), buffer_stream)
+
+    def test_records_pickle_through_their_dicts(self):
+        query = pickle.loads(pickle.dumps(self.query))
+        self.assertIsInstance(query, QueryRecord)
+        self.assertIsInstance(query.buffer_stream, BufferStreamRecord)
+        self.assertEqual(query, self.query)
+
+        publisher = PublisherRecord(id='pub1', source='rtmp://source', meta={'fps': '30'})
+        self.assertEqual(pickle.loads(pickle.dumps(publisher)), publisher)
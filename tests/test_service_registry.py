@@ -0,0 +1,169 @@
+from unittest import TestCase
+
+from client_manager.service_registry import ServiceRegistry
+
+
+class TestServiceRegistry(TestCase):
+
+    def setUp(self):
+        self.registry = ServiceRegistry()
+
+    def add_worker(self, service_type, stream_key, **kwargs):
+        worker = {
+            'service_type': service_type,
+            'stream_key': stream_key,
+            'queue_limit': 100,
+            'throughput': 10,
+            'accuracy': 0.5,
+            'energy_consumption': 50,
+        }
+        worker.update(kwargs)
+        self.registry.add_worker(worker)
+        return worker
+
+    def test_add_worker_should_keep_available_services_format(self):
+        worker = self.add_worker('ObjectDetection', 'obj-key')
+        self.assertDictEqual(
+            self.registry.available_services,
+            {'ObjectDetection': {'workers': {'obj-key': worker}}}
+        )
+
+    def test_chain_by_content_type_list_should_keep_content_type_order(self):
+        self.add_worker('ObjectDetection', 'obj-key')
+        self.add_worker('ColorDetection', 'clr-key')
+
+        chain = self.registry.get_service_function_chain_by_content_type_list(
+            ['ColorDetection', 'Unknown', 'ObjectDetection'])
+
+        self.assertListEqual(chain, ['ColorDetection', 'ObjectDetection'])
+
+    def test_chain_by_content_type_list_should_use_workers_content_types(self):
+        self.add_worker('MultiDetection', 'multi-key', content_types=['Car', 'Person'])
+
+        chain = self.registry.get_service_function_chain_by_content_type_list(['Car', 'Person'])
+
+        self.assertListEqual(chain, ['MultiDetection'])
+
+    def test_chain_should_order_service_types_by_the_qos_policy_metric(self):
+        self.add_worker('FastDetection', 'fast-key', content_types=['Car'], throughput=50, accuracy=0.5)
+        self.add_worker('PreciseDetection', 'precise-key', content_types=['Car'], throughput=10, accuracy=0.9)
+
+        self.assertListEqual(
+            self.registry.get_service_function_chain_by_content_type_list(['Car'], {'latency': 5, 'accuracy': 1}),
+            ['FastDetection'])
+        self.assertListEqual(
+            self.registry.get_service_function_chain_by_content_type_list(['Car'], {'latency': 1, 'accuracy': 5}),
+            ['PreciseDetection'])
+        self.assertListEqual(self.registry.get_service_function_chain_by_content_type_list(['Car']), ['FastDetection'])
+
+    def test_chain_should_only_differ_by_the_qos_policy_metric(self):
+        self.add_worker('DetectionA', 'a-key', content_types=['Car'], energy_consumption=80)
+        self.add_worker('DetectionB', 'b-key', content_types=['Car'], energy_consumption=20)
+
+        self.assertListEqual(
+            self.registry.get_service_function_chain_by_content_type_list(['Car'], {'energy_consumption': 'high'}),
+            ['DetectionA'])
+        self.assertListEqual(
+            self.registry.get_service_function_chain_by_content_type_list(['Car'], {'energy_consumption': 3}),
+            ['DetectionB'])
+        self.assertListEqual(
+            self.registry.get_service_function_chain_by_content_type_list(['Car'], {'accuracy': 3}), ['DetectionA'])
+
+    def test_add_worker_should_return_content_types_whose_qos_order_changed(self):
+        self.add_worker('DetectionA', 'a-key', content_types=['Car'], accuracy=0.5)
+        self.add_worker('DetectionB', 'b-key', content_types=['Car'], accuracy=0.6)
+
+        self.assertSetEqual(self.registry.add_worker(dict(
+            self.registry.available_services['DetectionA']['workers']['a-key'], accuracy=0.7)), {'Car'})
+        self.assertSetEqual(self.registry.add_worker(dict(
+            self.registry.available_services['DetectionA']['workers']['a-key'], accuracy=0.8)), set())
+        self.assertListEqual(
+            self.registry.get_service_function_chain_by_content_type_list(['Car'], {'accuracy': 1}), ['DetectionA'])
+
+    def test_chain_memo_should_be_invalidated_when_registry_changes(self):
+        self.assertListEqual(self.registry.get_service_function_chain_by_content_type_list(['ObjectDetection']), [])
+        version = self.registry.version
+
+        self.add_worker('ObjectDetection', 'obj-key')
+
+        self.assertGreater(self.registry.version, version)
+        self.assertListEqual(
+            self.registry.get_service_function_chain_by_content_type_list(['ObjectDetection']), ['ObjectDetection'])
+
+    def test_chain_result_should_not_change_memoized_chain(self):
+        self.add_worker('ObjectDetection', 'obj-key')
+        chain = self.registry.get_service_function_chain_by_content_type_list(['ObjectDetection'])
+        chain.append('Other')
+
+        self.assertListEqual(
+            self.registry.get_service_function_chain_by_content_type_list(['ObjectDetection']), ['ObjectDetection'])
+
+    def test_load_available_services_should_rebuild_indexes(self):
+        worker = self.add_worker('ObjectDetection', 'obj-key')
+        other_registry = ServiceRegistry()
+
+        other_registry.load_available_services({'ObjectDetection': {'workers': {'obj-key': worker}}})
+
+        self.assertListEqual(
+            other_registry.get_service_function_chain_by_content_type_list(['ObjectDetection']), ['ObjectDetection'])
+
+    def test_add_worker_should_return_changed_content_types(self):
+        self.assertSetEqual(self.registry.add_worker({'service_type': 'ObjectDetection', 'stream_key': 'w1'}),
+                            {'ObjectDetection'})
+        self.assertSetEqual(self.registry.add_worker({'service_type': 'ObjectDetection', 'stream_key': 'w2'}), set())
+        version = self.registry.version
+        self.assertSetEqual(self.registry.add_worker({'service_type': 'ObjectDetection', 'stream_key': 'w2'}), set())
+        self.assertEqual(self.registry.version, version)
+
+    def test_remove_worker_should_only_remove_service_after_last_worker(self):
+        self.add_worker('ObjectDetection', 'w1')
+        self.add_worker('ObjectDetection', 'w2')
+
+        self.assertSetEqual(self.registry.remove_worker('w1'), set())
+        self.assertListEqual(list(self.registry.available_services['ObjectDetection']['workers'].keys()), ['w2'])
+        self.assertListEqual(
+            self.registry.get_service_function_chain_by_content_type_list(['ObjectDetection']), ['ObjectDetection'])
+
+        self.assertSetEqual(self.registry.remove_worker('w2'), {'ObjectDetection'})
+        self.assertDictEqual(self.registry.available_services, {})
+        self.assertListEqual(self.registry.get_service_function_chain_by_content_type_list(['ObjectDetection']), [])
+        self.assertIsNone(self.registry.remove_worker('w2'))
+
+
+class TestServiceRegistryWorkerExpiration(TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.registry = ServiceRegistry(worker_heartbeat_ttl_seconds=10, clock=lambda: self.now)
+
+    def test_expire_workers_should_remove_workers_without_heartbeat(self):
+        self.registry.add_worker({'service_type': 'ObjectDetection', 'stream_key': 'w1'})
+        self.registry.add_worker({'service_type': 'ColorDetection', 'stream_key': 'w2'})
+        self.now = 8
+        self.registry.add_worker({'service_type': 'ObjectDetection', 'stream_key': 'w1'})
+        self.now = 12
+
+        expired_stream_keys, changed_content_types = self.registry.expire_workers()
+
+        self.assertListEqual(expired_stream_keys, ['w2'])
+        self.assertSetEqual(changed_content_types, {'ColorDetection'})
+        self.assertListEqual(list(self.registry.available_services.keys()), ['ObjectDetection'])
+
+        self.now = 18
+        expired_stream_keys, _ = self.registry.expire_workers()
+        self.assertListEqual(expired_stream_keys, ['w1'])
+        self.assertListEqual(self.registry._worker_expiration_heap, [])
+
+    def test_get_next_expiration_time(self):
+        self.assertIsNone(self.registry.get_next_expiration_time())
+        self.registry.add_worker({'service_type': 'ObjectDetection', 'stream_key': 'w1'})
+        self.now = 3
+        self.registry.add_worker({'service_type': 'ColorDetection', 'stream_key': 'w2'})
+
+        self.assertEqual(self.registry.get_next_expiration_time(), 10)
+        self.assertIsNone(ServiceRegistry().get_next_expiration_time())
+
+    def test_expire_workers_without_ttl_should_do_nothing(self):
+        registry = ServiceRegistry()
+        registry.add_worker({'service_type': 'ObjectDetection', 'stream_key': 'w1'})
+        self.assertEqual(registry.expire_workers(), ([], set()))
@@ -0,0 +1,189 @@
+from collections import Counter
+from unittest import TestCase
+
+from benchmarks.workload import SyntheticWorkload, create_service, new_msg
+from client_manager.in_memory_streams import InMemoryStreamFactory
+from client_manager.sharding import ConsistentHashRing, extract_query_publisher_id
+
+
+class TestConsistentHashRing(TestCase):
+
+    def setUp(self):
+        self.keys = [f'publisher_{i}' for i in range(2000)]
+
+    def test_keys_are_spread_between_shards(self):
+        ring = ConsistentHashRing(shard_ids=['a', 'b', 'c'])
+        shard_counts = Counter(ring.get_shard(key) for key in self.keys)
+        self.assertEqual(set(shard_counts.keys()), {'a', 'b', 'c'})
+        for count in shard_counts.values():
+            self.assertGreater(count, len(self.keys) / 3 * 0.5)
+
+    def test_only_keys_of_new_shard_change_owner(self):
+        ring = ConsistentHashRing(shard_ids=['a', 'b', 'c'])
+        old_owners = {key: ring.get_shard(key) for key in self.keys}
+        self.assertTrue(ring.add_shard('d'))
+        moved_keys = [key for key in self.keys if ring.get_shard(key) != old_owners[key]]
+
+        self.assertTrue(all(ring.get_shard(key) == 'd' for key in moved_keys))
+        self.assertLess(len(moved_keys), len(self.keys) / 2)
+
+        self.assertTrue(ring.remove_shard('d'))
+        self.assertEqual({key: ring.get_shard(key) for key in self.keys}, old_owners)
+
+    def test_add_and_remove_shards(self):
+        ring = ConsistentHashRing()
+        self.assertIsNone(ring.get_shard('publisher_1'))
+        self.assertTrue(ring.add_shard('a'))
+        self.assertFalse(ring.add_shard('a'))
+        self.assertIn('a', ring)
+        self.assertEqual(ring.get_shard('publisher_1'), 'a')
+        self.assertFalse(ring.remove_shard('b'))
+        self.assertTrue(ring.remove_shard('a'))
+        self.assertEqual(len(ring), 0)
+
+
+class TestExtractQueryPublisherId(TestCase):
+
+    def test_extracts_first_from_publisher(self):
+        query_text = (
+            "REGISTER QUERY my_query OUTPUT K_GRAPH_JSON CONTENT ObjectDetection "
+            "MATCH (c1:Car {color:'blue'}) FROM pub1, pub2 WITHIN TUMBLING_COUNT_WINDOW(2) RETURN *"
+        )
+        self.assertEqual(extract_query_publisher_id(query_text), 'pub1')
+
+    def test_ignores_from_inside_strings(self):
+        query_text = (
+            "register query my_query output K_GRAPH_JSON content ObjectDetection "
+            "match (c1:Car {color:'from x within'}) from pub1 within TUMBLING_COUNT_WINDOW(2) return *"
+        )
+        self.assertEqual(extract_query_publisher_id(query_text), 'pub1')
+
+    def test_returns_none_without_from(self):
+        self.assertIsNone(extract_query_publisher_id('REGISTER QUERY my_query'))
+
+
+class TestShardedClientManager(TestCase):
+
+    def setUp(self):
+        self.stream_factory = InMemoryStreamFactory()
+        self.shards = [
+            create_service(stream_factory=self.stream_factory, cmd_batch_size=100, shard_id=shard_id,
+                           shard_ids=['shard_a', 'shard_b'])
+            for shard_id in ['shard_a', 'shard_b']
+        ]
+        self.workload = SyntheticWorkload(publishers=20, workers=5, queries=60, churn=0, seed=3)
+
+    def drain(self):
+        while any(shard.service_cmd.pending_events_count() > 0 for shard in self.shards):
+            for shard in self.shards:
+                shard.process_cmd()
+
+    def get_all_query_ids(self):
+        query_ids = [query_id for shard in self.shards for query_id in shard.queries.keys()]
+        self.assertEqual(len(query_ids), len(set(query_ids)))
+        return set(query_ids)
+
+    def assert_queries_are_on_their_owner_shard(self):
+        for shard in self.shards:
+            for query in shard.queries.values():
+                self.assertTrue(shard.owns_shard_key(query['buffer_stream']['publisher_id']))
+            for publisher_id in shard.publishers.keys():
+                self.assertTrue(shard.owns_shard_key(publisher_id))
+
+    def test_shards_have_own_consumer_groups(self):
+        self.assertEqual(self.shards[0].name, 'ClientManager-shard_a')
+        self.assertEqual(self.shards[1].name, 'ClientManager-shard_b')
+
+    def test_queries_are_split_between_shards(self):
+        self.workload.write_events(self.stream_factory)
+        self.drain()
+
+        self.assert_queries_are_on_their_owner_shard()
+        self.assertTrue(all(len(shard.queries) > 0 for shard in self.shards))
+
+        unsharded = create_service(stream_factory=InMemoryStreamFactory(), cmd_batch_size=100)
+        workload = SyntheticWorkload(publishers=20, workers=5, queries=60, churn=0, seed=3)
+        workload.write_events(unsharded.stream_factory)
+        while unsharded.service_cmd.pending_events_count() > 0:
+            unsharded.process_cmd()
+        self.assertEqual(self.get_all_query_ids(), set(unsharded.queries.keys()))
+
+    def test_state_is_handed_over_when_shards_join_and_leave(self):
+        self.workload.write_events(self.stream_factory)
+        self.drain()
+        query_ids = self.get_all_query_ids()
+
+        new_shard = create_service(
+            stream_factory=self.stream_factory, cmd_batch_size=100, shard_id='shard_c',
+            shard_ids=['shard_a', 'shard_b'])
+        self.shards.append(new_shard)
+        new_shard.join_shards()
+        self.drain()
+
+        self.assertGreater(len(new_shard.queries), 0)
+        self.assertEqual(self.get_all_query_ids(), query_ids)
+        self.assert_queries_are_on_their_owner_shard()
+
+        leaving_shard = self.shards.pop(0)
+        leaving_shard.leave_shards()
+        self.drain()
+
+        self.assertEqual(len(leaving_shard.queries), 0)
+        self.assertEqual(len(leaving_shard.publishers), 0)
+        self.assertEqual(self.get_all_query_ids(), query_ids)
+        self.assert_queries_are_on_their_owner_shard()
+
+    def test_shard_joining_with_incomplete_shard_ids_should_learn_the_ring_before_owning_publishers(self):
+        self.workload.write_events(self.stream_factory)
+        self.drain()
+        query_ids = self.get_all_query_ids()
+
+        new_shard = create_service(
+            stream_factory=self.stream_factory, cmd_batch_size=100, shard_id='shard_c', shard_ids=[])
+        self.shards.append(new_shard)
+        new_shard.join_shards()
+        late_query_ids = set()
+        query_received_stream = self.stream_factory.create('QueryReceived', stype='streamOnly')
+        for i in range(10):
+            query_received_stream.write_events(new_msg({
+                'subscriber_id': 'subscriber_late',
+                'query': self.workload.query_text(f'late_query_{i}', f'publisher_{i}'),
+            }))
+            late_query_ids.add(new_shard.create_query_id('subscriber_late', f'late_query_{i}'))
+        self.drain()
+
+        self.assertFalse(new_shard.is_joining_shards())
+        for shard in self.shards:
+            self.assertEqual(shard.shard_ring.shard_ids, {'shard_a', 'shard_b', 'shard_c'})
+        self.assertEqual(self.get_all_query_ids(), query_ids | late_query_ids)
+        self.assert_queries_are_on_their_owner_shard()
+
+    def test_first_shard_should_stop_joining_after_the_timeout(self):
+        stream_factory = InMemoryStreamFactory()
+        shard = create_service(
+            stream_factory=stream_factory, shard_id='shard_a', shard_ids=[], shard_join_timeout_seconds=0)
+        shard.join_shards()
+        self.assertTrue(shard.is_joining_shards())
+        stream_factory.create('PublisherCreated', stype='streamOnly').write_events(new_msg({
+            'publisher_id': 'publisher_1', 'source': 'rtmp://source', 'meta': {'resolution': '640x480', 'fps': '30'},
+        }))
+
+        shard.process_cmd()
+
+        self.assertFalse(shard.is_joining_shards())
+        self.assertIn('publisher_1', shard.publishers)
+
+    def test_bulk_queries_are_processed_by_their_owner_shards(self):
+        query_texts = [
+            self.workload.query_text(f'bulk_query_{i}', f'publisher_{i}') for i in range(10)
+        ]
+        self.stream_factory.create('QueryBulkReceived', stype='streamOnly').write_events(
+            new_msg({'subscriber_id': 'subscriber_1', 'queries': query_texts})
+        )
+        self.drain()
+
+        # no publishers were created, so all queries are pending on their owner shard
+        self.assertEqual(sum(len(shard.pending_queries) for shard in self.shards), 10)
+        for shard in self.shards:
+            for pending_query in shard.pending_queries.entries.values():
+                self.assertTrue(shard.owns_shard_key(pending_query.publisher_id))
@@ -0,0 +1,63 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from client_manager.snapshots import (
+    FileStateSnapshotStore, RedisStateSnapshotStore, get_snapshot_stream_id, set_consumer_group_stream_ids
+)
+
+
+class TestFileStateSnapshotStore(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'state', 'snapshot.pickle')
+        self.store = FileStateSnapshotStore(self.path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_load_without_snapshot_should_return_none(self):
+        self.assertIsNone(self.store.load())
+
+    def test_save_and_load_should_roundtrip_snapshot(self):
+        snapshot = {'queries': {'q1': {'query_id': 'q1'}}, 'buffers': {'b1': {'q1'}}}
+        self.store.save(snapshot)
+        self.assertDictEqual(self.store.load(), snapshot)
+        self.assertListEqual(os.listdir(os.path.dirname(self.path)), ['snapshot.pickle'])
+
+    def test_failed_save_should_keep_previous_snapshot(self):
+        self.store.save({'version': 1})
+        with self.assertRaises(Exception):
+            self.store.save({'unpicklable': lambda: None})
+        self.assertDictEqual(self.store.load(), {'version': 1})
+        self.assertListEqual(os.listdir(os.path.dirname(self.path)), ['snapshot.pickle'])
+
+
+class TestRedisStateSnapshotStore(TestCase):
+
+    def test_save_and_load_should_roundtrip_snapshot(self):
+        redis_db = MagicMock()
+        store = RedisStateSnapshotStore(redis_db, 'cm-snapshot')
+        store.save({'version': 1})
+        redis_db.get.return_value = redis_db.set.call_args[0][1]
+
+        self.assertDictEqual(store.load(), {'version': 1})
+        redis_db.get.assert_called_once_with('cm-snapshot')
+
+
+class TestSetConsumerGroupStreamIds(TestCase):
+
+    def test_get_snapshot_stream_id_should_use_creation_time_in_ms(self):
+        self.assertEqual(get_snapshot_stream_id(1526919030.474), '1526919030474-0')
+        self.assertEqual(get_snapshot_stream_id(None), '0')
+
+    def test_should_set_each_stream_id(self):
+        cmd_stream = MagicMock()
+        set_consumer_group_stream_ids(cmd_stream, {'QueryReceived': '10-0'})
+        cmd_stream.input_consumer_group.queryreceived.set_id.assert_called_once_with('10-0')
+
+    def test_should_ignore_streams_without_consumer_group(self):
+        cmd_stream = MagicMock(spec=['read_stream_events_list'])
+        self.assertFalse(set_consumer_group_stream_ids(cmd_stream, {'QueryReceived': '10-0'}))
@@ -0,0 +1,37 @@
+import subprocess
+import sys
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import opentracing
+
+from client_manager.tracing import NoopTracer, init_tracer
+
+
+class TestInitTracer(TestCase):
+
+    def test_without_reporting_host_should_use_noop_tracer(self):
+        tracer = init_tracer('ClientManager', reporting_host=None, reporting_port=None)
+        self.assertIsInstance(tracer, NoopTracer)
+        with tracer.start_active_span('span') as scope:
+            self.assertIsNotNone(scope.span)
+        tracer.close()
+
+    @patch('event_service_utils.tracing.jaeger.init_tracer')
+    def test_with_reporting_host_should_init_jaeger_tracer(self, mocked_init_tracer):
+        tracer = init_tracer('ClientManager', reporting_host='localhost', reporting_port='6831')
+        self.assertEqual(tracer, mocked_init_tracer.return_value)
+        mocked_init_tracer.assert_called_once_with('ClientManager', reporting_host='localhost', reporting_port='6831')
+
+    @patch('event_service_utils.tracing.jaeger.init_tracer', MagicMock(return_value=None))
+    def test_with_jaeger_already_initialized_should_use_global_tracer(self):
+        tracer = init_tracer('ClientManager', reporting_host='localhost', reporting_port='6831')
+        self.assertEqual(tracer, opentracing.global_tracer())
+
+    def test_service_import_should_not_import_parser_nor_jaeger(self):
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, client_manager.service; '
+            'print(sorted(m for m in ("gnosis_epl", "jaeger_client") if m in sys.modules))'
+        ])
+        self.assertEqual(output.decode('utf-8').strip(), '[]')
@@ -0,0 +1,48 @@
+import copy
+import pickle
+from unittest import TestCase
+
+from client_manager.tracking import TrackedDict
+
+
+class TestTrackedDict(TestCase):
+
+    def setUp(self):
+        self.tracked = TrackedDict({'a': 1, 'b': 2})
+
+    def test_initial_items_are_not_changes(self):
+        self.assertEqual(self.tracked.pop_changes(), ([], [], []))
+
+    def test_tracks_added_updated_and_removed_keys(self):
+        self.tracked['c'] = 3
+        self.tracked['a'] = 10
+        del self.tracked['b']
+        self.tracked.setdefault('d', 4)
+        self.tracked.setdefault('a', 0)
+
+        self.assertEqual(self.tracked.pop_changes(), (['c', 'd'], ['a'], ['b']))
+        self.assertEqual(self.tracked.pop_changes(), ([], [], []))
+
+    def test_keys_added_and_removed_between_calls_are_not_changes(self):
+        self.tracked['c'] = 3
+        self.tracked.pop('c')
+        self.tracked.pop('missing', None)
+
+        self.assertEqual(self.tracked.pop_changes(), ([], [], []))
+
+    def test_removed_and_added_again_is_an_update(self):
+        self.tracked.pop('a')
+        self.tracked['a'] = 1
+
+        self.assertEqual(self.tracked.pop_changes(), ([], ['a'], []))
+
+    def test_clear_and_update(self):
+        self.tracked.update({'a': 5, 'e': 6})
+        self.assertEqual(self.tracked.pop_changes(), (['e'], ['a'], []))
+
+        self.tracked.clear()
+        self.assertEqual(sorted(self.tracked.pop_changes()[2]), ['a', 'b', 'e'])
+
+    def test_pickles_and_copies_as_plain_dict(self):
+        self.assertIs(type(pickle.loads(pickle.dumps(self.tracked))), dict)
+        self.assertEqual(copy.copy(self.tracked), {'a': 1, 'b': 2})
@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+from client_manager.ttl_map import BoundedTTLMap
+
+
+class TestBoundedTTLMap(TestCase):
+
+    def setUp(self):
+        self.now = 100
+        self.removed = []
+        self.map = BoundedTTLMap(
+            ttl_seconds=10, max_size=3, clock=lambda: self.now,
+            on_remove=lambda key, value: self.removed.append(key))
+
+    def add(self, key):
+        self.map.add(key, key.upper(), self.map.get_expires_at())
+
+    def test_purge_expired_should_remove_oldest_entries_only(self):
+        self.add('a')
+        self.now = 105
+        self.add('b')
+        self.now = 110
+        self.map.purge_expired()
+
+        self.assertListEqual(list(self.map.entries.items()), [('b', 'B')])
+        self.assertListEqual(self.removed, ['a'])
+        self.assertEqual(self.map.expired, 1)
+
+    def test_add_over_max_size_should_evict_oldest(self):
+        for key in ['a', 'b', 'c', 'd']:
+            self.add(key)
+
+        self.assertNotIn('a', self.map)
+        self.assertEqual(len(self.map), 3)
+        self.assertListEqual(self.removed, ['a'])
+        self.assertEqual(self.map.evicted, 1)
+
+    def test_add_existing_key_should_move_it_to_the_back(self):
+        self.add('a')
+        self.add('b')
+        self.now = 105
+        self.add('a')
+        self.now = 112
+        self.map.purge_expired()
+
+        self.assertListEqual(list(self.map.entries.keys()), ['a'])
+
+    def test_pop_should_not_call_on_remove(self):
+        self.add('a')
+        self.assertEqual(self.map.pop('a'), 'A')
+        self.assertIsNone(self.map.pop('a'))
+        self.assertListEqual(self.removed, [])
+        self.assertEqual(self.map.expiration_times, {})
+
+    def test_zero_ttl_should_never_expire(self):
+        ttl_map = BoundedTTLMap(ttl_seconds=0, max_size=3, clock=lambda: self.now)
+        ttl_map.add('a', 'A', ttl_map.get_expires_at())
+        self.now = 10000
+        ttl_map.purge_expired()
+        self.assertIn('a', ttl_map)